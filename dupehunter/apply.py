@@ -0,0 +1,397 @@
+"""
+Carry out the copy plan, remove duplicates whose copy is verified, or
+replace duplicates in place with links to their gold file.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from dupehunter.archives import is_member_path, open_file, split_member_path, stat_file
+from dupehunter.constants import (
+    PARTIAL_COPY_SUFFIX,
+    PENDING_LINK_SUFFIX,
+    READ_BUFFER_SIZE,
+)
+from dupehunter.database import (
+    REMOVE_FILE_SQL,
+    UPDATE_SIGNATURE_SQL,
+    DatabaseWriter,
+    Signature,
+    iter_delete_candidate_rows,
+    iter_link_candidates,
+)
+from dupehunter.files import calculate_checksum
+from dupehunter.metrics import NO_METRICS, Metrics
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import stat_signature
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# ioctl that makes the target share the source's extents (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+# Errors meaning a copy method is unsupported for this pair of files
+UNSUPPORTED_COPY_ERRORS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+}
+
+
+def _reflink(source_fd: int, target_fd: int) -> bool:
+    """Clone the source into the target, if the filesystem supports it."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file_range(source_fd: int, target_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(source_fd, target_fd, count, offset, offset)
+
+
+def _sendfile(source_fd: int, target_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+
+# Kernel-side copies, fastest first; each copies ``count`` bytes at ``offset``
+KERNEL_COPIES: Tuple[Tuple[str, Callable[[int, int, int, int], int]], ...] = tuple(
+    (name, copy)
+    for name, copy, available in (
+        ("copy_file_range", _copy_file_range, hasattr(os, "copy_file_range")),
+        ("sendfile", _sendfile, hasattr(os, "sendfile")),
+    )
+    if available
+)
+
+
+def copy_file(source: Path, target: Path) -> str:
+    """
+    Copy ``source`` to ``target`` through the fastest path available.
+
+    A reflink is tried first, then ``copy_file_range`` and ``sendfile``,
+    which copy inside the kernel, and finally a buffered read/write loop.
+
+    Returns:
+        str: The name of the method that copied the file.
+    """
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        source_fd, target_fd = src.fileno(), dst.fileno()
+        if _reflink(source_fd, target_fd):
+            return "reflink"
+        size = os.fstat(source_fd).st_size
+        for method, copy in KERNEL_COPIES:
+            try:
+                offset = 0
+                while offset < size:
+                    copied = copy(source_fd, target_fd, offset, size - offset)
+                    if not copied:
+                        break
+                    offset += copied
+                return method
+            except OSError as error:
+                if error.errno not in UNSUPPORTED_COPY_ERRORS:
+                    raise
+                os.ftruncate(target_fd, 0)
+                os.lseek(target_fd, 0, os.SEEK_SET)
+        shutil.copyfileobj(src, dst, READ_BUFFER_SIZE)
+        return "read_write"
+
+
+def _copy_member(source: str, target: Path) -> str:
+    """
+    Stream an archive member out to ``target``, giving it its archive's
+    timestamps.
+
+    Returns:
+        str: "extract", the name of this copy method.
+    """
+    with open_file(source) as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, READ_BUFFER_SIZE)
+    archive_stat = os.stat(split_member_path(source)[0])
+    os.utime(target, ns=(archive_stat.st_atime_ns, archive_stat.st_mtime_ns))
+    return "extract"
+
+
+def _already_copied(source: str, target: Path, checksum: bytes, algorithm: str) -> bool:
+    """
+    Whether ``target`` is the verified copy a previous run left behind.
+
+    A target whose size and modification time match the source is hashed
+    and compared with the catalogued ``checksum``: a file truncated and
+    touched since, or put there by something else, is copied again.
+    """
+    try:
+        source_stat = stat_file(source)
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        return False
+    if (
+        target_stat.st_size != source_stat.st_size
+        or target_stat.st_mtime_ns != source_stat.st_mtime_ns
+    ):
+        return False
+    return calculate_checksum(target, algorithm) == checksum.hex()
+
+
+def copy_verified(
+    source: str, target: str, checksum: bytes, file_size: int, algorithm: str
+) -> Tuple[str, int]:
+    """
+    Copy one file of the plan for a worker and verify the copy.
+
+    The copy is written next to the target under a temporary name, hashed
+    and compared with the catalogued ``checksum``, and only then renamed
+    into place with the source's timestamps, so an interrupted run can be
+    resumed by skipping targets whose size and modification time match the
+    source and whose checksum still matches the catalog.
+
+    Returns:
+        Tuple[str, int]: The copy method, "present" or "failed", and the
+        number of bytes copied.
+    """
+    target_path = Path(target)
+    partial = target_path.with_name(target_path.name + PARTIAL_COPY_SUFFIX)
+    try:
+        if _already_copied(source, target_path, checksum, algorithm):
+            return "present", 0
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        if is_member_path(source):
+            method = _copy_member(source, partial)
+        else:
+            method = copy_file(Path(source), partial)
+            shutil.copystat(source, partial)
+        if bytes.fromhex(calculate_checksum(partial, algorithm)) != checksum:
+            partial.unlink()
+            logging.error(f"Copy of {source} to {target} failed verification")
+            return "failed", 0
+        os.replace(partial, target_path)
+        return method, file_size
+    except OSError as error:
+        logging.error(f"Error copying {source} to {target}: {error}")
+        return "failed", 0
+
+
+async def apply_copy_plan(
+    plan: Iterable[Dict],
+    pool: WorkerPool,
+    algorithm: str,
+    metrics: Metrics = NO_METRICS,
+) -> Tuple[Dict[str, int], Set[bytes]]:
+    """
+    Copy every entry of a copy plan in ``pool``, verifying each copy.
+
+    Parameters:
+        plan (Iterable[Dict]): Entries from ``catalog.iter_files_to_copy``.
+        pool (WorkerPool): Pool running the copies.
+        algorithm (str): Algorithm the catalogued checksums were made with.
+
+    Returns:
+        Tuple[Dict[str, int], Set[bytes]]: Copy counts and bytes, and the
+        checksums of groups whose gold file could not be copied.
+    """
+    stats = {
+        "copied_files": 0,
+        "copied_bytes": 0,
+        "present_files": 0,
+        "failed_copies": 0,
+    }
+    failed_checksums: Set[bytes] = set()
+    items = (
+        (
+            entry["source"],
+            entry["target"],
+            entry["checksum"],
+            entry["file_size"],
+            algorithm,
+        )
+        for entry in plan
+    )
+    with metrics.stage("copy"):
+        async for args, (method, copied) in pool.map(copy_verified, items):
+            metrics.advance()
+            if method == "failed":
+                failed_checksums.add(args[2])
+                stats["failed_copies"] += 1
+            elif method == "present":
+                stats["present_files"] += 1
+            else:
+                stats["copied_files"] += 1
+                stats["copied_bytes"] += copied
+                metrics.increment(f"copied_with_{method}")
+                metrics.increment("bytes_copied", copied)
+    return stats, failed_checksums
+
+
+def remove_duplicate(
+    file_path: str,
+    signature: Signature,
+    action: str,
+    base_path: str,
+    quarantine_path: str,
+) -> bool:
+    """
+    Delete a duplicate, or move it below ``quarantine_path``, for a worker.
+
+    Files whose stat signature no longer matches the catalog have changed
+    since the scan and are left alone, as are duplicates inside archives.
+
+    Returns:
+        bool: Whether the file was removed.
+    """
+    if is_member_path(file_path):
+        logging.warning(f"Not removing {file_path}: it is inside an archive")
+        return False
+    try:
+        if stat_signature(os.stat(file_path, follow_symlinks=False)) != signature:
+            logging.warning(f"Not removing {file_path}: changed since the scan")
+            return False
+        if action == "delete":
+            os.unlink(file_path)
+        else:
+            destination = Path(quarantine_path) / Path(file_path).relative_to(base_path)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(file_path, destination)
+        return True
+    except (OSError, ValueError) as error:
+        logging.error(f"Error removing duplicate {file_path}: {error}")
+        return False
+
+
+async def remove_duplicates(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    action: str,
+    base_path: Path,
+    quarantine_path: Path,
+    failed_checksums: Set[bytes],
+    metrics: Metrics = NO_METRICS,
+) -> Dict[str, int]:
+    """
+    Delete or quarantine every delete candidate whose gold copy is verified.
+
+    Candidates in a group whose gold file failed to copy are kept. Removed
+    files are dropped from the catalog.
+
+    Returns:
+        Dict[str, int]: Counts of removed, kept and failed duplicates.
+    """
+    stats = {"removed_files": 0, "kept_files": 0, "failed_removals": 0}
+
+    def candidates() -> Iterable[Tuple]:
+        for file_path, checksum, signature in iter_delete_candidate_rows(db_path):
+            if checksum in failed_checksums:
+                stats["kept_files"] += 1
+                continue
+            yield file_path, signature, action, str(base_path), str(quarantine_path)
+
+    with metrics.stage(action):
+        async for args, removed in pool.map(remove_duplicate, candidates()):
+            metrics.advance()
+            if removed:
+                writer.write(REMOVE_FILE_SQL, (args[0],))
+                stats["removed_files"] += 1
+            else:
+                stats["failed_removals"] += 1
+        writer.flush()
+    return stats
+
+
+def link_duplicate(
+    file_path: str,
+    signature: Signature,
+    gold_path: str,
+    gold_signature: Signature,
+    action: str,
+) -> Optional[Signature]:
+    """
+    Replace a duplicate with a hardlink or reflink of its gold file, for a
+    worker.
+
+    The link is created under a temporary name and renamed over the
+    duplicate, so the path always holds either the old or the new file.
+    Files whose stat signature no longer matches the catalog have changed
+    since the scan and are left alone, as are duplicates inside archives and
+    duplicates of a file inside one. A reflink keeps the duplicate's own
+    permissions and timestamps.
+
+    Returns:
+        Optional[Signature]: The new signature of ``file_path``, or None if
+        it was not replaced.
+    """
+    if is_member_path(file_path) or is_member_path(gold_path):
+        logging.warning(
+            f"Not linking {file_path} to {gold_path}: archive members cannot be "
+            "linked"
+        )
+        return None
+    path = Path(file_path)
+    temporary = path.with_name(path.name + PENDING_LINK_SUFFIX)
+    try:
+        if stat_signature(os.stat(file_path, follow_symlinks=False)) != signature:
+            logging.warning(f"Not linking {file_path}: changed since the scan")
+            return None
+        if stat_signature(os.stat(gold_path)) != gold_signature:
+            logging.warning(f"Not linking {file_path}: {gold_path} changed")
+            return None
+        temporary.unlink(missing_ok=True)
+        if action == "hardlink":
+            os.link(gold_path, temporary)
+        else:
+            with open(gold_path, "rb") as src, open(temporary, "wb") as dst:
+                if not _reflink(src.fileno(), dst.fileno()):
+                    raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported")
+            shutil.copystat(file_path, temporary)
+        os.replace(temporary, file_path)
+        return stat_signature(os.stat(file_path))
+    except OSError as error:
+        logging.error(f"Error linking {file_path} to {gold_path}: {error}")
+        temporary.unlink(missing_ok=True)
+        return None
+
+
+async def link_duplicates(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    action: str,
+    metrics: Metrics = NO_METRICS,
+) -> Dict[str, int]:
+    """
+    Replace every duplicate in place with a hardlink or reflink of its gold
+    file, without copying anything to the target path.
+
+    Duplicates that already share the gold file's inode are skipped. The
+    catalog keeps the checksums of linked files and records their new
+    signatures, so the next scan sees them as unchanged.
+
+    Returns:
+        Dict[str, int]: Counts of linked and failed duplicates, and the
+        bytes the links freed.
+    """
+    stats = {"linked_files": 0, "linked_bytes": 0, "failed_links": 0}
+    items = (row + (action,) for row in iter_link_candidates(db_path))
+    with metrics.stage(action):
+        async for args, signature in pool.map(link_duplicate, items):
+            metrics.advance()
+            if signature is None:
+                stats["failed_links"] += 1
+                continue
+            writer.write(UPDATE_SIGNATURE_SQL, signature + (args[0],))
+            stats["linked_files"] += 1
+            stats["linked_bytes"] += signature[2]
+        writer.flush()
+    return stats
@@ -0,0 +1,228 @@
+"""
+Images inside zip and tar archives, read as files of their own.
+
+A member is catalogued under a composite path, the archive's path and the
+member's name joined by ``!/``, e.g. ``/photos/2009.zip!/rome/img_01.jpg``,
+with the member's own size. Members are streamed from their archive and
+never extracted. Compressed tarballs are not scanned: reading one member
+would mean decompressing every member stored before it.
+"""
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import posixpath
+import stat
+import tarfile
+import zipfile
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from dupehunter.constants import (
+    ARCHIVE_CACHE_SIZE,
+    ARCHIVE_EXTENSIONS,
+    ARCHIVE_SEPARATOR,
+    SUPPORTED_EXTENSIONS,
+)
+from dupehunter.utils import is_storable_path
+
+
+def is_archive(name: str) -> bool:
+    """Return True if ``name`` has the extension of a scannable archive."""
+    return os.path.splitext(name)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def split_member_path(file_path: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a composite path into its archive's path and the member's name.
+
+    Returns:
+        Optional[Tuple[str, str]]: ``(archive_path, member_name)``, or None
+        if ``file_path`` is an ordinary path.
+    """
+    file_path = str(file_path)
+    index = file_path.find(ARCHIVE_SEPARATOR)
+    while index >= 0:
+        if is_archive(file_path[:index]):
+            return file_path[:index], file_path[index + len(ARCHIVE_SEPARATOR) :]
+        index = file_path.find(ARCHIVE_SEPARATOR, index + 1)
+    return None
+
+
+def is_member_path(file_path: str) -> bool:
+    """Return True if ``file_path`` names a member inside an archive."""
+    return split_member_path(file_path) is not None
+
+
+def member_inode(file_path: str) -> int:
+    """
+    Return a stable inode number for an archive member.
+
+    Members share the inode of their archive, so each gets a number of its
+    own instead, derived from its path. It is negative, so it never equals
+    the inode of a real file.
+    """
+    digest = hashlib.blake2b(file_path.encode(), digest_size=8).digest()
+    return -1 - (int.from_bytes(digest, "big") >> 2)
+
+
+class _TarMember(io.RawIOBase):
+    """One member of an uncompressed tar archive, read from its own handle."""
+
+    def __init__(self, archive_path: str, offset: int, size: int):
+        self._file = open(archive_path, "rb", buffering=0)
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), self._size - self._position))
+        if not count:
+            return 0
+        self._file.seek(self._offset + self._position)
+        read = self._file.readinto(memoryview(buffer)[:count])
+        self._position += read
+        return read
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._position, os.SEEK_END: self._size}
+        self._position = max(0, base[whence] + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class _Archive:
+    """The regular members of an archive, with their sizes, ready to open."""
+
+    def __init__(self, archive_path: str):
+        self.path = archive_path
+        self._zip_file: Optional[zipfile.ZipFile] = None
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        if archive_path.lower().endswith(".zip"):
+            self._zip_file = zipfile.ZipFile(archive_path)
+            self.sizes = {
+                info.filename: info.file_size
+                for info in self._zip_file.infolist()
+                if not info.is_dir()
+            }
+            return
+        with tarfile.open(archive_path, "r:") as tar:
+            self._offsets = {
+                member.name: (member.offset_data, member.size)
+                for member in tar
+                if member.isreg() and not member.issparse()
+            }
+        self.sizes = {name: size for name, (_, size) in self._offsets.items()}
+
+    def open(self, name: str) -> BinaryIO:
+        """Open a member for reading; each call gets a handle of its own."""
+        if self._zip_file is not None:
+            return self._zip_file.open(name)
+        offset, size = self._offsets[name]
+        return io.BufferedReader(_TarMember(self.path, offset, size))
+
+
+@functools.lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def _load_archive(archive_path: str, mtime_ns: int, size: int) -> _Archive:
+    """Read an archive's member list once per version of the archive."""
+    return _Archive(archive_path)
+
+
+def _archive(archive_path: str, stat_result: os.stat_result) -> _Archive:
+    return _load_archive(archive_path, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def _member_stat(
+    file_path: str, size: int, archive_stat: os.stat_result
+) -> os.stat_result:
+    """
+    Build the stat result of a member: its own size and inode number, and
+    the device, owner and timestamps of its archive.
+    """
+    fields = list(archive_stat[:10]) + [
+        archive_stat.st_atime,
+        archive_stat.st_mtime,
+        archive_stat.st_ctime,
+        archive_stat.st_atime_ns,
+        archive_stat.st_mtime_ns,
+        archive_stat.st_ctime_ns,
+    ]
+    fields[stat.ST_MODE] = stat.S_IFREG | 0o444
+    fields[stat.ST_INO] = member_inode(file_path)
+    fields[stat.ST_NLINK] = 1
+    fields[stat.ST_SIZE] = size
+    return os.stat_result(fields)
+
+
+def iter_archive_members(
+    archive_path: str, archive_stat: os.stat_result
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yield the supported image files inside an archive, in path order.
+
+    Members whose names are absolute, not normalised, not valid UTF-8 or
+    reach outside the archive with ``..`` are skipped. An unreadable
+    archive yields nothing.
+
+    Yields:
+        Tuple[str, os.stat_result]: The composite path and stat result of
+        each member, as ``processing.walk_files`` yields files.
+    """
+    try:
+        sizes = _archive(archive_path, archive_stat).sizes
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as error:
+        logging.warning(f"Cannot read archive {archive_path}: {error}")
+        return
+    for name in sorted(sizes):
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+            continue
+        if (
+            name.startswith("/")
+            or posixpath.normpath(name) != name
+            or ".." in name.split("/")
+            or not is_storable_path(name)
+        ):
+            logging.warning(f"Skipping {ascii(name)} in {archive_path}: unusable name")
+            continue
+        file_path = archive_path + ARCHIVE_SEPARATOR + name
+        yield file_path, _member_stat(file_path, sizes[name], archive_stat)
+
+
+def open_file(file_path: str) -> BinaryIO:
+    """Open a file, or an archive member by its composite path, for reading."""
+    member = split_member_path(file_path)
+    if member is None:
+        return open(file_path, "rb")
+    archive_path, name = member
+    try:
+        archive = _archive(archive_path, os.stat(archive_path))
+        return archive.open(name)
+    except (KeyError, zipfile.BadZipFile, tarfile.TarError) as error:
+        raise OSError(f"Cannot read {name} in {archive_path}: {error}") from error
+
+
+def stat_file(file_path: str) -> os.stat_result:
+    """Return the status of a file, or of an archive member by its composite path."""
+    member = split_member_path(file_path)
+    if member is None:
+        return os.stat(file_path)
+    archive_path, name = member
+    archive_stat = os.stat(archive_path)
+    try:
+        size = _archive(archive_path, archive_stat).sizes[name]
+    except (KeyError, zipfile.BadZipFile, tarfile.TarError) as error:
+        raise OSError(f"Cannot read {name} in {archive_path}: {error}") from error
+    return _member_stat(file_path, size, archive_stat)
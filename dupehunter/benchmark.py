@@ -0,0 +1,331 @@
+"""
+Throughput benchmarks on synthetic image corpora.
+
+Usage:
+    python -m dupehunter.benchmark run --files 5000 --output new.json
+    python -m dupehunter.benchmark compare old.json new.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from PIL import Image
+
+from dupehunter.catalog import iter_duplicate_summaries, iter_files_to_copy
+from dupehunter.constants import (
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_POOL_KIND,
+    DEFAULT_WORKERS,
+    POOL_KINDS,
+)
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_duplicate_groups,
+    iter_file_records,
+    iter_gold_files,
+)
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import catalog_changes, hash_candidates, walk_files
+from dupehunter.reports import write_delete_candidates, write_files_to_copy
+
+SIZE_DISTRIBUTIONS = ("uniform", "lognormal")
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def _jpeg_bytes(rng: random.Random, size: int, with_exif: bool) -> bytes:
+    """Build a JPEG-framed file of ``size`` bytes with random payload."""
+    header = b"\xff\xd8"
+    if with_exif:
+        exif = Image.Exif()
+        exif[272] = f"Camera {rng.randrange(20)}"
+        exif.get_ifd(0x8769)[36867] = f"20{rng.randrange(10, 24)}:01:01 12:00:00"
+        segment = b"Exif\x00\x00" + exif.tobytes()
+        header += b"\xff\xe1" + (len(segment) + 2).to_bytes(2, "big") + segment
+    payload = max(size - len(header) - 2, 0)
+    return header + rng.randbytes(payload) + b"\xff\xd9"
+
+
+def _file_size(
+    rng: random.Random, distribution: str, min_size: int, max_size: int
+) -> int:
+    """Draw a file size from the configured distribution."""
+    if distribution == "lognormal":
+        median = (min_size * max_size) ** 0.5
+        size = int(rng.lognormvariate(0, 1) * median)
+        return min(max(size, min_size), max_size)
+    return rng.randint(min_size, max_size)
+
+
+def generate_corpus(
+    root: Path,
+    files: int,
+    duplicate_ratio: float = 0.2,
+    depth: int = 3,
+    exif_density: float = 0.5,
+    min_size: int = 16 * 1024,
+    max_size: int = 512 * 1024,
+    distribution: str = "lognormal",
+    seed: int = 0,
+) -> Dict:
+    """
+    Generate a reproducible corpus of synthetic JPEG files.
+
+    Parameters:
+        root (Path): Directory to create the corpus in.
+        files (int): Number of files to create.
+        duplicate_ratio (float): Fraction of files that copy an earlier file.
+        depth (int): Number of directory levels below ``root``.
+        exif_density (float): Fraction of unique files with an EXIF segment.
+        min_size (int): Smallest file size in bytes.
+        max_size (int): Largest file size in bytes.
+        distribution (str): Size distribution, "uniform" or "lognormal".
+        seed (int): Random seed; equal parameters give identical corpora.
+
+    Returns:
+        Dict: The parameters together with the file and byte totals.
+    """
+    if distribution not in SIZE_DISTRIBUTIONS:
+        raise ValueError(f"Unknown size distribution: {distribution}")
+    rng = random.Random(seed)
+    originals: List[Path] = []
+    total_bytes = 0
+    for index in range(files):
+        parts = [f"d{rng.randrange(4)}" for _ in range(depth)]
+        file_path = root.joinpath(*parts, f"img_{index:07d}.jpg")
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if originals and rng.random() < duplicate_ratio:
+            data = rng.choice(originals).read_bytes()
+        else:
+            size = _file_size(rng, distribution, min_size, max_size)
+            data = _jpeg_bytes(rng, size, rng.random() < exif_density)
+            originals.append(file_path)
+        file_path.write_bytes(data)
+        total_bytes += len(data)
+    return {
+        "files": files,
+        "bytes": total_bytes,
+        "duplicate_ratio": duplicate_ratio,
+        "depth": depth,
+        "exif_density": exif_density,
+        "min_size": min_size,
+        "max_size": max_size,
+        "distribution": distribution,
+        "seed": seed,
+    }
+
+
+def _peak_rss_kb() -> int:
+    """Return the peak resident set size of this process in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+@contextmanager
+def _stage(results: Dict, name: str, files: int, size: int) -> Iterator[Dict]:
+    """Time a stage and record its throughput; the body may update counts."""
+    counts = {"files": files, "bytes": size}
+    start = time.perf_counter()
+    yield counts
+    seconds = time.perf_counter() - start
+    results[name] = {
+        "files": counts["files"],
+        "bytes": counts["bytes"],
+        "seconds": seconds,
+        "files_per_sec": counts["files"] / seconds if seconds else 0.0,
+        "mb_per_sec": counts["bytes"] / 1024 / 1024 / seconds if seconds else 0.0,
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+async def run_benchmark(
+    corpus: Path,
+    work_dir: Path,
+    workers: int = DEFAULT_WORKERS,
+    pool_kind: str = DEFAULT_POOL_KIND,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+) -> Dict[str, Dict]:
+    """
+    Run every pipeline stage over ``corpus`` and measure it.
+
+    Stages run in order on a fresh catalog in ``work_dir``: traverse (the
+    scandir walk), ingest (catalog rows through the writer), hash (size,
+    partial and full stages), find_duplicates (one-pass grouping within a
+    memory budget) and report (writing the copy and delete lists).
+
+    Returns:
+        Dict[str, Dict]: Per-stage files, bytes, seconds, files/sec, MB/sec
+        and peak RSS.
+    """
+    db_path = work_dir / "benchmark.db"
+    initialize_database(db_path)
+    results: Dict[str, Dict] = {}
+
+    with _stage(results, "traverse", 0, 0) as counts:
+        walked = list(walk_files(corpus.resolve()))
+        counts["files"] = len(walked)
+        counts["bytes"] = sum(stat_result.st_size for _, stat_result in walked)
+    files, size = counts["files"], counts["bytes"]
+
+    with WorkerPool(pool_kind, workers) as pool, DatabaseWriter(db_path) as writer:
+        with _stage(results, "ingest", files, size):
+            catalog_changes(walked, [], writer)
+            writer.flush()
+        with _stage(results, "hash", files, size) as counts:
+            stats = await hash_candidates(db_path, pool, writer, algorithm)
+            counts["bytes"] = (
+                size - stats["size_skipped_bytes"] - stats["partial_skipped_bytes"]
+            )
+
+    with _stage(results, "find_duplicates", files, 0) as counts:
+        counts["bytes"] = sum(
+            group.gold["file_size"]
+            + sum(file["file_size"] for file in group.duplicates)
+            for group in iter_duplicate_summaries(
+                iter_file_records(db_path), temp_dir=work_dir
+            )
+        )
+
+    with _stage(results, "report", files, 0) as counts:
+        write_files_to_copy(
+            iter_files_to_copy(
+                iter_gold_files(db_path), work_dir / "target", corpus.resolve()
+            ),
+            work_dir / "files_to_copy.txt",
+        )
+        write_delete_candidates(
+            iter_duplicate_groups(db_path), work_dir / "delete_candidates.txt"
+        )
+        counts["bytes"] = sum(
+            (work_dir / name).stat().st_size
+            for name in ("files_to_copy.txt", "delete_candidates.txt")
+        )
+    return results
+
+
+def compare_results(
+    baseline: Dict, candidate: Dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD
+) -> List[Dict]:
+    """
+    Compare the stage throughput of two benchmark result files.
+
+    Returns:
+        List[Dict]: One entry per stage present in both results, with the
+        relative change in files/sec and whether it is a regression beyond
+        ``threshold``.
+    """
+    rows = []
+    for name, before in baseline["stages"].items():
+        after = candidate["stages"].get(name)
+        if after is None:
+            continue
+        old, new = before["files_per_sec"], after["files_per_sec"]
+        change = (new - old) / old if old else 0.0
+        rows.append(
+            {
+                "stage": name,
+                "baseline_files_per_sec": old,
+                "candidate_files_per_sec": new,
+                "change": change,
+                "regression": change < -threshold,
+            }
+        )
+    return rows
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+    """Parse command-line arguments for the benchmark runner."""
+    parser = argparse.ArgumentParser(description="DupeHunter throughput benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Generate a corpus and benchmark it")
+    run.add_argument("--output", type=Path, required=True, help="Result JSON file")
+    run.add_argument("--files", type=int, default=2000)
+    run.add_argument("--duplicate-ratio", type=float, default=0.2)
+    run.add_argument("--depth", type=int, default=3)
+    run.add_argument("--exif-density", type=float, default=0.5)
+    run.add_argument("--min-size", type=int, default=16 * 1024)
+    run.add_argument("--max-size", type=int, default=512 * 1024)
+    run.add_argument("--distribution", choices=SIZE_DISTRIBUTIONS, default="lognormal")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    run.add_argument("--pool", choices=POOL_KINDS, default=DEFAULT_POOL_KIND)
+    run.add_argument("--hash-algorithm", default=DEFAULT_HASH_ALGORITHM)
+    run.add_argument(
+        "--corpus", type=Path, help="Keep the generated corpus in this directory"
+    )
+
+    compare = commands.add_parser("compare", help="Diff two result files")
+    compare.add_argument("baseline", type=Path)
+    compare.add_argument("candidate", type=Path)
+    compare.add_argument(
+        "--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    """Run the benchmark CLI and return its exit code."""
+    args = parse_arguments(argv)
+    if args.command == "compare":
+        rows = compare_results(
+            json.loads(args.baseline.read_text()),
+            json.loads(args.candidate.read_text()),
+            args.threshold,
+        )
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(
+                f"{row['stage']:<16} {row['baseline_files_per_sec']:>12.1f} -> "
+                f"{row['candidate_files_per_sec']:>12.1f} files/s "
+                f"({row['change']:+.1%}){flag}"
+            )
+        return 1 if any(row["regression"] for row in rows) else 0
+
+    with tempfile.TemporaryDirectory() as work:
+        work_dir = Path(work)
+        corpus_dir = args.corpus or work_dir / "corpus"
+        corpus = generate_corpus(
+            corpus_dir,
+            args.files,
+            args.duplicate_ratio,
+            args.depth,
+            args.exif_density,
+            args.min_size,
+            args.max_size,
+            args.distribution,
+            args.seed,
+        )
+        stages = asyncio.run(
+            run_benchmark(
+                corpus_dir, work_dir, args.workers, args.pool, args.hash_algorithm
+            )
+        )
+    results = {
+        "corpus": corpus,
+        "settings": {
+            "workers": args.workers,
+            "pool": args.pool,
+            "hash_algorithm": args.hash_algorithm,
+        },
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "stages": stages,
+    }
+    args.output.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,49 +1,374 @@
+import heapq
+import os
+import pickle
+import tempfile
+from array import array
 from collections import defaultdict
+from collections.abc import Sequence
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
+from dupehunter.constants import DEFAULT_GROUPING_MEMORY, GROUPING_SPILL_BATCH
 
-def find_duplicates(catalog: List[Dict]) -> Tuple[Dict, Dict]:
-    """Find duplicate files based on checksum."""
+# Stands for NULL in the unsigned size column of a Catalog, and in its
+# signed device and inode columns, which hold negative archive member inodes
+_NULL = 2**64 - 1
+_NULL_INODE = -(2**63)
+# Estimated bytes a buffered entry costs besides its strings (path,
+# checksums, metadata, EXIF fields and shard), including its gold rank
+_BUFFERED_ENTRY_OVERHEAD = 500
+
+
+class FileRecord:
+    """
+    One catalogued file, read like the dict it replaces, e.g.
+    ``record["file_path"]`` or ``dict(record)``, but held in slots.
+    """
+
+    __slots__ = (
+        "file_path",
+        "checksum",
+        "metadata",
+        "file_size",
+        "st_dev",
+        "st_ino",
+        "shard",
+        "content_checksum",
+        "exif_datetime_original",
+        "exif_camera_model",
+    )
+
+    def __init__(
+        self,
+        file_path: str,
+        checksum: Optional[bytes],
+        metadata: Optional[str],
+        file_size: int,
+        st_dev: Optional[int] = None,
+        st_ino: Optional[int] = None,
+        shard: Optional[str] = None,
+        content_checksum: Optional[bytes] = None,
+        exif_datetime_original: Optional[str] = None,
+        exif_camera_model: Optional[str] = None,
+    ):
+        self.file_path = file_path
+        self.checksum = checksum
+        self.metadata = metadata
+        self.file_size = file_size
+        self.st_dev = st_dev
+        self.st_ino = st_ino
+        self.shard = shard
+        self.content_checksum = content_checksum
+        self.exif_datetime_original = exif_datetime_original
+        self.exif_camera_model = exif_camera_model
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FileRecord):
+            return NotImplemented
+        return all(self[key] == other[key] for key in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"FileRecord({self.file_path!r}, {self.checksum!r})"
+
+
+class Catalog(Sequence):
+    """
+    An in-memory catalog stored column by column.
+
+    Sizes and inode numbers live in ``array`` columns, directories and
+    shard ids are stored once and referenced by index, and checksums are
+    raw digests, so a row costs its file name and digest plus a few dozen
+    bytes instead of a dict of strings. Indexing builds a FileRecord.
+    """
+
+    def __init__(self, rows: Iterable[Tuple] = ()):
+        self._strings: List[Optional[str]] = []
+        self._string_ids: Dict[Optional[str], int] = {}
+        self._directory = array("I")
+        self._name: List[str] = []
+        self._checksum: List[Optional[bytes]] = []
+        self._content_checksum: List[Optional[bytes]] = []
+        self._metadata: List[Optional[str]] = []
+        self._file_size = array("Q")
+        self._st_dev = array("q")
+        self._st_ino = array("q")
+        self._shard = array("I")
+        self._exif_datetime_original: List[Optional[str]] = []
+        self._exif_camera_model = array("I")
+        for row in rows:
+            self.append(*row)
+
+    def _intern(self, value: Optional[str]) -> int:
+        index = self._string_ids.get(value)
+        if index is None:
+            index = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def append(
+        self,
+        file_path: str,
+        checksum: Optional[bytes],
+        metadata: Optional[str],
+        file_size: Optional[int],
+        st_dev: Optional[int] = None,
+        st_ino: Optional[int] = None,
+        shard: Optional[str] = None,
+        content_checksum: Optional[bytes] = None,
+        exif_datetime_original: Optional[str] = None,
+        exif_camera_model: Optional[str] = None,
+    ) -> None:
+        """Add a row in ``load_catalog`` column order."""
+        split = file_path.rfind(os.sep) + 1
+        self._directory.append(self._intern(file_path[:split]))
+        self._name.append(file_path[split:])
+        self._checksum.append(checksum)
+        self._metadata.append(metadata)
+        self._file_size.append(_NULL if file_size is None else file_size)
+        self._st_dev.append(_NULL_INODE if st_dev is None else st_dev)
+        self._st_ino.append(_NULL_INODE if st_ino is None else st_ino)
+        self._shard.append(self._intern(shard))
+        self._content_checksum.append(content_checksum)
+        self._exif_datetime_original.append(exif_datetime_original)
+        self._exif_camera_model.append(self._intern(exif_camera_model))
+
+    def __len__(self) -> int:
+        return len(self._name)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        file_size = self._file_size[index]
+        st_dev, st_ino = (
+            None if value == _NULL_INODE else value
+            for value in (self._st_dev[index], self._st_ino[index])
+        )
+        return FileRecord(
+            self._strings[self._directory[index]] + self._name[index],
+            self._checksum[index],
+            self._metadata[index],
+            None if file_size == _NULL else file_size,
+            st_dev,
+            st_ino,
+            self._strings[self._shard[index]],
+            self._content_checksum[index],
+            self._exif_datetime_original[index],
+            self._strings[self._exif_camera_model[index]],
+        )
+
+
+def _gold_order(file: Dict, position: int) -> Tuple:
+    """
+    Rank a file for gold-copy selection as ``database.GOLD_ORDER_SQL`` does:
+    the earliest EXIF DateTimeOriginal, then a file whose EXIF still names
+    its camera, then ``position``, the file's place in catalog order.
+    """
+    taken = file.get("exif_datetime_original")
+    return (
+        taken is None,
+        taken or "",
+        file.get("exif_camera_model") is None,
+        position,
+    )
+
+
+def find_duplicates(catalog: List[Dict], key: str = "checksum") -> Tuple[Dict, Dict]:
+    """
+    Find duplicate files based on checksum.
+
+    Files without a checksum were skipped by the hashing stages because
+    they cannot have a duplicate, and are left out of the result. With
+    ``key="content_checksum"``, images are grouped on their content so
+    copies differing only in metadata are duplicates too. The gold copy of
+    each group is the first of its files in ``_gold_order``. Groups of a
+    single inode, hardlinks of one file, have no gold copy.
+    """
     duplicates = defaultdict(list)
-    for file in catalog:
-        duplicates[file["checksum"]].append(file)
+    ranks = {}
+    for position, file in enumerate(catalog):
+        checksum = file.get(key)
+        if not checksum:
+            continue
+        duplicates[checksum].append(file)
+        rank = _gold_order(file, position)
+        if checksum not in ranks or rank < ranks[checksum][0]:
+            ranks[checksum] = (rank, file)
 
     gold_files = {
-        checksum: files[0] for checksum, files in duplicates.items() if len(files) > 1
+        checksum: ranks[checksum][1]
+        for checksum, files in duplicates.items()
+        if len({_inode(file) for file in files}) > 1
     }
     return gold_files, duplicates
 
 
+def iter_files_to_copy(
+    gold_files: Iterable[Dict], target_path: Path, base_path: Path
+) -> Iterator[Dict]:
+    """
+    Yield the copy plan entry of each gold file as it arrives.
+
+    Entries hold the ``source`` and ``target`` paths, with the target at the
+    same path relative to ``target_path`` as the source has to ``base_path``,
+    and the catalogued ``checksum`` and ``file_size`` to verify the copy by.
+    """
+    for file in gold_files:
+        relative_path = Path(file["file_path"]).relative_to(base_path)
+        target_file_path = target_path / relative_path
+        yield {
+            "source": file["file_path"],
+            "target": str(target_file_path),
+            "checksum": file["checksum"],
+            "file_size": file["file_size"],
+        }
+
+
 def list_files_to_copy(
     gold_files: Dict, target_path: Path, base_path: Path
 ) -> List[Dict]:
     """Generate a list of files to copy with their source and target paths."""
-    files_to_copy = []
-    for file in gold_files.values():
-        relative_path = Path(file["file_path"]).relative_to(base_path)
-        target_file_path = target_path / relative_path
-        files_to_copy.append(
-            {"source": file["file_path"], "target": str(target_file_path)}
-        )
-    return files_to_copy
+    return list(iter_files_to_copy(gold_files.values(), target_path, base_path))
 
 
 def generate_delete_candidates(duplicates: Dict, gold_files: Dict) -> List[str]:
-    """Generate a list of files to delete."""
+    """Generate a list of files to delete, leaving out hardlinks of gold files."""
     candidates = []
-    for checksum, files in duplicates.items():
-        for file in files:
-            if file != gold_files.get(checksum):
+    for checksum, gold in gold_files.items():
+        for file in duplicates[checksum]:
+            if _inode(file) != _inode(gold):
                 candidates.append(file["file_path"])
     return candidates
 
 
+def _inode(file: Dict) -> Tuple:
+    """Identify the inode of a catalog entry, or its path if it is unknown."""
+    if file.get("st_ino") is None:
+        return (file["file_path"],)
+    return file.get("shard"), file["st_dev"], file["st_ino"]
+
+
 def calculate_storage_savings(duplicates: Dict, gold_files: Dict) -> int:
-    """Calculate potential storage savings."""
+    """
+    Calculate potential storage savings.
+
+    Each inode is counted once, and hardlinks of the gold file not at all,
+    as deleting them frees no space.
+    """
     return sum(
-        int(file["file_size"])
-        for checksum, files in duplicates.items()
-        for file in files
-        if file != gold_files.get(checksum)
+        _group_savings(gold, duplicates[checksum])
+        for checksum, gold in gold_files.items()
     )
+
+
+def _group_savings(gold: Dict, files: Iterable[Dict]) -> int:
+    """Count the bytes deleting ``files`` frees, keeping ``gold``."""
+    counted = {_inode(gold)}
+    savings = 0
+    for file in files:
+        inode = _inode(file)
+        if inode not in counted:
+            counted.add(inode)
+            savings += int(file["file_size"])
+    return savings
+
+
+class DuplicateGroup(NamedTuple):
+    """A duplicate group with its gold copy and the bytes deleting the rest frees."""
+
+    checksum: Any
+    gold: FileRecord
+    duplicates: List[FileRecord]
+    savings: int
+
+
+def _spill(run: List[Tuple], temp_dir: Optional[Path]) -> IO[bytes]:
+    """Sort a run and write it to a temporary file, in batches of entries."""
+    run.sort()
+    spill_file = tempfile.TemporaryFile(dir=temp_dir)
+    for start in range(0, len(run), GROUPING_SPILL_BATCH):
+        pickle.dump(
+            run[start : start + GROUPING_SPILL_BATCH],
+            spill_file,
+            pickle.HIGHEST_PROTOCOL,
+        )
+    spill_file.seek(0)
+    return spill_file
+
+
+def _read_run(spill_file: IO[bytes]) -> Iterator[Tuple]:
+    while True:
+        try:
+            yield from pickle.load(spill_file)
+        except EOFError:
+            return
+
+
+def iter_duplicate_summaries(
+    files: Iterable[Dict],
+    key: str = "checksum",
+    memory_budget: int = DEFAULT_GROUPING_MEMORY,
+    temp_dir: Optional[Path] = None,
+) -> Iterator[DuplicateGroup]:
+    """
+    Group a catalog on ``key`` in one pass, within a fixed memory budget.
+
+    Entries are buffered until about ``memory_budget`` bytes are used, then
+    sorted by checksum and gold rank and spilled to a temporary file in
+    ``temp_dir``. The sorted runs are merged, so only one group is held in
+    memory at a time, and each group is yielded with its gold copy, the
+    first of its files in ``_gold_order`` as with ``find_duplicates``, its
+    delete candidates, which leave out hardlinks of the gold copy, and its
+    storage savings as ``calculate_storage_savings`` counts them.
+
+    Parameters:
+        files (Iterable[Dict]): Catalog entries in catalog order, as
+            ``database.iter_file_records`` streams them.
+        key (str): The checksum field to group on.
+        memory_budget (int): Bytes of entries to buffer before spilling.
+        temp_dir (Optional[Path]): Where runs are spilled (default: the
+            system temporary directory).
+
+    Yields:
+        DuplicateGroup: Each group of more than one file, by checksum.
+    """
+    runs: List[IO[bytes]] = []
+    run: List[Tuple] = []
+    buffered = 0
+    try:
+        for position, file in enumerate(files):
+            checksum = file.get(key)
+            if not checksum:
+                continue
+            row = tuple(file.get(field) for field in FileRecord.__slots__)
+            run.append((checksum, _gold_order(file, position), row))
+            buffered += _BUFFERED_ENTRY_OVERHEAD + sum(
+                len(value) for value in row if isinstance(value, (str, bytes))
+            )
+            if buffered >= memory_budget:
+                runs.append(_spill(run, temp_dir))
+                run = []
+                buffered = 0
+        run.sort()
+        entries = heapq.merge(run, *(_read_run(spill_file) for spill_file in runs))
+        for checksum, group in groupby(entries, key=itemgetter(0)):
+            gold, *files = (FileRecord(*row) for _, _, row in group)
+            duplicates = [file for file in files if _inode(file) != _inode(gold)]
+            if duplicates:
+                savings = _group_savings(gold, duplicates)
+                yield DuplicateGroup(checksum, gold, duplicates, savings)
+    finally:
+        for spill_file in runs:
+            spill_file.close()
@@ -0,0 +1,198 @@
+"""
+Check which files of a new directory an existing catalog already holds,
+in time proportional to the new directory alone.
+
+Usage:
+    python -m dupehunter.check --db-path archive.db /incoming/camera-dump
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dupehunter.constants import (
+    DEFAULT_DB_PATH,
+    DEFAULT_LOG_LEVEL,
+    DEFAULT_POOL_KIND,
+    DEFAULT_WORKERS,
+    POOL_KINDS,
+)
+from dupehunter.database import UPDATE_CHECKSUM_SQL, DatabaseWriter, connect
+from dupehunter.index import (
+    CatalogIndex,
+    catalog_signature,
+    default_index_path,
+    open_index,
+    update_index,
+)
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import hash_file, walk_files
+from dupehunter.utils import configure_logging
+
+# One catalogued path per unhashed inode of a size
+UNHASHED_OF_SIZE_SQL = """
+    SELECT MIN(file_path), file_size FROM file_info
+    WHERE checksum IS NULL AND file_size = ?
+    GROUP BY st_dev, st_ino
+"""
+
+
+async def check_files(
+    base_path: Path, db_path: Path, index: CatalogIndex, pool: WorkerPool
+) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    Look up every image file below ``base_path`` in a catalog.
+
+    Files of a size the catalog does not have are new without being read.
+    The others are hashed in ``pool``, and a checksum the index's Bloom
+    filter rejects is new without a SQLite query. Only files the filter
+    may contain are looked up in the catalog. Catalogued files that were
+    never hashed are read only if an incoming file has their size, and
+    their checksums are stored in the catalog and added to the index, so
+    later checks find them without reading them or rebuilding the index.
+
+    Yields:
+        Tuple[str, Optional[str]]: Each incoming file with a catalogued file
+        of the same content, or None if it is new.
+    """
+    candidates = []
+    for file_path, stat_result in walk_files(base_path.resolve()):
+        if index.has_size(stat_result.st_size):
+            candidates.append((file_path, stat_result.st_size, index.algorithm))
+        else:
+            yield file_path, None
+    if not candidates:
+        return
+
+    unresolved: List[Tuple[bytes, str, int]] = []
+    conn = connect(db_path)
+    try:
+        async for _, (checksum, file_path, file_size) in pool.map(
+            hash_file, candidates
+        ):
+            if not checksum:
+                continue
+            match = None
+            if index.may_contain(checksum):
+                row = conn.execute(
+                    "SELECT file_path FROM file_info WHERE checksum = ? LIMIT 1",
+                    (checksum,),
+                ).fetchone()
+                match = row[0] if row else None
+            if match is None and index.has_unhashed_size(file_size):
+                unresolved.append((checksum, file_path, file_size))
+                continue
+            yield file_path, match
+
+        if not unresolved:
+            return
+        archived = [
+            row + (index.algorithm,)
+            for size in sorted({file_size for _, _, file_size in unresolved})
+            for row in conn.execute(UNHASHED_OF_SIZE_SQL, (size,))
+        ]
+    finally:
+        conn.close()
+    logging.info(f"Reading {len(archived)} catalogued files that have no checksum")
+    known: Dict[bytes, str] = {}
+    fresh = index.signature == catalog_signature(db_path)
+    with DatabaseWriter(db_path) as writer:
+        async for _, (checksum, file_path, _) in pool.map(hash_file, archived):
+            if checksum:
+                known.setdefault(checksum, file_path)
+                update = (checksum, index.algorithm, file_path)
+                writer.write(UPDATE_CHECKSUM_SQL, update)
+    # Unless another writer changed the catalog since the index was built
+    if fresh:
+        sizes = (file_size for _, file_size, _ in archived)
+        update_index(db_path, index.path, known, sizes)
+    for checksum, file_path, _ in unresolved:
+        yield file_path, known.get(checksum)
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+    """Parse command-line arguments for the check command."""
+    parser = argparse.ArgumentParser(
+        description="Check new files against a DupeHunter catalog"
+    )
+    parser.add_argument("base_path", type=Path, help="Directory of new files")
+    parser.add_argument(
+        "--db-path",
+        default=DEFAULT_DB_PATH,
+        type=Path,
+        help="Catalog to check against (default: file_catalog.db)",
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        help="Lookup index of the catalog, built when missing or stale "
+        "(default: the catalog path with .index appended)",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Rebuild the lookup index even if it is up to date",
+    )
+    parser.add_argument(
+        "--workers",
+        default=DEFAULT_WORKERS,
+        type=int,
+        help="Number of hashing workers (default: CPU count)",
+    )
+    parser.add_argument(
+        "--pool",
+        default=DEFAULT_POOL_KIND,
+        choices=POOL_KINDS,
+        help="Worker pool type (default: thread)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=DEFAULT_LOG_LEVEL,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help="Set the logging level (default: INFO)",
+    )
+    return parser.parse_args(argv)
+
+
+async def _check(args: argparse.Namespace, index: CatalogIndex) -> Dict[str, int]:
+    counts = {"new": 0, "exists": 0}
+    with WorkerPool(args.pool, args.workers) as pool:
+        async for file_path, match in check_files(
+            args.base_path, args.db_path, index, pool
+        ):
+            if match is None:
+                print(f"new\t{file_path}")
+                counts["new"] += 1
+            else:
+                print(f"exists\t{file_path}\t{match}")
+                counts["exists"] += 1
+    return counts
+
+
+def main(argv: List[str]) -> int:
+    """
+    Print ``new<TAB>path`` for each new file and ``exists<TAB>path<TAB>
+    catalogued path`` for each file the catalog already holds.
+    """
+    args = parse_arguments(argv)
+    configure_logging(args.log_level)
+    if not args.db_path.is_file():
+        logging.error(f"Catalog {args.db_path} does not exist")
+        return 1
+    index_path = args.index or default_index_path(args.db_path)
+    try:
+        index = open_index(args.db_path, index_path, args.rebuild_index)
+    except ValueError as error:
+        logging.error(str(error))
+        return 1
+    with index:
+        counts = asyncio.run(_check(args, index))
+    logging.info(f"{counts['new']} new files, {counts['exists']} already catalogued")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
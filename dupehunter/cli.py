@@ -3,8 +3,28 @@ import asyncio
 import logging
 from pathlib import Path
 
-from dupehunter.constants import DEFAULT_DB_PATH, DEFAULT_LOG_LEVEL
-from dupehunter.core import main
+from dupehunter.constants import (
+    DEFAULT_DB_PATH,
+    DEFAULT_DELETE_CANDIDATES_FILE,
+    DEFAULT_DISK_ORDER,
+    DEFAULT_DUPLICATE_ACTION,
+    DEFAULT_FILES_TO_COPY_FILE,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_LOG_LEVEL,
+    DEFAULT_MAX_HAMMING_DISTANCE,
+    DEFAULT_METRICS_INTERVAL,
+    DEFAULT_NEAR_DUPLICATES_FILE,
+    DEFAULT_POOL_KIND,
+    DEFAULT_QUARANTINE_PATH,
+    DEFAULT_READ_AHEAD,
+    DEFAULT_REPORT_FORMAT,
+    DEFAULT_WORKERS,
+    DUPLICATE_ACTIONS,
+    LINK_ACTIONS,
+    POOL_KINDS,
+    REPORT_FORMATS,
+)
+from dupehunter.hashers import HASHERS
 from dupehunter.utils import configure_logging
 
 
@@ -33,13 +53,176 @@ def parse_arguments() -> argparse.Namespace:
         help="Path to the SQLite database file (default: file_catalog.db)",
         type=Path,
     )
+    parser.add_argument(
+        "--files-to-copy",
+        default=DEFAULT_FILES_TO_COPY_FILE,
+        help="Report of the gold files to copy (default: files_to_copy.txt)",
+        type=Path,
+    )
+    parser.add_argument(
+        "--delete-candidates",
+        default=DEFAULT_DELETE_CANDIDATES_FILE,
+        help="Report of the duplicates to delete (default: delete_candidates.txt)",
+        type=Path,
+    )
+    parser.add_argument(
+        "--near-duplicates-report",
+        default=DEFAULT_NEAR_DUPLICATES_FILE,
+        help="Report of the near-duplicate groups found with --near-duplicates "
+        "(default: near_duplicates.txt)",
+        type=Path,
+    )
+    parser.add_argument(
+        "--report-format",
+        default=DEFAULT_REPORT_FORMAT,
+        choices=REPORT_FORMATS,
+        help="Format of both reports; nul separates paths with NUL bytes for "
+        "xargs -0 (default: text)",
+    )
     parser.add_argument(
         "--log-level",
         default=DEFAULT_LOG_LEVEL,
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="Set the logging level (default: INFO)",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        default=DEFAULT_WORKERS,
+        help="Number of hashing and metadata workers (default: CPU count)",
+        type=int,
+    )
+    parser.add_argument(
+        "--pool",
+        default=DEFAULT_POOL_KIND,
+        choices=POOL_KINDS,
+        help="Worker pool type (default: thread)",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="Also report resized or re-encoded copies using perceptual hashes",
+    )
+    parser.add_argument(
+        "--max-distance",
+        default=DEFAULT_MAX_HAMMING_DISTANCE,
+        help="Hamming distance treated as a near duplicate (default: 4)",
+        type=int,
+    )
+    parser.add_argument(
+        "--hash-algorithm",
+        default=DEFAULT_HASH_ALGORITHM,
+        choices=sorted(HASHERS),
+        help="Checksum algorithm (default: sha256)",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Log progress, throughput and ETA while scanning",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write a JSON metrics summary to this file",
+        type=Path,
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        help="Write metrics to this Prometheus textfile",
+        type=Path,
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        default=DEFAULT_METRICS_INTERVAL,
+        help="Seconds between progress lines and metrics exports (default: 10)",
+        type=float,
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Copy the gold files to the target path and verify each copy",
+    )
+    parser.add_argument(
+        "--duplicates",
+        default=DEFAULT_DUPLICATE_ACTION,
+        choices=DUPLICATE_ACTIONS,
+        help="What to do with duplicates: delete or quarantine them once "
+        "--apply verified their gold copy, or replace them in place with a "
+        "hardlink or reflink to it (default: keep)",
+    )
+    parser.add_argument(
+        "--quarantine-path",
+        default=DEFAULT_QUARANTINE_PATH,
+        help="Directory duplicates are moved to by --duplicates quarantine "
+        "(default: quarantine)",
+        type=Path,
+    )
+    parser.add_argument(
+        "--shard-id",
+        help="Scan as one shard of a larger tree, hashing every file so the "
+        "catalog can be merged with python -m dupehunter.merge",
+    )
+    parser.add_argument(
+        "--content-hash",
+        action="store_true",
+        help="Also treat images as duplicates when only their metadata differs, "
+        "by hashing JPEG image data or decoded pixels",
+    )
+    parser.add_argument(
+        "--read-ahead",
+        default=DEFAULT_READ_AHEAD,
+        help="Hash whole files this many at a time with asynchronous "
+        "read-ahead, for network storage (default: 0, use the worker pool)",
+        type=int,
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After the scan, keep running and catalog changes to the base "
+        "path as they happen, reporting new duplicates (Linux only)",
+    )
+    parser.add_argument(
+        "--xattr-cache",
+        action="store_true",
+        help="Cache checksums in the files' extended attributes, so moved "
+        "files and new catalogs need not read them again",
+    )
+    parser.add_argument(
+        "--hash-only",
+        action="store_true",
+        help="Only hash files: skip extracting the metadata of duplicates, "
+        "so images are never decoded",
+    )
+    parser.add_argument(
+        "--scan-archives",
+        action="store_true",
+        help="Also catalog the images inside zip and uncompressed tar archives, "
+        "reading them in place without extracting",
+    )
+    parser.add_argument(
+        "--disk-order",
+        default=DEFAULT_DISK_ORDER,
+        help="Hash files in on-disk order with this many readers per device, "
+        "for spinning disks (default: 0, use the worker pool)",
+        type=int,
+    )
+    args = parser.parse_args()
+    removes = args.duplicates not in LINK_ACTIONS + (DEFAULT_DUPLICATE_ACTION,)
+    if removes and not args.apply:
+        parser.error(f"--duplicates {args.duplicates} requires --apply")
+    if args.read_ahead < 0:
+        parser.error("--read-ahead must not be negative")
+    if args.disk_order < 0:
+        parser.error("--disk-order must not be negative")
+    if args.disk_order and args.read_ahead:
+        parser.error("--disk-order and --read-ahead schedule reads differently")
+    if args.content_hash and (args.apply or args.duplicates in LINK_ACTIONS):
+        # Copies are verified, and links made, against the whole-file checksum
+        parser.error("--content-hash only reports duplicates; it cannot be applied")
+    if args.hash_only and (args.content_hash or args.near_duplicates):
+        parser.error(
+            "--hash-only cannot decode images for --content-hash or "
+            "--near-duplicates"
+        )
+    return args
 
 
 def cli_entry_point() -> None:
@@ -48,10 +231,42 @@ def cli_entry_point() -> None:
     """
     args = parse_arguments()
     configure_logging(args.log_level)
+    # Imported here so that parsing and --help do not load the pipeline
+    from dupehunter.core import main
 
     logging.info("Starting DupeHunter CLI")
     try:
-        asyncio.run(main(args.base_path, args.target_path, args.db_path))
+        asyncio.run(
+            main(
+                args.base_path,
+                args.target_path,
+                args.db_path,
+                workers=args.workers,
+                pool_kind=args.pool,
+                near_duplicates=args.near_duplicates,
+                max_distance=args.max_distance,
+                hash_algorithm=args.hash_algorithm,
+                progress=args.progress,
+                metrics_json=args.metrics_json,
+                metrics_prometheus=args.metrics_prometheus,
+                metrics_interval=args.metrics_interval,
+                apply=args.apply,
+                duplicate_action=args.duplicates,
+                quarantine_path=args.quarantine_path,
+                shard_id=args.shard_id,
+                content_hash=args.content_hash,
+                read_ahead=args.read_ahead,
+                watch=args.watch,
+                xattr_cache=args.xattr_cache,
+                files_to_copy_path=args.files_to_copy,
+                delete_candidates_path=args.delete_candidates,
+                report_format=args.report_format,
+                hash_only=args.hash_only,
+                scan_archives=args.scan_archives,
+                disk_order=args.disk_order,
+                near_duplicates_path=args.near_duplicates_report,
+            )
+        )
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         raise
@@ -1,9 +1,86 @@
 import logging
+import os
 from pathlib import Path
 
 # Constants
 DEFAULT_DB_PATH = Path("file_catalog.db").resolve()
 DEFAULT_DELETE_CANDIDATES_FILE = Path("delete_candidates.txt").resolve()
 DEFAULT_FILES_TO_COPY_FILE = Path("files_to_copy.txt").resolve()
+# Formats the copy plan and delete candidates can be written in
+REPORT_FORMATS = ("text", "jsonl", "csv", "nul")
+DEFAULT_REPORT_FORMAT = "text"
+DEFAULT_MERGED_DB_PATH = Path("merged_catalog.db").resolve()
+DEFAULT_HASH_ALGORITHM = "sha256"
+# Lookup index built next to a catalog by ``python -m dupehunter.check``
+CATALOG_INDEX_SUFFIX = ".index"
+# Bloom filter of the index: 10 bits and 7 probes per checksum give about
+# one false positive, settled by a SQLite lookup, per 120 unseen checksums
+BLOOM_BITS_PER_CHECKSUM = 10
+BLOOM_HASHES = 7
+# Per-thread buffer size for whole-file reads
+READ_BUFFER_SIZE = 1024 * 1024
+# Files hashed concurrently by the read-ahead reader; 0 uses the worker pool
+DEFAULT_READ_AHEAD = 0
+# Bytes the read-ahead reader asks the kernel to fetch ahead of each read
+READ_AHEAD_WINDOW = 8 * 1024 * 1024
+# Readers per device when files are hashed in on-disk order; 0 uses the
+# worker pool. Files are located and sorted this many at a time
+DEFAULT_DISK_ORDER = 0
+DISK_ORDER_BATCH_SIZE = 4096
+# Extended attributes checksums are cached in, one per algorithm
+XATTR_CACHE_PREFIX = "user.dupehunter."
+# Files modified more recently than this are not cached: a write within
+# the filesystem's timestamp granularity would not change their mtime
+XATTR_CACHE_MIN_AGE_NS = 2 * 10**9
+# Bytes hashed from each end of a file before committing to a full read
+PARTIAL_CHECKSUM_SIZE = 8 * 1024
+# Side of the dHash grid; 8 gives 64-bit perceptual hashes
+PERCEPTUAL_HASH_SIZE = 8
+DEFAULT_MAX_HAMMING_DISTANCE = 4
+DEFAULT_NEAR_DUPLICATES_FILE = Path("near_duplicates.txt").resolve()
+# What to do with duplicates: delete and quarantine need a verified copy
+# from --apply, links replace each duplicate in place with its gold file
+LINK_ACTIONS = ("hardlink", "reflink")
+DUPLICATE_ACTIONS = ("keep", "delete", "quarantine") + LINK_ACTIONS
+DEFAULT_DUPLICATE_ACTION = "keep"
+DEFAULT_QUARANTINE_PATH = Path("quarantine").resolve()
+# Suffix of a copy in progress; it is renamed into place once verified
+PARTIAL_COPY_SUFFIX = ".dupehunter-part"
+# Suffix of a link that is about to replace a duplicate
+PENDING_LINK_SUFFIX = ".dupehunter-link"
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff"}
+# Archives whose image members can be scanned in place, the separator
+# between an archive's path and a member's name in the catalog, and the
+# number of archives whose member lists are kept open
+ARCHIVE_EXTENSIONS = {".zip", ".tar"}
+ARCHIVE_SEPARATOR = "!/"
+ARCHIVE_CACHE_SIZE = 8
 DEFAULT_LOG_LEVEL = logging.INFO
+# Worker pool used for hashing and metadata extraction
+POOL_KINDS = ("thread", "process")
+DEFAULT_POOL_KIND = "thread"
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Files handed to a worker per task, and rows written per transaction
+POOL_BATCH_SIZE = 64
+WRITE_BATCH_SIZE = 10000
+# Bytes of catalog entries duplicate grouping buffers before spilling a
+# sorted run to disk, and entries written to a run per pickle
+DEFAULT_GROUPING_MEMORY = 512 * 1024 * 1024
+GROUPING_SPILL_BATCH = 1000
+# Walked files buffered ahead of the catalog comparison
+SCAN_QUEUE_SIZE = 10000
+# Applied to every catalog connection; WAL lets readers run beside the writer
+SQLITE_PRAGMAS = (
+    "journal_mode = WAL",
+    "synchronous = NORMAL",
+    "temp_store = MEMORY",
+    "cache_size = -65536",
+    "mmap_size = 268435456",
+)
+# Seconds a watched file must be left alone before it is catalogued, so
+# a file being written or copied is hashed once, when it is complete
+WATCH_DEBOUNCE = 2.0
+# Seconds between progress lines and metrics exports during a run
+DEFAULT_METRICS_INTERVAL = 10.0
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
@@ -1,66 +1,382 @@
 import argparse
 import asyncio
 import logging
+from contextlib import nullcontext
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Optional, Set
 
-from dupehunter.catalog import (
-    calculate_storage_savings,
-    find_duplicates,
-    generate_delete_candidates,
-    list_files_to_copy,
-)
+from dupehunter.apply import apply_copy_plan, link_duplicates, remove_duplicates
+from dupehunter.catalog import iter_duplicate_summaries, iter_files_to_copy
 from dupehunter.constants import (
     DEFAULT_DB_PATH,
     DEFAULT_DELETE_CANDIDATES_FILE,
+    DEFAULT_DISK_ORDER,
+    DEFAULT_DUPLICATE_ACTION,
     DEFAULT_FILES_TO_COPY_FILE,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_MAX_HAMMING_DISTANCE,
+    DEFAULT_METRICS_INTERVAL,
+    DEFAULT_NEAR_DUPLICATES_FILE,
+    DEFAULT_POOL_KIND,
+    DEFAULT_QUARANTINE_PATH,
+    DEFAULT_READ_AHEAD,
+    DEFAULT_REPORT_FORMAT,
+    DEFAULT_WORKERS,
+    LINK_ACTIONS,
+)
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_file_records,
+    iter_gold_files,
+    load_perceptual_hashes,
+    set_catalog_info,
 )
-from dupehunter.database import initialize_database, load_catalog
-from dupehunter.processing import traverse_directory
+from dupehunter.metrics import Metrics, MetricsReporter
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import (
+    extract_duplicate_metadata,
+    hash_content,
+    hash_perceptually,
+    traverse_directory,
+)
+from dupehunter.reports import write_delete_candidates, write_files_to_copy
+from dupehunter.similarity import find_near_duplicates
 from dupehunter.utils import configure_logging, human_readable_size
 
-# Configure logging
-configure_logging()
+if TYPE_CHECKING:
+    from dupehunter.watch import DirectoryWatcher
 
 
-async def main(base_path: Path, target_path: Path, db_path: Path = DEFAULT_DB_PATH):
+async def main(
+    base_path: Path,
+    target_path: Path,
+    db_path: Path = DEFAULT_DB_PATH,
+    workers: int = DEFAULT_WORKERS,
+    pool_kind: str = DEFAULT_POOL_KIND,
+    near_duplicates: bool = False,
+    max_distance: int = DEFAULT_MAX_HAMMING_DISTANCE,
+    hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+    progress: bool = False,
+    metrics_json: Optional[Path] = None,
+    metrics_prometheus: Optional[Path] = None,
+    metrics_interval: float = DEFAULT_METRICS_INTERVAL,
+    apply: bool = False,
+    duplicate_action: str = DEFAULT_DUPLICATE_ACTION,
+    quarantine_path: Path = DEFAULT_QUARANTINE_PATH,
+    shard_id: Optional[str] = None,
+    content_hash: bool = False,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    watch: bool = False,
+    xattr_cache: bool = False,
+    files_to_copy_path: Path = DEFAULT_FILES_TO_COPY_FILE,
+    delete_candidates_path: Path = DEFAULT_DELETE_CANDIDATES_FILE,
+    report_format: str = DEFAULT_REPORT_FORMAT,
+    hash_only: bool = False,
+    scan_archives: bool = False,
+    disk_order: int = DEFAULT_DISK_ORDER,
+    near_duplicates_path: Path = DEFAULT_NEAR_DUPLICATES_FILE,
+):
     """
     Main function to orchestrate the deduplication process.
     Args:
         base_path (Path): Directory to scan for images.
         target_path (Path): Directory to copy unique files to.
         db_path (Path): Path to the SQLite database file.
+        workers (int): Number of hashing and metadata workers.
+        pool_kind (str): Worker pool type, "thread" or "process".
+        near_duplicates (bool): Also report perceptually similar images.
+        max_distance (int): Hamming distance for near-duplicate matches.
+        hash_algorithm (str): Registered algorithm used for checksums.
+        progress (bool): Log progress and throughput while running.
+        metrics_json (Optional[Path]): File to write a JSON metrics summary to.
+        metrics_prometheus (Optional[Path]): Prometheus textfile to write to.
+        metrics_interval (float): Seconds between progress lines and exports.
+        apply (bool): Copy the gold files to ``target_path`` and verify them.
+        duplicate_action (str): With ``apply``, "keep", "delete" or
+            "quarantine" the duplicates of each verified gold file. With
+            "hardlink" or "reflink", replace duplicates in place with a link
+            to their gold file; this needs no ``apply``.
+        quarantine_path (Path): Directory duplicates are quarantined in.
+        shard_id (Optional[str]): Name of this node when the tree is scanned
+            in shards; every file is then hashed so the catalog can be merged
+            with the other shards' by ``dupehunter.merge``.
+        content_hash (bool): Group duplicates on a checksum of the image
+            content, so copies that differ only in metadata are found too.
+        read_ahead (int): Files read concurrently, with read-ahead hints, when
+            hashing whole files; 0 reads them in the worker pool.
+        watch (bool): After the run, keep the catalog up to date with the
+            changes made to ``base_path`` until interrupted.
+        xattr_cache (bool): Cache full checksums in the files' extended
+            attributes, and use the ones cached there.
+        files_to_copy_path (Path): Report of the gold files to copy.
+        delete_candidates_path (Path): Report of the duplicates to delete.
+        report_format (str): Format of both reports: "text", "jsonl", "csv"
+            or "nul".
+        hash_only (bool): Only hash files; leave out the metadata of
+            duplicates, so images are never decoded.
+        scan_archives (bool): Also catalog the images inside zip and tar
+            archives, reading them from the archive without extracting it.
+        disk_order (int): Readers per device when hashing files in on-disk
+            order; 0 reads them in the worker pool.
+        near_duplicates_path (Path): Report of the near-duplicate groups.
     """
+    metrics = Metrics(enabled=bool(progress or metrics_json or metrics_prometheus))
+    # Watches are set before the scan, so changes made during it are queued
+    watcher = nullcontext()
+    if watch:
+        from dupehunter.watch import DirectoryWatcher
+
+        watcher = DirectoryWatcher(
+            base_path,
+            db_path,
+            hash_algorithm,
+            metrics,
+            bool(shard_id),
+            xattr_cache,
+            hash_only,
+            read_ahead,
+            scan_archives,
+            disk_order,
+        )
+    with watcher, MetricsReporter(
+        metrics, progress, metrics_json, metrics_prometheus, metrics_interval
+    ):
+        await _run(
+            base_path,
+            target_path,
+            db_path,
+            workers,
+            pool_kind,
+            near_duplicates,
+            max_distance,
+            hash_algorithm,
+            metrics,
+            apply,
+            duplicate_action,
+            quarantine_path,
+            shard_id,
+            content_hash,
+            read_ahead,
+            xattr_cache,
+            files_to_copy_path,
+            delete_candidates_path,
+            report_format,
+            hash_only,
+            scan_archives,
+            disk_order,
+            near_duplicates_path,
+        )
+        if watch:
+            await _watch(watcher, workers, pool_kind, metrics)
+
+
+async def _run(
+    base_path: Path,
+    target_path: Path,
+    db_path: Path,
+    workers: int,
+    pool_kind: str,
+    near_duplicates: bool,
+    max_distance: int,
+    hash_algorithm: str,
+    metrics: Metrics,
+    apply: bool,
+    duplicate_action: str,
+    quarantine_path: Path,
+    shard_id: Optional[str],
+    content_hash: bool,
+    read_ahead: int,
+    xattr_cache: bool,
+    files_to_copy_path: Path,
+    delete_candidates_path: Path,
+    report_format: str,
+    hash_only: bool,
+    scan_archives: bool,
+    disk_order: int,
+    near_duplicates_path: Path,
+):
+    """Run every stage of ``main``, recording them in ``metrics``."""
     logging.info(f"Initializing database at {db_path}")
     initialize_database(db_path)
+    if shard_id:
+        # Duplicates may be on other shards, so no file can be skipped here
+        logging.info(f"Scanning as shard {shard_id}, hashing every file")
+        set_catalog_info(db_path, "shard_id", shard_id)
 
     logging.info(f"Starting directory traversal for {base_path}")
-    await traverse_directory(base_path, db_path)
+    pool = WorkerPool(pool_kind, workers, metrics=metrics)
+    writer = DatabaseWriter(db_path, metrics=metrics)
+    with pool, writer:
+        stats = await traverse_directory(
+            base_path,
+            db_path,
+            pool,
+            writer,
+            hash_algorithm,
+            metrics,
+            hash_all=bool(shard_id),
+            read_ahead=read_ahead,
+            xattr_cache=xattr_cache,
+            archives=scan_archives,
+            disk_order=disk_order,
+        )
+        if content_hash:
+            logging.info("Hashing image content without metadata")
+            hashed = await hash_content(db_path, pool, writer, hash_algorithm, metrics)
+            logging.info(f"Content hashed {hashed} files")
+        if not hash_only:
+            # Gold copies are chosen by the EXIF of the groups that are reported
+            logging.info("Extracting metadata for duplicate groups")
+            key = "content_checksum" if content_hash else "checksum"
+            described = await extract_duplicate_metadata(
+                db_path, pool, writer, metrics, key=key
+            )
+            logging.info(f"Extracted metadata for {described} files")
+        if near_duplicates:
+            logging.info("Computing perceptual hashes")
+            hashed = await hash_perceptually(db_path, pool, writer, metrics)
+            logging.info(f"Perceptually hashed {hashed} files")
+    logging.info(
+        f"Skipped {stats['unchanged_files']} unchanged files, "
+        f"removed {stats['removed_files']} deleted files"
+    )
+    logging.info(
+        "Size prefilter skipped reading "
+        f"{human_readable_size(stats['size_skipped_bytes'])}"
+    )
+    logging.info(
+        "Partial hash stage skipped reading "
+        f"{human_readable_size(stats['partial_skipped_bytes'])}"
+    )
+
+    # Duplicate groups are streamed from the database, so results are
+    # written as they are produced. Delete candidates and savings come from
+    # one pass over the catalog, grouped within a fixed memory budget.
+    key = "content_checksum" if content_hash else "checksum"
+    with metrics.stage("report"):
+        logging.info(f"Writing files to copy to {files_to_copy_path}")
+        files_to_copy = iter_files_to_copy(
+            iter_gold_files(db_path, key), target_path, base_path.resolve()
+        )
+        write_files_to_copy(files_to_copy, files_to_copy_path, report_format)
 
-    logging.info("Loading catalog from database")
-    catalog = load_catalog(db_path)
+        logging.info(f"Writing delete candidates to {delete_candidates_path}")
+        storage_savings = 0
 
-    logging.info("Finding duplicates")
-    gold_files, duplicates = find_duplicates(catalog)
+        def groups() -> Iterator[List]:
+            nonlocal storage_savings
+            for group in iter_duplicate_summaries(
+                iter_file_records(db_path), key, temp_dir=db_path.resolve().parent
+            ):
+                storage_savings += group.savings
+                yield [group.gold, *group.duplicates]
 
-    logging.info("Generating files to copy")
-    files_to_copy = list_files_to_copy(gold_files, target_path, base_path)
+        write_delete_candidates(groups(), delete_candidates_path, report_format, key)
+        logging.info(
+            f"Potential storage savings: {human_readable_size(storage_savings)}"
+        )
 
-    logging.info("Generating delete candidates")
-    delete_candidates = generate_delete_candidates(duplicates, gold_files)
+    if near_duplicates:
+        with metrics.stage("near_duplicates"):
+            logging.info(f"Finding near duplicates within {max_distance} bits")
+            hashes = load_perceptual_hashes(db_path)
+            clusters = find_near_duplicates(hashes, max_distance)
+            logging.info(f"Writing near duplicates to {near_duplicates_path}")
+            with near_duplicates_path.open("w") as f:
+                for cluster in clusters:
+                    f.write("\n".join(cluster) + "\n\n")
+            logging.info(f"Found {len(clusters)} near-duplicate groups")
 
-    storage_savings = calculate_storage_savings(duplicates, gold_files)
+    if apply or duplicate_action in LINK_ACTIONS:
+        await _apply(
+            base_path,
+            target_path,
+            db_path,
+            workers,
+            pool_kind,
+            hash_algorithm,
+            metrics,
+            apply,
+            duplicate_action,
+            quarantine_path,
+        )
 
-    # Write results to files
-    logging.info(f"Writing files to copy to {DEFAULT_FILES_TO_COPY_FILE}")
-    with DEFAULT_FILES_TO_COPY_FILE.open("w") as f:
-        for entry in files_to_copy:
-            f.write(f"{entry['source']} -> {entry['target']}\n")
 
-    logging.info(f"Writing delete candidates to {DEFAULT_DELETE_CANDIDATES_FILE}")
-    with DEFAULT_DELETE_CANDIDATES_FILE.open("w") as f:
-        f.writelines("\n".join(delete_candidates))
+async def _watch(
+    watcher: "DirectoryWatcher", workers: int, pool_kind: str, metrics: Metrics
+):
+    """Catalog the changes ``watcher`` reports until interrupted."""
+    logging.info(f"Watching {watcher.base_path} for changes")
+    pool = WorkerPool(pool_kind, workers, metrics=metrics)
+    writer = DatabaseWriter(watcher.db_path, metrics=metrics)
+    with pool, writer:
+        await watcher.run(pool, writer)
 
-    logging.info(f"Potential storage savings: {human_readable_size(storage_savings)}")
+
+async def _apply(
+    base_path: Path,
+    target_path: Path,
+    db_path: Path,
+    workers: int,
+    pool_kind: str,
+    hash_algorithm: str,
+    metrics: Metrics,
+    apply: bool,
+    duplicate_action: str,
+    quarantine_path: Path,
+):
+    """
+    Copy the gold files, then remove duplicates whose gold copy verified,
+    or replace duplicates in place with links to their gold file.
+    """
+    pool = WorkerPool(pool_kind, workers, metrics=metrics)
+    writer = DatabaseWriter(db_path, metrics=metrics)
+    with pool, writer:
+        failed_checksums: Set[bytes] = set()
+        if apply:
+            logging.info(f"Copying gold files to {target_path}")
+            plan = iter_files_to_copy(
+                iter_gold_files(db_path), target_path, base_path.resolve()
+            )
+            stats, failed_checksums = await apply_copy_plan(
+                plan, pool, hash_algorithm, metrics
+            )
+            logging.info(
+                f"Copied {stats['copied_files']} files "
+                f"({human_readable_size(stats['copied_bytes'])}), "
+                f"{stats['present_files']} already present, "
+                f"{stats['failed_copies']} failed"
+            )
+        if duplicate_action in LINK_ACTIONS:
+            logging.info(f"Replacing duplicates with a {duplicate_action}")
+            stats = await link_duplicates(
+                db_path, pool, writer, duplicate_action, metrics
+            )
+            logging.info(
+                f"Linked {stats['linked_files']} duplicates, freeing "
+                f"{human_readable_size(stats['linked_bytes'])}, "
+                f"{stats['failed_links']} failed"
+            )
+            return
+        if duplicate_action == "keep":
+            return
+        logging.info(f"Removing duplicates ({duplicate_action})")
+        stats = await remove_duplicates(
+            db_path,
+            pool,
+            writer,
+            duplicate_action,
+            base_path.resolve(),
+            quarantine_path,
+            failed_checksums,
+            metrics,
+        )
+        logging.info(
+            f"Removed {stats['removed_files']} duplicates, "
+            f"kept {stats['kept_files']} whose gold copy failed, "
+            f"{stats['failed_removals']} failed"
+        )
 
 
 if __name__ == "__main__":
@@ -76,4 +392,5 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    configure_logging()
     asyncio.run(main(Path(args.base_path), Path(args.target_path), Path(args.db_path)))
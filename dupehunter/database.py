@@ -1,40 +1,810 @@
+import json
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from dupehunter.catalog import Catalog, FileRecord
+from dupehunter.constants import SQLITE_PRAGMAS, WRITE_BATCH_SIZE
+from dupehunter.metrics import NO_METRICS, Metrics
 
-def initialize_database(db_path: Path) -> None:
-    """Initialize the SQLite database."""
+# (st_dev, st_ino, st_size, st_mtime_ns) of a file when it was catalogued
+Signature = Tuple[int, int, int, int]
+
+# Columns added after the initial schema, with their SQL types. Existing
+# databases are upgraded in place by ``initialize_database``.
+ADDED_COLUMNS = {
+    "partial_checksum": "BLOB",
+    "st_dev": "INTEGER",
+    "st_ino": "INTEGER",
+    "st_mtime_ns": "INTEGER",
+    "perceptual_hash": "TEXT",
+    "exif_datetime_original": "TEXT",
+    "exif_camera_model": "TEXT",
+    "hash_algorithm": "TEXT",
+    "shard": "TEXT",
+    "content_checksum": "BLOB",
+}
+# Run once when a column is added, to fill it in for existing rows
+COLUMN_BACKFILLS = {
+    "hash_algorithm": """
+        UPDATE file_info SET hash_algorithm = 'sha256'
+        WHERE checksum IS NOT NULL OR partial_checksum IS NOT NULL
+    """,
+}
+
+# Data migrations, applied in order to catalogs whose ``user_version`` is
+# lower than their position in this tuple
+MIGRATIONS = (
+    # 1: hex checksums become raw digests, half the size on disk and in memory
+    """
+    UPDATE file_info SET
+        checksum = unhex_checksum(checksum),
+        partial_checksum = unhex_checksum(partial_checksum)
+    WHERE typeof(checksum) = 'text' OR typeof(partial_checksum) = 'text'
+    """,
+)
+
+# Rank of the files of a duplicate group, gold copy first: the earliest
+# EXIF DateTimeOriginal, then a file whose EXIF still names its camera.
+# GOLD_ORDER_SQL breaks ties by catalog order, by rowid, which id aliases
+# and catalogs from before id also have. The group key indexes below end
+# in the rank, so each group's gold copy is read from their first entry.
+GOLD_RANK_SQL = (
+    "exif_datetime_original IS NULL, exif_datetime_original, "
+    "exif_camera_model IS NULL"
+)
+GOLD_ORDER_SQL = f"{GOLD_RANK_SQL}, rowid"
+
+INDEXES = {
+    "idx_file_info_checksum": "file_info (checksum)",
+    "idx_file_info_size": "file_info (file_size, partial_checksum)",
+    "idx_file_info_inode": "file_info (st_dev, st_ino)",
+    "idx_file_info_shard": "file_info (shard)",
+    "idx_file_info_content_checksum": "file_info (content_checksum)",
+    "idx_file_info_datetime_original": "file_info (exif_datetime_original)",
+    "idx_file_info_camera_model": "file_info (exif_camera_model)",
+    "idx_file_info_checksum_gold": f"file_info (checksum, {GOLD_RANK_SQL})",
+    "idx_file_info_content_checksum_gold": (
+        f"file_info (content_checksum, {GOLD_RANK_SQL})"
+    ),
+}
+
+# Statements applied by the DatabaseWriter. Storing a changed file clears
+# everything derived from its content so later stages process it again.
+STORE_FILE_SQL = """
+    INSERT INTO file_info (file_path, file_size, st_dev, st_ino, st_mtime_ns)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (file_path) DO UPDATE SET
+        checksum = NULL,
+        partial_checksum = NULL,
+        content_checksum = NULL,
+        hash_algorithm = NULL,
+        perceptual_hash = NULL,
+        metadata = NULL,
+        exif_datetime_original = NULL,
+        exif_camera_model = NULL,
+        file_size = excluded.file_size,
+        st_dev = excluded.st_dev,
+        st_ino = excluded.st_ino,
+        st_mtime_ns = excluded.st_mtime_ns
+"""
+# Checksums are stored for every path linked to the hashed file's inode
+UPDATE_PARTIAL_CHECKSUM_SQL = """
+    UPDATE file_info SET partial_checksum = ?1, hash_algorithm = ?2
+    WHERE file_path = ?3 OR (st_dev, st_ino) = (
+        SELECT st_dev, st_ino FROM file_info WHERE file_path = ?3
+    )
+"""
+UPDATE_CHECKSUM_SQL = """
+    UPDATE file_info SET checksum = ?1, hash_algorithm = ?2
+    WHERE file_path = ?3 OR (st_dev, st_ino) = (
+        SELECT st_dev, st_ino FROM file_info WHERE file_path = ?3
+    )
+"""
+UPDATE_CONTENT_CHECKSUM_SQL = """
+    UPDATE file_info SET content_checksum = ?1, hash_algorithm = ?2
+    WHERE file_path = ?3 OR (st_dev, st_ino) = (
+        SELECT st_dev, st_ino FROM file_info WHERE file_path = ?3
+    )
+"""
+# Checksums from another algorithm must never be compared with new ones
+RESET_CHECKSUMS_SQL = """
+    UPDATE file_info
+    SET checksum = NULL, partial_checksum = NULL, content_checksum = NULL,
+        hash_algorithm = NULL
+    WHERE hash_algorithm != ?
+"""
+UPDATE_PERCEPTUAL_HASH_SQL = (
+    "UPDATE file_info SET perceptual_hash = ? WHERE file_path = ?"
+)
+UPDATE_METADATA_SQL = """
+    UPDATE file_info
+    SET metadata = ?, exif_datetime_original = ?, exif_camera_model = ?
+    WHERE file_path = ?
+"""
+UPDATE_SIGNATURE_SQL = """
+    UPDATE file_info SET st_dev = ?, st_ino = ?, file_size = ?, st_mtime_ns = ?
+    WHERE file_path = ?
+"""
+REMOVE_FILE_SQL = "DELETE FROM file_info WHERE file_path = ?"
+# Renames keep a row's checksums and id. A file renamed over a catalogued
+# one replaces its row, as it replaced the file.
+RENAME_FILE_SQL = "UPDATE OR REPLACE file_info SET file_path = ?1 WHERE file_path = ?2"
+# Bounds as returned by ``path_range``: ?2 is the old directory with a
+# trailing separator, ?3 its upper bound, and ?1 the new directory
+RENAME_TREE_SQL = """
+    UPDATE OR REPLACE file_info SET file_path = ?1 || substr(file_path, length(?2))
+    WHERE file_path >= ?2 AND file_path < ?3
+"""
+REMOVE_TREE_SQL = "DELETE FROM file_info WHERE file_path >= ? AND file_path < ?"
+# Files awaiting the partial and the full hashing stage, one path per inode.
+# Hardlinks of one inode never collide with each other, only with other
+# inodes, so they are neither read twice nor reported as duplicates alone.
+# Queries with a {size_filter} are formatted by ``sized_query``.
+SIZE_COLLISIONS_SQL = """
+    SELECT MIN(file_path), file_size FROM file_info
+    WHERE checksum IS NULL AND partial_checksum IS NULL AND file_size IN (
+        SELECT file_size FROM (
+            SELECT DISTINCT file_size, st_dev, st_ino FROM file_info
+            WHERE TRUE {size_filter}
+        )
+        GROUP BY file_size HAVING COUNT(*) > 1
+    )
+    GROUP BY st_dev, st_ino
+"""
+PARTIAL_COLLISIONS_SQL = """
+    SELECT MIN(file_path), file_size FROM file_info
+    WHERE checksum IS NULL AND (file_size, partial_checksum) IN (
+        SELECT file_size, partial_checksum FROM (
+            SELECT DISTINCT file_size, partial_checksum, st_dev, st_ino
+            FROM file_info WHERE partial_checksum IS NOT NULL {size_filter}
+        )
+        GROUP BY file_size, partial_checksum HAVING COUNT(*) > 1
+    )
+    GROUP BY st_dev, st_ino
+"""
+# Every unhashed inode, for shard scans whose collisions span other shards
+UNHASHED_FILES_SQL = """
+    SELECT MIN(file_path), file_size FROM file_info
+    WHERE checksum IS NULL {size_filter}
+    GROUP BY st_dev, st_ino
+"""
+# Narrows a query to the file sizes of a JSON array bound to it
+SIZE_FILTER = "AND file_size IN (SELECT value FROM json_each(?))"
+# Files awaiting the content hash, which no prefilter applies to: copies
+# with edited metadata differ in size and in their first and last blocks
+UNHASHED_CONTENT_SQL = """
+    SELECT MIN(file_path) FROM file_info WHERE content_checksum IS NULL
+    GROUP BY st_dev, st_ino
+"""
+# Columns duplicate groups can be formed on: the checksum of the whole
+# file, or the content checksum that leaves image metadata out
+GROUP_KEYS = ("checksum", "content_checksum")
+# Columns of a catalog entry, in ``FileRecord`` order
+FILE_COLUMNS_SQL = (
+    "file_path, checksum, metadata, file_size, st_dev, st_ino, shard, "
+    "content_checksum, exif_datetime_original, exif_camera_model"
+)
+# Identifies an inode across shards, or a file whose inode is unknown.
+# ``_inode_key_sql`` fills the {alias} in for a table alias.
+INODE_KEY_TEMPLATE = (
+    "COALESCE(COALESCE({alias}shard, '') || ':' || {alias}st_dev || ':' "
+    "|| {alias}st_ino, {alias}file_path)"
+)
+INODE_KEY_SQL = INODE_KEY_TEMPLATE.format(alias="")
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """Open a connection tuned for bulk catalog work (WAL journaling)."""
     conn = sqlite3.connect(db_path)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+
+def _stream(db_path: Path, query: str, parameters: Tuple = ()) -> Iterator[Tuple]:
+    """Yield the rows of ``query`` from an open cursor, one at a time."""
+    conn = connect(db_path)
+    try:
+        yield from conn.execute(query, parameters)
+    finally:
+        conn.close()
+
+
+def _unhex_checksum(value):
+    """Convert a hex checksum to its digest, leaving other values as they are."""
+    if isinstance(value, str):
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            return value
+    return value
+
+
+def initialize_database(db_path: Path) -> None:
+    """
+    Initialize the SQLite database, upgrading an existing one in place.
+
+    Missing columns are added and pending ``MIGRATIONS`` applied. A
+    migration that rewrote rows is followed by a VACUUM, so the space it
+    freed is returned to the filesystem.
+    """
+    conn = connect(db_path)
     cursor = conn.cursor()
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS file_info (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file_path TEXT UNIQUE,
-            checksum TEXT,
+            checksum BLOB,
             metadata TEXT,
-            file_size INTEGER
+            file_size INTEGER,
+            partial_checksum BLOB,
+            st_dev INTEGER,
+            st_ino INTEGER,
+            st_mtime_ns INTEGER,
+            perceptual_hash TEXT,
+            exif_datetime_original TEXT,
+            exif_camera_model TEXT,
+            hash_algorithm TEXT,
+            shard TEXT,
+            content_checksum BLOB
         )
         """
     )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS catalog_info (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(file_info)")}
+    for column, column_type in ADDED_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE file_info ADD COLUMN {column} {column_type}")
+            if column in COLUMN_BACKFILLS:
+                cursor.execute(COLUMN_BACKFILLS[column])
+    for name, definition in INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    (version,) = cursor.execute("PRAGMA user_version").fetchone()
+    migrated = 0
+    if version < len(MIGRATIONS):
+        conn.create_function("unhex_checksum", 1, _unhex_checksum, deterministic=True)
+        for migration in MIGRATIONS[version:]:
+            migrated += max(cursor.execute(migration).rowcount, 0)
+        cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
     conn.commit()
+    if migrated:
+        logging.info(f"Migrated {migrated} catalog rows, compacting {db_path}")
+        conn.execute("VACUUM")
     conn.close()
 
 
-def load_catalog(db_path: Path) -> List[Dict]:
-    """Load the file catalog from the database."""
-    conn = sqlite3.connect(db_path)
+def read_catalog_info(db_path: Path) -> Dict[str, str]:
+    """Return the catalog's settings, such as its ``shard_id``."""
+    conn = connect(db_path)
+    rows = conn.execute("SELECT key, value FROM catalog_info").fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def set_catalog_info(db_path: Path, key: str, value: str) -> None:
+    """Store one catalog setting."""
+    conn = connect(db_path)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO catalog_info (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+    conn.close()
+
+
+def _as_file(row: Tuple) -> FileRecord:
+    """Build a catalog entry from a ``FILE_COLUMNS_SQL`` row."""
+    return FileRecord(*row)
+
+
+def iter_file_records(db_path: Path) -> Iterator[FileRecord]:
+    """Stream every catalog entry in catalog order, without loading the catalog."""
+    for row in _stream(
+        db_path, f"SELECT {FILE_COLUMNS_SQL} FROM file_info ORDER BY rowid"
+    ):
+        yield _as_file(row)
+
+
+def load_catalog(db_path: Path) -> Catalog:
+    """Load the file catalog from the database into compact columns."""
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {FILE_COLUMNS_SQL} FROM file_info ORDER BY rowid")
+    catalog = Catalog(cursor)
+    conn.close()
+    return catalog
+
+
+def path_range(base_path: Path) -> Tuple[str, str]:
+    """Return bounds selecting every path below ``base_path`` by comparison."""
+    prefix = str(base_path).rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def iter_signatures(db_path: Path, base_path: Path) -> Iterator[Tuple]:
+    """
+    Stream the stored stat signature of every catalogued file below a directory.
+
+    Parameters:
+        db_path (Path): Path to the SQLite database file.
+        base_path (Path): Resolved directory being rescanned.
+
+    Yields:
+        Tuple: ``(file_path, st_dev, st_ino, file_size, st_mtime_ns)`` rows
+        in ``file_path`` order.
+    """
+    return _stream(
+        db_path,
+        """
+        SELECT file_path, st_dev, st_ino, file_size, st_mtime_ns FROM file_info
+        WHERE file_path >= ? AND file_path < ?
+        ORDER BY file_path
+        """,
+        path_range(base_path),
+    )
+
+
+def load_signatures(db_path: Path, file_paths: Iterable[str]) -> Dict[str, Signature]:
+    """Return the stored stat signature of each of ``file_paths`` in the catalog."""
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    signatures = {}
+    for file_path in file_paths:
+        row = cursor.execute(
+            """
+            SELECT st_dev, st_ino, file_size, st_mtime_ns FROM file_info
+            WHERE file_path = ?
+            """,
+            (file_path,),
+        ).fetchone()
+        if row is not None:
+            signatures[file_path] = row
+    conn.close()
+    return signatures
+
+
+def sized_query(query: str, sizes: Optional[Iterable[int]] = None) -> Tuple[str, Tuple]:
+    """
+    Format a query with a ``{size_filter}``, narrowed to ``sizes`` if given.
+
+    Returns:
+        Tuple[str, Tuple]: The query and its parameters.
+    """
+    if sizes is None:
+        return query.format(size_filter=""), ()
+    return query.format(size_filter=SIZE_FILTER), (json.dumps(sorted(set(sizes))),)
+
+
+def iter_size_collisions(
+    db_path: Path, sizes: Optional[Iterable[int]] = None
+) -> Iterator[Tuple[str, int]]:
+    """
+    Stream files without a partial checksum whose size is shared by another file.
+
+    Yields:
+        Tuple[str, int]: ``(file_path, file_size)`` pairs to partial-hash,
+        of ``sizes`` only if given.
+    """
+    return _stream(db_path, *sized_query(SIZE_COLLISIONS_SQL, sizes))
+
+
+def iter_partial_collisions(
+    db_path: Path, sizes: Optional[Iterable[int]] = None
+) -> Iterator[Tuple[str, int]]:
+    """
+    Stream unhashed files whose size and partial checksum are shared by another file.
+
+    Yields:
+        Tuple[str, int]: ``(file_path, file_size)`` pairs to fully hash, of
+        ``sizes`` only if given.
+    """
+    return _stream(db_path, *sized_query(PARTIAL_COLLISIONS_SQL, sizes))
+
+
+def iter_unhashed_files(
+    db_path: Path, sizes: Optional[Iterable[int]] = None
+) -> Iterator[Tuple[str, int]]:
+    """
+    Stream every unhashed file, one path per inode, whatever its size.
+
+    Yields:
+        Tuple[str, int]: ``(file_path, file_size)`` pairs to fully hash, of
+        ``sizes`` only if given.
+    """
+    return _stream(db_path, *sized_query(UNHASHED_FILES_SQL, sizes))
+
+
+def count_rows(db_path: Path, query: str, parameters: Tuple = ()) -> int:
+    """Return the number of rows ``query`` selects, without fetching them."""
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM ({query})", parameters)
+    (count,) = cursor.fetchone()
+    conn.close()
+    return count
+
+
+def unique_size_bytes(db_path: Path, sizes: Optional[Iterable[int]] = None) -> int:
+    """
+    Return the total size of inodes no other inode shares a size with, of
+    ``sizes`` only if given.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        *sized_query(
+            """
+            SELECT COALESCE(SUM(file_size), 0) FROM (
+                SELECT file_size FROM (
+                    SELECT DISTINCT file_size, st_dev, st_ino FROM file_info
+                    WHERE TRUE {size_filter}
+                )
+                GROUP BY file_size HAVING COUNT(*) = 1
+            )
+            """,
+            sizes,
+        )
+    )
+    (total,) = cursor.fetchone()
+    conn.close()
+    return total
+
+
+def iter_duplicates_without_metadata(
+    db_path: Path, sizes: Optional[Iterable[int]] = None, key: str = "checksum"
+) -> Iterator[Tuple[str]]:
+    """
+    Stream members of duplicate groups whose metadata has not been read yet,
+    of groups of ``sizes`` only if given. Groups are formed on ``key`` and
+    need more than one inode: hardlinks of one file are not duplicates.
+    """
+    key = _group_key(key)
+    return _stream(
+        db_path,
+        *sized_query(
+            f"""
+            SELECT file_path FROM file_info
+            WHERE metadata IS NULL AND {key} IN (
+                SELECT {key} FROM file_info
+                WHERE {key} IS NOT NULL {{size_filter}}
+                GROUP BY {key} HAVING COUNT(DISTINCT {INODE_KEY_SQL}) > 1
+            )
+            """,
+            sizes,
+        ),
+    )
+
+
+def iter_unhashed_content(db_path: Path) -> Iterator[Tuple[str]]:
+    """Stream files without a content checksum, one path per inode."""
+    return _stream(db_path, UNHASHED_CONTENT_SQL)
+
+
+def iter_unhashed_images(db_path: Path) -> Iterator[Tuple[str]]:
+    """Stream files that have not been perceptually hashed yet."""
+    return _stream(
+        db_path, "SELECT file_path FROM file_info WHERE perceptual_hash IS NULL"
+    )
+
+
+def load_perceptual_hashes(db_path: Path) -> List[Tuple[str, str]]:
+    """Load ``(file_path, perceptual_hash)`` for every perceptually hashed file."""
+    conn = connect(db_path)
     cursor = conn.cursor()
-    cursor.execute("SELECT file_path, checksum, metadata, file_size FROM file_info")
+    cursor.execute(
+        """
+        SELECT file_path, perceptual_hash FROM file_info
+        WHERE perceptual_hash IS NOT NULL AND perceptual_hash != ''
+        """
+    )
     rows = cursor.fetchall()
     conn.close()
-    return [
-        {
-            "file_path": row[0],
-            "checksum": row[1],
-            "metadata": row[2],
-            "file_size": row[3],
-        }
-        for row in rows
-    ]
+    return rows
+
+
+def _group_key(key: str) -> str:
+    """Check that ``key`` is one of the ``GROUP_KEYS``."""
+    if key not in GROUP_KEYS:
+        raise ValueError(f"Cannot group duplicates on {key!r}")
+    return key
+
+
+def iter_duplicate_groups(
+    db_path: Path, key: str = "checksum"
+) -> Iterator[List[FileRecord]]:
+    """
+    Stream groups of files sharing a checksum, read through its index.
+
+    Only one group is held in memory at a time. Within a group files are in
+    ``GOLD_ORDER_SQL`` order, so the first file is the gold copy. ``key`` is the
+    checksum column of ``GROUP_KEYS`` the groups are formed on. Hardlinks of
+    the gold copy are left out, as deleting them frees nothing, and groups
+    of a single inode are not duplicates at all.
+
+    Yields:
+        List[FileRecord]: Catalog entries of one duplicate group.
+    """
+    key = _group_key(key)
+    rows = _stream(
+        db_path,
+        f"""
+        SELECT {FILE_COLUMNS_SQL}, {INODE_KEY_SQL}, {key} FROM file_info
+        WHERE {key} IN (
+            SELECT {key} FROM file_info WHERE {key} IS NOT NULL
+            GROUP BY {key} HAVING COUNT(DISTINCT {INODE_KEY_SQL}) > 1
+        )
+        ORDER BY {key}, {GOLD_ORDER_SQL}
+        """,
+    )
+    for _, group in groupby(rows, key=itemgetter(-1)):
+        gold, *duplicates = group
+        yield [_as_file(gold[:-2])] + [
+            _as_file(row[:-2]) for row in duplicates if row[-2] != gold[-2]
+        ]
+
+
+def _inode_key_sql(alias: str) -> str:
+    """Identify the inode of row ``alias`` as ``INODE_KEY_SQL`` does."""
+    return INODE_KEY_TEMPLATE.format(alias=f"{alias}.")
+
+
+def _gold_id_sql(key: str, alias: str) -> str:
+    """
+    Select the id of the gold copy of the ``key`` group of row ``alias``,
+    the first entry of the group in its ``INDEXES`` gold index.
+    """
+    return f"""(
+        SELECT id FROM file_info WHERE {key} = {alias}.{key}
+        ORDER BY {GOLD_ORDER_SQL} LIMIT 1
+    )"""
+
+
+def iter_gold_files(db_path: Path, key: str = "checksum") -> Iterator[FileRecord]:
+    """
+    Stream the gold copy of each duplicate group, the first of its files in
+    ``GOLD_ORDER_SQL`` order.
+    """
+    key = _group_key(key)
+    rows = _stream(
+        db_path,
+        f"""
+        SELECT {FILE_COLUMNS_SQL} FROM file_info
+        WHERE id IN (
+            SELECT {_gold_id_sql(key, "grouped")} FROM file_info AS grouped
+            WHERE {key} IS NOT NULL
+            GROUP BY {key} HAVING COUNT(DISTINCT {INODE_KEY_SQL}) > 1
+        )
+        """,
+    )
+    for row in rows:
+        yield _as_file(row)
+
+
+def iter_delete_candidate_rows(
+    db_path: Path, key: str = "checksum"
+) -> Iterator[Tuple[str, bytes, Signature]]:
+    """
+    Stream every duplicate that is not its group's gold copy or a hardlink
+    of it.
+
+    Yields:
+        Tuple[str, bytes, Signature]: ``(file_path, checksum, signature)``
+        rows, with the ``key`` checksum and the catalogued stat signature.
+    """
+    key = _group_key(key)
+    rows = _stream(
+        db_path,
+        f"""
+        SELECT duplicate.file_path, duplicate.{key}, duplicate.st_dev,
+            duplicate.st_ino, duplicate.file_size, duplicate.st_mtime_ns
+        FROM file_info AS duplicate JOIN file_info AS gold
+            ON gold.id = {_gold_id_sql(key, "duplicate")}
+        WHERE duplicate.{key} IS NOT NULL
+            AND {_inode_key_sql("duplicate")} != {_inode_key_sql("gold")}
+        """,
+    )
+    for row in rows:
+        yield row[0], row[1], tuple(row[2:6])
+
+
+def iter_link_candidates(
+    db_path: Path,
+) -> Iterator[Tuple[str, Signature, str, Signature]]:
+    """
+    Stream duplicates that are not yet linked to their group's gold copy.
+
+    Yields:
+        Tuple[str, Signature, str, Signature]: Each duplicate's path and
+        catalogued signature, with those of its gold copy.
+    """
+    rows = _stream(
+        db_path,
+        f"""
+        SELECT duplicate.file_path, duplicate.st_dev, duplicate.st_ino,
+            duplicate.file_size, duplicate.st_mtime_ns,
+            gold.file_path, gold.st_dev, gold.st_ino,
+            gold.file_size, gold.st_mtime_ns
+        FROM file_info AS duplicate JOIN file_info AS gold
+            ON gold.id = {_gold_id_sql("checksum", "duplicate")}
+        WHERE duplicate.checksum IS NOT NULL AND duplicate.id != gold.id
+            AND (duplicate.st_dev, duplicate.st_ino) != (gold.st_dev, gold.st_ino)
+        """,
+    )
+    for row in rows:
+        yield row[0], tuple(row[1:5]), row[5], tuple(row[6:10])
+
+
+def iter_new_duplicates(
+    db_path: Path, file_paths: Iterable[str]
+) -> Iterator[Tuple[str, str]]:
+    """
+    Find which of ``file_paths`` duplicate a file of another inode.
+
+    Yields:
+        Tuple[str, str]: ``(file_path, gold_path)`` for each of ``file_paths``
+        that is not its group's gold copy.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    try:
+        for file_path in file_paths:
+            row = cursor.execute(
+                f"""
+                SELECT gold.file_path
+                FROM file_info AS duplicate JOIN file_info AS gold
+                    ON gold.id = {_gold_id_sql("checksum", "duplicate")}
+                WHERE duplicate.file_path = ? AND duplicate.id != gold.id
+                    AND (duplicate.st_dev, duplicate.st_ino)
+                        != (gold.st_dev, gold.st_ino)
+                """,
+                (file_path,),
+            ).fetchone()
+            if row is not None:
+                yield file_path, row[0]
+    finally:
+        conn.close()
+
+
+def iter_delete_candidates(db_path: Path, key: str = "checksum") -> Iterator[str]:
+    """
+    Stream the paths of every duplicate that is not its group's gold copy
+    or a hardlink of it.
+    """
+    for file_path, _, _ in iter_delete_candidate_rows(db_path, key):
+        yield file_path
+
+
+def duplicate_savings(db_path: Path, key: str = "checksum") -> int:
+    """
+    Return the bytes freed by deleting every delete candidate.
+
+    Each inode is counted once: removing a hardlink of a file that stays
+    frees nothing, so a group saves its file size once per extra inode.
+    Copies grouped on their content checksum may differ in size; each is
+    then counted at the size of the smallest.
+    """
+    key = _group_key(key)
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT COALESCE(SUM(file_size * (inodes - 1)), 0) FROM (
+            SELECT MIN(file_size) AS file_size, COUNT(DISTINCT {INODE_KEY_SQL})
+                AS inodes
+            FROM file_info WHERE {key} IS NOT NULL
+            GROUP BY {key} HAVING COUNT(*) > 1
+        )
+        """
+    )
+    (total,) = cursor.fetchone()
+    conn.close()
+    return total
+
+
+class DatabaseWriter:
+    """
+    The single writer of a catalog database.
+
+    Producers hand rows to ``write`` and a dedicated thread applies them
+    with ``executemany``, committing everything queued so far in one
+    transaction of up to ``batch_size`` rows. The queue is bounded, so
+    producers block when the writer falls behind. With ``metrics`` enabled,
+    each transaction's latency, size and the queue depth left behind it
+    are recorded. A failed transaction is retried row by row, and rows
+    that still fail are logged and dropped.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        batch_size: int = WRITE_BATCH_SIZE,
+        metrics: Metrics = NO_METRICS,
+    ):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.queue: queue.Queue = queue.Queue(maxsize=4 * batch_size)
+        self.thread = threading.Thread(
+            target=self._run, name="dupehunter-db-writer", daemon=True
+        )
+        self.thread.start()
+
+    def __enter__(self) -> "DatabaseWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, statement: str, row: Tuple) -> None:
+        """Queue one row for ``statement``."""
+        self.queue.put((statement, row))
+
+    def write_many(self, statement: str, rows: Iterable[Tuple]) -> None:
+        """Queue several rows for ``statement``."""
+        for row in rows:
+            self.queue.put((statement, row))
+
+    def flush(self) -> None:
+        """Block until every queued row has been committed."""
+        self.queue.join()
+
+    def close(self) -> None:
+        """Commit the remaining rows and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        conn = connect(self.db_path)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+            try:
+                start = time.perf_counter()
+                self._commit(conn, [item for item in batch if item is not None])
+                if self.metrics.enabled:
+                    elapsed = time.perf_counter() - start
+                    self.metrics.observe("db_commit_seconds", elapsed)
+                    self.metrics.increment(
+                        "db_rows_written", len(batch) - (not running)
+                    )
+                    self.metrics.set_gauge("db_queue_depth", self.queue.qsize())
+            finally:
+                # Always release flush() and close(), even if the batch failed
+                for _ in batch:
+                    self.queue.task_done()
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Tuple]) -> None:
+        try:
+            with conn:
+                for statement, items in groupby(batch, key=itemgetter(0)):
+                    conn.executemany(statement, [item[1] for item in items])
+        except Exception as error:
+            if len(batch) == 1:
+                row = batch[0][1]
+                logging.error(f"Database write error for row {ascii(row)}: {error}")
+                return
+            # Retry row by row, so one bad row does not lose the whole batch
+            logging.warning(
+                f"Database write error for {len(batch)} rows, retrying each: {error}"
+            )
+            for item in batch:
+                self._commit(conn, [item])
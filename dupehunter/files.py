@@ -1,23 +1,226 @@
-import hashlib
+import json
 import logging
+import os
 from pathlib import Path
+from typing import Any, BinaryIO, Dict
 
-from PIL import ExifTags, Image
+from dupehunter.archives import is_member_path, open_file
+from dupehunter.constants import (
+    DEFAULT_HASH_ALGORITHM,
+    PARTIAL_CHECKSUM_SIZE,
+    PERCEPTUAL_HASH_SIZE,
+)
+from dupehunter.hashers import digest_file, new_hasher
+from dupehunter.xattrs import read_cached_checksum, write_cached_checksum
 
+JPEG_APP1_MARKER = 0xE1
+JPEG_START_OF_SCAN = 0xDA
+JPEG_END_OF_IMAGE = 0xD9
+# Segments that carry metadata rather than image data: APP0-APP15 and COM
+JPEG_METADATA_MARKERS = set(range(0xE0, 0xF0)) | {0xFE}
+# Start of scan and end of image: no metadata segments follow
+JPEG_SCAN_MARKERS = (0xDA, 0xD9)
+EXIF_IFD_POINTER = 0x8769
 
-def calculate_checksum(file_path: Path) -> str:
-    """Calculate the SHA-256 checksum of a file."""
-    hasher = hashlib.sha256()
+
+def calculate_checksum(
+    file_path: Path, algorithm: str = DEFAULT_HASH_ALGORITHM, xattr_cache: bool = False
+) -> str:
+    """
+    Calculate the checksum of a file with a registered hash algorithm.
+
+    With ``xattr_cache``, a checksum cached in the file's extended
+    attributes is returned without opening the file, and a computed one
+    is cached there. Archive members have no attributes of their own and
+    are never cached.
+    """
+    xattr_cache = xattr_cache and not is_member_path(file_path)
     try:
-        with open(file_path, "rb") as file:
-            for chunk in iter(lambda: file.read(4096), b""):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        if xattr_cache:
+            checksum = read_cached_checksum(file_path, algorithm)
+            if checksum:
+                return checksum
+        with open_file(file_path) as file:
+            if xattr_cache:
+                stat_result = os.fstat(file.fileno())
+            checksum = digest_file(file, algorithm)
+        if xattr_cache:
+            write_cached_checksum(file_path, algorithm, checksum, stat_result)
+        return checksum
     except Exception as error:
         logging.error(f"Error calculating checksum for {file_path}: {error}")
         return ""
 
 
+def calculate_partial_checksum(
+    file_path: Path,
+    file_size: int,
+    block_size: int = PARTIAL_CHECKSUM_SIZE,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+) -> str:
+    """
+    Calculate the checksum of the first and last blocks of a file.
+
+    For files no larger than two blocks the whole file is read, so the result
+    equals the full checksum from ``calculate_checksum``.
+    """
+    try:
+        hasher = new_hasher(algorithm)
+        with open_file(file_path) as file:
+            hasher.update(file.read(block_size))
+            if file_size > block_size:
+                file.seek(max(file_size - block_size, block_size))
+                hasher.update(file.read(block_size))
+        return hasher.hexdigest()
+    except Exception as error:
+        logging.error(f"Error calculating partial checksum for {file_path}: {error}")
+        return ""
+
+
+def _digest_jpeg_payload(file: BinaryIO, algorithm: str) -> str:
+    """
+    Hash a JPEG's image data, leaving out its metadata segments.
+
+    The tables and frame header before the first scan are hashed, APPn and
+    comment segments skipped, and everything from the scan on is hashed as
+    is, so the entropy-coded data is never decoded.
+
+    Returns:
+        str: The hex digest, or '' if the file is not a well-formed JPEG.
+    """
+    if file.read(2) != b"\xff\xd8":
+        return ""
+    hasher = new_hasher(algorithm)
+    while True:
+        marker = file.read(2)
+        while marker[1:] == b"\xff":
+            marker = marker[1:] + file.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] == JPEG_END_OF_IMAGE:
+            return ""
+        length = file.read(2)
+        if int.from_bytes(length, "big") < 2:
+            return ""
+        size = int.from_bytes(length, "big") - 2
+        if marker[1] in JPEG_METADATA_MARKERS:
+            file.seek(size, os.SEEK_CUR)
+            continue
+        hasher.update(marker + length)
+        if marker[1] == JPEG_START_OF_SCAN:
+            return digest_file(file, algorithm, hasher)
+        hasher.update(file.read(size))
+
+
+def _digest_pixels(file_path: Path, algorithm: str) -> str:
+    """Hash the decoded pixels, mode and size of every frame of an image."""
+    # Pillow is imported where images are decoded, so runs that only hash
+    # files never import it
+    from PIL import Image, ImageSequence
+
+    hasher = new_hasher(algorithm)
+    with open_file(file_path) as file, Image.open(file) as img:
+        for frame in ImageSequence.Iterator(img):
+            hasher.update(f"{frame.mode} {frame.size}\n".encode())
+            hasher.update(frame.tobytes())
+    return hasher.hexdigest()
+
+
+def calculate_content_checksum(
+    file_path: Path, algorithm: str = DEFAULT_HASH_ALGORITHM
+) -> str:
+    """
+    Calculate a checksum of an image's content that ignores its metadata.
+
+    JPEGs hash their image data without decoding it, other formats their
+    decoded pixels, so copies that differ only in edited EXIF, XMP or
+    comments get the same checksum. Files that cannot be read as images
+    fall back to ``calculate_checksum``.
+
+    Returns:
+        str: The hex digest, or '' if the file cannot be read.
+    """
+    try:
+        with open_file(file_path) as file:
+            checksum = _digest_jpeg_payload(file, algorithm)
+        if not checksum:
+            checksum = _digest_pixels(file_path, algorithm)
+        return checksum
+    except Exception as error:
+        logging.debug(f"Hashing the image content of {file_path} failed: {error}")
+        return calculate_checksum(file_path, algorithm)
+
+
+def read_exif_segment(file_path: Path) -> bytes:
+    """
+    Read the APP1 Exif segment of a JPEG without touching the image data.
+
+    Only the marker segments before the first scan are read, and all but
+    the Exif one are skipped with a seek.
+
+    Returns:
+        bytes: The segment payload starting with ``Exif\\0\\0``, or b'' if the
+        file is not a JPEG or has no Exif segment.
+    """
+    with open_file(file_path) as file:
+        if file.read(2) != b"\xff\xd8":
+            return b""
+        while True:
+            marker = file.read(2)
+            while marker[1:] == b"\xff":
+                marker = marker[1:] + file.read(1)
+            if len(marker) < 2 or marker[0] != 0xFF or marker[1] in JPEG_SCAN_MARKERS:
+                return b""
+            length = int.from_bytes(file.read(2), "big") - 2
+            if length < 0:
+                return b""
+            if marker[1] == JPEG_APP1_MARKER:
+                data = file.read(length)
+                if data.startswith(b"Exif\x00\x00"):
+                    return data
+            else:
+                file.seek(length, os.SEEK_CUR)
+
+
+def _json_value(value: Any) -> Any:
+    """Convert an EXIF value into something ``json.dumps`` accepts."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace").rstrip("\x00")
+    if isinstance(value, (tuple, list)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, (str, int)):
+        return value
+    if hasattr(value, "numerator") and hasattr(value, "denominator"):
+        return float(value) if value.denominator else None
+    return str(value)
+
+
+def read_metadata(file_path: Path) -> Dict[str, Any]:
+    """
+    Read the EXIF tags of an image, including the Exif sub-IFD.
+
+    JPEGs are parsed from their Exif header segment alone; other formats
+    go through ``Image.open``, which also reads only the file header.
+
+    Returns:
+        Dict[str, Any]: JSON-serialisable tags keyed by tag name.
+    """
+    from PIL import ExifTags, Image
+
+    segment = read_exif_segment(file_path)
+    if segment:
+        exif_data = Image.Exif()
+        exif_data.load(segment)
+    else:
+        with open_file(file_path) as file, Image.open(file) as img:
+            exif_data = img.getexif()
+    tags = dict(exif_data.items())
+    tags.update(exif_data.get_ifd(EXIF_IFD_POINTER))
+    return {
+        ExifTags.TAGS[tag]: _json_value(value)
+        for tag, value in tags.items()
+        if tag in ExifTags.TAGS and tag != EXIF_IFD_POINTER
+    }
+
+
 def extract_metadata(file_path: Path) -> str:
     """
     Extract image metadata if available.
@@ -26,19 +229,48 @@ def extract_metadata(file_path: Path) -> str:
         file_path (Path): Path to the image file.
 
     Returns:
-        str: Extracted metadata as a JSON-like string,
+        str: Extracted metadata as a JSON object,
         or '{}' if no metadata is available.
     """
     try:
-        with Image.open(file_path) as img:
-            # Use getexif() for metadata extraction
-            exif_data = img.getexif()
-            metadata = {
-                ExifTags.TAGS.get(tag): value
-                for tag, value in exif_data.items()
-                if tag in ExifTags.TAGS
-            }
-            return str(metadata)
+        return json.dumps(read_metadata(file_path))
     except Exception as error:
         logging.warning(f"Metadata extraction failed for {file_path}: {error}")
         return "{}"
+
+
+def calculate_perceptual_hash(
+    file_path: Path, hash_size: int = PERCEPTUAL_HASH_SIZE
+) -> str:
+    """
+    Calculate the difference hash (dHash) of an image.
+
+    The image is shrunk to ``hash_size + 1`` by ``hash_size`` grey pixels
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour, so resized or re-encoded copies get equal or nearby hashes.
+    JPEGs are decoded at reduced resolution via ``Image.draft``.
+
+    Returns:
+        str: The hash as a hex string, or '' if the image cannot be read.
+    """
+    from PIL import Image
+
+    try:
+        with open_file(file_path) as file, Image.open(file) as img:
+            img.draft("L", (4 * (hash_size + 1), 4 * hash_size))
+            pixels = (
+                img.convert("L")
+                .resize((hash_size + 1, hash_size), Image.LANCZOS)
+                .tobytes()
+            )
+    except Exception as error:
+        logging.warning(f"Perceptual hashing failed for {file_path}: {error}")
+        return ""
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{hash_size * hash_size // 4}x}"
@@ -0,0 +1,64 @@
+"""Registry of hash engines for file checksums."""
+
+import hashlib
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+from dupehunter.constants import READ_BUFFER_SIZE
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover - optional dependency
+    xxhash = None
+
+HASHERS: Dict[str, Callable[[], Any]] = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash is not None:
+    # Non-cryptographic, but 128 bits keep accidental collisions negligible
+    HASHERS["xxh128"] = xxhash.xxh3_128
+
+# Algorithms hashed through ``hashlib.file_digest``
+FILE_DIGEST_ALGORITHMS = {"sha256"}
+
+_buffers = threading.local()
+
+
+def new_hasher(algorithm: str) -> Any:
+    """Create a hasher for a registered algorithm."""
+    try:
+        return HASHERS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}") from None
+
+
+def _read_buffer() -> memoryview:
+    """Return this thread's reusable read buffer."""
+    buffer = getattr(_buffers, "view", None)
+    if buffer is None:
+        buffer = _buffers.view = memoryview(bytearray(READ_BUFFER_SIZE))
+    return buffer
+
+
+def digest_file(file: BinaryIO, algorithm: str, hasher: Optional[Any] = None) -> str:
+    """
+    Hash the rest of an open binary file.
+
+    SHA-256 goes through ``hashlib.file_digest``; other algorithms read
+    into a per-thread buffer with ``readinto`` so no chunk is copied. A
+    ``hasher`` of ``algorithm`` that was already fed a prefix is continued.
+
+    Returns:
+        str: The hex digest.
+    """
+    if hasher is None:
+        hasher = new_hasher(algorithm)
+    if algorithm in FILE_DIGEST_ALGORITHMS:
+        return hashlib.file_digest(file, lambda: hasher).hexdigest()
+    buffer = _read_buffer()
+    while True:
+        size = file.readinto(buffer)
+        if not size:
+            return hasher.hexdigest()
+        hasher.update(buffer[:size])
@@ -0,0 +1,289 @@
+"""
+An on-disk lookup index over a catalog's file sizes and checksums.
+
+The index holds the sorted distinct file sizes of the catalog, the sizes
+of its files that have no checksum, and a Bloom filter of its checksums.
+It is memory-mapped, so a lookup reads only the pages it touches, and a
+file whose size or checksum the catalog has never seen is rejected
+without a SQLite query.
+"""
+
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Sequence, Tuple
+
+from dupehunter.constants import (
+    BLOOM_BITS_PER_CHECKSUM,
+    BLOOM_HASHES,
+    CATALOG_INDEX_SUFFIX,
+    DEFAULT_HASH_ALGORITHM,
+)
+from dupehunter.database import connect
+
+INDEX_MAGIC = b"DHINDEX1"
+# Magic, hash algorithm, catalog signature, and the number of sizes,
+# unhashed sizes, Bloom filter bits and Bloom filter probes. The arrays
+# that follow are in native byte order: an index is local to its machine.
+INDEX_HEADER = struct.Struct("<8s16s4q4Q")
+
+# (mtime_ns, size) of a catalog database and of its write-ahead log
+CatalogSignature = Tuple[int, int, int, int]
+# Pads the unhashed sizes of an index updated in place; no file has it
+NO_SIZE = 2**64 - 1
+# Files of a size that have no checksum yet
+UNHASHED_SIZE_SQL = (
+    "SELECT 1 FROM file_info WHERE file_size = ? AND checksum IS NULL LIMIT 1"
+)
+
+
+def default_index_path(db_path: Path) -> Path:
+    """Return where the index of a catalog is kept by default."""
+    return db_path.with_name(db_path.name + CATALOG_INDEX_SUFFIX)
+
+
+def catalog_signature(db_path: Path) -> CatalogSignature:
+    """
+    Return the modification time and size of a catalog and its WAL file.
+
+    Any write to the catalog changes one of them, so an index built with
+    another signature is stale.
+    """
+    signature = []
+    for path in (db_path, Path(f"{db_path}-wal")):
+        try:
+            stat_result = os.stat(path)
+            signature.extend((stat_result.st_mtime_ns, stat_result.st_size))
+        except FileNotFoundError:
+            signature.extend((0, 0))
+    return tuple(signature)
+
+
+def _bloom_positions(checksum: bytes, bits: int, hashes: int) -> Iterator[int]:
+    """
+    Derive the filter bits of a checksum by double hashing.
+
+    Checksums are uniformly distributed already, so two 64-bit words of
+    the digest serve as the two base hashes.
+    """
+    first = int.from_bytes(checksum[:8], "little")
+    step = int.from_bytes(checksum[8:16], "little") | 1
+    return ((first + i * step) % bits for i in range(hashes))
+
+
+def _contains(sizes: Sequence[int], size: int) -> bool:
+    index = bisect_left(sizes, size)
+    return index < len(sizes) and sizes[index] == size
+
+
+def build_index(db_path: Path, index_path: Path) -> Dict[str, int]:
+    """
+    Build the lookup index of a catalog.
+
+    The index is written to a temporary file and renamed into place, so
+    readers never see a partial index.
+
+    Returns:
+        Dict[str, int]: Counts of indexed sizes, checksums, and catalogued
+        files without a checksum.
+
+    Raises:
+        ValueError: If the catalog mixes hash algorithms.
+    """
+    conn = connect(db_path)
+    try:
+        algorithms = [
+            algorithm
+            for (algorithm,) in conn.execute(
+                "SELECT DISTINCT hash_algorithm FROM file_info "
+                "WHERE hash_algorithm IS NOT NULL"
+            )
+        ]
+        if len(algorithms) > 1:
+            raise ValueError(
+                f"Catalog {db_path} mixes hash algorithms {sorted(algorithms)}; "
+                "rescan it with one --hash-algorithm"
+            )
+        sizes = array(
+            "Q",
+            (
+                size
+                for (size,) in conn.execute(
+                    "SELECT DISTINCT file_size FROM file_info ORDER BY file_size"
+                )
+            ),
+        )
+        unhashed_sizes = array(
+            "Q",
+            (
+                size
+                for (size,) in conn.execute(
+                    "SELECT DISTINCT file_size FROM file_info "
+                    "WHERE checksum IS NULL ORDER BY file_size"
+                )
+            ),
+        )
+        (checksums,) = conn.execute(
+            "SELECT COUNT(DISTINCT checksum) FROM file_info"
+        ).fetchone()
+        (unhashed,) = conn.execute(
+            "SELECT COUNT(*) FROM file_info WHERE checksum IS NULL"
+        ).fetchone()
+        bits = max(8, -(-checksums * BLOOM_BITS_PER_CHECKSUM // 8) * 8)
+        bloom = bytearray(bits // 8)
+        for (checksum,) in conn.execute(
+            "SELECT DISTINCT checksum FROM file_info WHERE checksum IS NOT NULL"
+        ):
+            for position in _bloom_positions(checksum, bits, BLOOM_HASHES):
+                bloom[position >> 3] |= 1 << (position & 7)
+    finally:
+        conn.close()
+
+    algorithm = algorithms[0] if algorithms else DEFAULT_HASH_ALGORITHM
+    header = INDEX_HEADER.pack(
+        INDEX_MAGIC,
+        algorithm.encode(),
+        *catalog_signature(db_path),
+        len(sizes),
+        len(unhashed_sizes),
+        bits,
+        BLOOM_HASHES,
+    )
+    partial_path = index_path.with_name(index_path.name + ".tmp")
+    with partial_path.open("wb") as f:
+        f.write(header)
+        sizes.tofile(f)
+        unhashed_sizes.tofile(f)
+        f.write(bloom)
+    os.replace(partial_path, index_path)
+    if unhashed:
+        logging.warning(
+            f"{unhashed} catalogued files have no checksum; incoming files of "
+            "their sizes are compared by reading them. Scan the archive with "
+            "--shard-id to hash every file."
+        )
+    return {"sizes": len(sizes), "checksums": checksums, "unhashed_files": unhashed}
+
+
+class CatalogIndex:
+    """A memory-mapped catalog index, as written by ``build_index``."""
+
+    def __init__(self, index_path: Path):
+        self.path = index_path
+        with index_path.open("rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fields = INDEX_HEADER.unpack_from(self._map)
+        except struct.error:
+            fields = (b"",)
+        if fields[0] != INDEX_MAGIC:
+            self._map.close()
+            raise ValueError(f"{index_path} is not a catalog index")
+        self.algorithm = fields[1].rstrip(b"\0").decode()
+        self.signature: CatalogSignature = fields[2:6]
+        size_count, unhashed_count, self.bloom_bits, self.bloom_hashes = fields[6:]
+        self._view = memoryview(self._map)
+        offset = INDEX_HEADER.size
+        end = offset + 8 * size_count
+        self.sizes = self._view[offset:end].cast("Q")
+        offset, end = end, end + 8 * unhashed_count
+        self.unhashed_sizes = self._view[offset:end].cast("Q")
+        self.bloom = self._view[end : end + self.bloom_bits // 8]
+
+    def __enter__(self) -> "CatalogIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unmap the index."""
+        for view in (self.sizes, self.unhashed_sizes, self.bloom, self._view):
+            view.release()
+        self._map.close()
+
+    def has_size(self, size: int) -> bool:
+        """Return True if a catalogued file has this size."""
+        return _contains(self.sizes, size)
+
+    def has_unhashed_size(self, size: int) -> bool:
+        """Return True if a catalogued file of this size has no checksum."""
+        return _contains(self.unhashed_sizes, size)
+
+    def may_contain(self, checksum: bytes) -> bool:
+        """
+        Return False if no catalogued file has this checksum, and True if
+        one may have it.
+        """
+        return all(
+            self.bloom[position >> 3] & (1 << (position & 7))
+            for position in _bloom_positions(
+                checksum, self.bloom_bits, self.bloom_hashes
+            )
+        )
+
+
+def update_index(
+    db_path: Path, index_path: Path, checksums: Iterable[bytes], sizes: Iterable[int]
+) -> None:
+    """
+    Add checksums just stored in a catalog to its index, in place.
+
+    The checksums are set in the Bloom filter, and ``sizes``, those of the
+    files they were stored for, are dropped from the unhashed sizes once no
+    file of the size lacks a checksum. The index then takes the catalog's
+    new signature, so it is not rebuilt. Bits are set before the signature
+    is written: an update cut short leaves a stale index, never a wrong one.
+    """
+    conn = connect(db_path)
+    try:
+        hashed = [
+            size
+            for size in sorted(set(sizes))
+            if conn.execute(UNHASHED_SIZE_SQL, (size,)).fetchone() is None
+        ]
+    finally:
+        conn.close()
+    with index_path.open("r+b") as f, mmap.mmap(f.fileno(), 0) as view:
+        fields = INDEX_HEADER.unpack_from(view)
+        size_count, unhashed_count, bits, hashes = fields[6:]
+        offset = INDEX_HEADER.size + 8 * size_count
+        end = offset + 8 * unhashed_count
+        unhashed = array("Q", view[offset:end])
+        for size in hashed:
+            index = bisect_left(unhashed, size)
+            if index < len(unhashed) and unhashed[index] == size:
+                del unhashed[index]
+                unhashed.append(NO_SIZE)
+        view[offset:end] = unhashed.tobytes()
+        for checksum in checksums:
+            for position in _bloom_positions(checksum, bits, hashes):
+                view[end + (position >> 3)] |= 1 << (position & 7)
+        view.flush()
+        INDEX_HEADER.pack_into(
+            view, 0, *fields[:2], *catalog_signature(db_path), *fields[6:]
+        )
+        view.flush()
+
+
+def open_index(db_path: Path, index_path: Path, rebuild: bool = False) -> CatalogIndex:
+    """
+    Open the index of a catalog, building it first if it is missing,
+    stale or ``rebuild`` is set.
+    """
+    if not rebuild and index_path.exists():
+        index = CatalogIndex(index_path)
+        if index.signature == catalog_signature(db_path):
+            return index
+        index.close()
+        logging.info(f"Catalog {db_path} changed since {index_path} was built")
+    logging.info(f"Building catalog index {index_path}")
+    stats = build_index(db_path, index_path)
+    logging.info(
+        f"Indexed {stats['sizes']} file sizes and {stats['checksums']} checksums"
+    )
+    return CatalogIndex(index_path)
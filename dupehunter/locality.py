@@ -0,0 +1,153 @@
+"""
+Hashing in on-disk order, for spinning disks where every seek costs a
+rotation and moving the heads costs more.
+
+Candidate files are taken in batches and sorted by device and by the
+physical offset of their first extent, which the FIEMAP ioctl reports on
+Linux. Where it does not, the inode number stands in: filesystems tend to
+place the data of nearby inodes close together. Each device is then read
+by a fixed number of readers working through its files in that order, so
+the heads sweep across the disk instead of jumping between files.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, islice
+from typing import Any, AsyncIterator, Callable, Deque, Iterable, List, Tuple
+
+from dupehunter.archives import split_member_path
+from dupehunter.constants import DISK_ORDER_BATCH_SIZE
+
+FS_IOC_FIEMAP = 0xC020660B
+# struct fiemap: start, length, flags, mapped and allocated extent counts
+FIEMAP_HEADER = struct.Struct("=QQIIII")
+# struct fiemap_extent: logical, physical, length, two reserved, flags
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+# Set on extents whose location is not known yet, e.g. delayed allocation
+FIEMAP_EXTENT_UNKNOWN = 0x2
+
+# (device, 0 with a physical offset or 1 with an inode number, position)
+Location = Tuple[int, int, int]
+
+
+def first_extent(fd: int) -> int:
+    """
+    Return the physical byte offset of a file's first extent.
+
+    Raises:
+        OSError: If the filesystem does not support FIEMAP, or the file has
+        no extent or one not yet placed on disk.
+    """
+    import fcntl
+
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 2**64 - 1, 0, 0, 1, 0)
+    fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    if not FIEMAP_HEADER.unpack_from(request)[3]:
+        raise OSError(f"File descriptor {fd} has no extent")
+    extent = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+    if extent[5] & FIEMAP_EXTENT_UNKNOWN:
+        raise OSError(f"File descriptor {fd} has not been placed on disk yet")
+    return extent[1]
+
+
+def locate(file_path: str) -> Location:
+    """
+    Find where a file's data starts on disk.
+
+    Archive members are located by their archive. Files that cannot be
+    opened sort last, to fail where they would have anyway.
+    """
+    member = split_member_path(file_path)
+    path = member[0] if member else file_path
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return (-1, 1, 0)
+    try:
+        stat_result = os.fstat(fd)
+        if sys.platform.startswith("linux"):
+            try:
+                return (stat_result.st_dev, 0, first_extent(fd))
+            except OSError:
+                pass
+        return (stat_result.st_dev, 1, stat_result.st_ino)
+    finally:
+        os.close(fd)
+
+
+def sort_by_location(batch: List[Tuple]) -> List[Tuple[Location, Tuple]]:
+    """Pair argument tuples, whose first item is a path, with their locations,
+    in on-disk order."""
+    located = [(locate(args[0]), args) for args in batch]
+    located.sort(key=lambda item: (item[0], item[1][0]))
+    return located
+
+
+async def map_in_disk_order(
+    func: Callable,
+    items: Iterable[Tuple],
+    readers_per_device: int,
+    batch_size: int = DISK_ORDER_BATCH_SIZE,
+) -> AsyncIterator[Tuple[Tuple, Any]]:
+    """
+    Run ``func(*args)`` for every argument tuple in ``items``, reading each
+    device in on-disk order with ``readers_per_device`` readers.
+
+    ``items`` are taken ``batch_size`` at a time and sorted by
+    ``sort_by_location``; the first item of each tuple is the file's path.
+    Every device of a batch gets its own readers, so devices are read in
+    parallel while each sees at most ``readers_per_device`` requests.
+
+    Yields:
+        Tuple[Tuple, Any]: Each argument tuple with its result, in
+        completion order, as ``WorkerPool.map`` yields them.
+    """
+    if readers_per_device < 1:
+        raise ValueError("Readers per device must be at least 1.")
+    loop = asyncio.get_running_loop()
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def read(files: Deque[Tuple], executor: ThreadPoolExecutor) -> None:
+        try:
+            while files:
+                args = files.popleft()
+                result = await loop.run_in_executor(executor, func, *args)
+                await results.put((args, result))
+        except Exception as error:
+            await results.put((None, error))
+
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        located = await loop.run_in_executor(None, sort_by_location, batch)
+        devices = [
+            deque(args for _, args in files)
+            for _, files in groupby(located, key=lambda item: item[0][0])
+        ]
+        logging.debug(f"Reading {len(batch)} files from {len(devices)} devices")
+        with ThreadPoolExecutor(
+            max_workers=readers_per_device * len(devices),
+            thread_name_prefix="dupehunter-disk-order",
+        ) as executor:
+            tasks = [
+                asyncio.ensure_future(read(files, executor))
+                for files in devices
+                for _ in range(readers_per_device)
+            ]
+            try:
+                for _ in batch:
+                    args, result = await results.get()
+                    if args is None:
+                        raise result
+                    yield args, result
+            finally:
+                for task in tasks:
+                    task.cancel()
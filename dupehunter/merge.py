@@ -0,0 +1,209 @@
+"""
+Merge the catalogs of a tree scanned in shards into one catalog, so
+duplicates are found across every shard.
+
+Usage:
+    python -m dupehunter.cli --base-path /images --target-path /out \\
+        --db-path node-1.db --shard-id node-1
+    python -m dupehunter.merge --db-path merged.db node-1.db node-2.db
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dupehunter.constants import (
+    DEFAULT_DELETE_CANDIDATES_FILE,
+    DEFAULT_LOG_LEVEL,
+    DEFAULT_MERGED_DB_PATH,
+    DEFAULT_REPORT_FORMAT,
+    REPORT_FORMATS,
+)
+from dupehunter.database import (
+    INODE_KEY_SQL,
+    connect,
+    count_rows,
+    duplicate_savings,
+    initialize_database,
+    iter_duplicate_groups,
+)
+from dupehunter.reports import write_delete_candidates
+from dupehunter.utils import configure_logging, human_readable_size
+
+# Columns copied from a shard catalog; paths are prefixed with the shard id
+MERGED_COLUMNS = (
+    "checksum",
+    "metadata",
+    "file_size",
+    "partial_checksum",
+    "st_dev",
+    "st_ino",
+    "st_mtime_ns",
+    "perceptual_hash",
+    "exif_datetime_original",
+    "exif_camera_model",
+    "hash_algorithm",
+    "content_checksum",
+)
+# Inserts new shard files and updates changed ones. Unchanged rows are not
+# written, and updated rows keep their id, so gold copies stay stable.
+MERGE_SHARD_SQL = f"""
+    INSERT INTO file_info (file_path, {", ".join(MERGED_COLUMNS)}, shard)
+    SELECT ?1 || ':' || file_path, {", ".join(MERGED_COLUMNS)}, ?1
+    FROM shard.file_info WHERE true ORDER BY file_path
+    ON CONFLICT (file_path) DO UPDATE SET
+        {", ".join(f"{column} = excluded.{column}" for column in MERGED_COLUMNS)}
+    WHERE ({", ".join(MERGED_COLUMNS)}) IS NOT
+        ({", ".join(f"excluded.{column}" for column in MERGED_COLUMNS)})
+"""
+# Files a shard no longer has
+REMOVE_SHARD_FILES_SQL = """
+    DELETE FROM file_info WHERE shard = ?1 AND substr(file_path, length(?1) + 2)
+        NOT IN (SELECT file_path FROM shard.file_info)
+"""
+
+
+def merge_catalog(
+    merged_db: Path, shard_db: Path, shard_id: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Merge one shard catalog into ``merged_db``, incrementally.
+
+    Files are stored as ``<shard_id>:<file_path>``. Merging a shard again
+    only writes the files that changed since the last merge and drops the
+    ones the shard no longer has.
+
+    Parameters:
+        merged_db (Path): Catalog to merge into; created if missing.
+        shard_db (Path): Catalog written by a scan with ``--shard-id``.
+        shard_id (Optional[str]): Overrides the shard id stored in the shard
+            catalog, or its file name if it has none.
+
+    Returns:
+        Dict[str, int]: Counts of the shard's files, changed and removed
+        files, and shard files that have no checksum.
+
+    Raises:
+        ValueError: If the shard was hashed with another algorithm than the
+            catalogs already merged.
+    """
+    initialize_database(merged_db)
+    conn = connect(merged_db)
+    try:
+        conn.execute("ATTACH DATABASE ? AS shard", (str(shard_db),))
+        if shard_id is None:
+            row = conn.execute(
+                "SELECT value FROM shard.catalog_info WHERE key = 'shard_id'"
+            ).fetchone()
+            shard_id = row[0] if row else shard_db.stem
+
+        algorithms = {
+            algorithm
+            for (algorithm,) in conn.execute(
+                """
+                SELECT hash_algorithm FROM shard.file_info
+                UNION SELECT hash_algorithm FROM main.file_info WHERE shard != ?
+                """,
+                (shard_id,),
+            )
+            if algorithm is not None
+        }
+        if len(algorithms) > 1:
+            raise ValueError(
+                f"Shard {shard_id} mixes hash algorithms {sorted(algorithms)}; "
+                "rescan every shard with the same --hash-algorithm"
+            )
+
+        with conn:
+            removed = conn.execute(REMOVE_SHARD_FILES_SQL, (shard_id,)).rowcount
+            changed = conn.execute(MERGE_SHARD_SQL, (shard_id,)).rowcount
+        files, unhashed = conn.execute(
+            "SELECT COUNT(*), COUNT(*) - COUNT(checksum) FROM shard.file_info"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if unhashed:
+        logging.warning(
+            f"Shard {shard_id} has {unhashed} files without a checksum; "
+            "scan it with --shard-id so they are compared with other shards"
+        )
+    return {
+        "files": files,
+        "changed_files": changed,
+        "removed_files": removed,
+        "unhashed_files": unhashed,
+    }
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+    """Parse command-line arguments for the merge command."""
+    parser = argparse.ArgumentParser(description="Merge DupeHunter shard catalogs")
+    parser.add_argument("shards", nargs="+", type=Path, help="Shard catalogs")
+    parser.add_argument(
+        "--db-path",
+        default=DEFAULT_MERGED_DB_PATH,
+        type=Path,
+        help="Merged catalog to create or update (default: merged_catalog.db)",
+    )
+    parser.add_argument(
+        "--delete-candidates",
+        default=DEFAULT_DELETE_CANDIDATES_FILE,
+        type=Path,
+        help="File to write cross-shard delete candidates to",
+    )
+    parser.add_argument(
+        "--report-format",
+        default=DEFAULT_REPORT_FORMAT,
+        choices=REPORT_FORMATS,
+        help="Format of the delete candidates (default: text)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=DEFAULT_LOG_LEVEL,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help="Set the logging level (default: INFO)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    """Merge the shard catalogs and report duplicates across them."""
+    args = parse_arguments(argv)
+    configure_logging(args.log_level)
+
+    for shard_db in args.shards:
+        if not shard_db.is_file():
+            logging.error(f"Shard catalog {shard_db} does not exist")
+            return 1
+        try:
+            stats = merge_catalog(args.db_path, shard_db)
+        except ValueError as error:
+            logging.error(str(error))
+            return 1
+        logging.info(
+            f"Merged {shard_db}: {stats['files']} files, "
+            f"{stats['changed_files']} new or changed, "
+            f"{stats['removed_files']} removed"
+        )
+
+    logging.info(f"Writing delete candidates to {args.delete_candidates}")
+    write_delete_candidates(
+        iter_duplicate_groups(args.db_path), args.delete_candidates, args.report_format
+    )
+    groups = count_rows(
+        args.db_path,
+        "SELECT checksum FROM file_info WHERE checksum IS NOT NULL "
+        f"GROUP BY checksum HAVING COUNT(DISTINCT {INODE_KEY_SQL}) > 1",
+    )
+    logging.info(
+        f"Found {groups} duplicate groups across shards, potential storage "
+        f"savings: {human_readable_size(duplicate_savings(args.db_path))}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
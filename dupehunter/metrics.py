@@ -0,0 +1,272 @@
+"""Run metrics: stage timings, counters, gauges and latency histograms."""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from dupehunter.constants import DEFAULT_METRICS_INTERVAL, LATENCY_BUCKETS
+from dupehunter.utils import human_readable_size
+
+PROMETHEUS_PREFIX = "dupehunter"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> List[int]:
+        """Return the number of values at or below each bucket bound and +Inf."""
+        totals, running = [], 0
+        for count in self.counts:
+            running += count
+            totals.append(running)
+        return totals
+
+
+class Metrics:
+    """
+    Collects the metrics of one run.
+
+    A disabled instance ignores every call after a single attribute check,
+    so instrumented code pays next to nothing when metrics are off. Updates
+    may come from the event loop, worker callbacks and the database writer
+    thread, and are serialised by a lock.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.monotonic()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.stages: Dict[str, float] = {}
+        self.current_stage: Optional[str] = None
+        self.stage_started = self.started
+        self.stage_total: Optional[int] = None
+        self.stage_done = 0
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add ``value`` to counter ``name``."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set gauge ``name`` to its current ``value``."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record ``value`` in histogram ``name``."""
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def advance(self, done: int = 1) -> None:
+        """Count ``done`` items as finished in the current stage."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.stage_done += done
+
+    @contextmanager
+    def stage(self, name: str, total: Optional[int] = None) -> Iterator[None]:
+        """
+        Time a pipeline stage.
+
+        ``total`` is the number of items the stage will ``advance`` through,
+        if known, and is used to estimate the time remaining.
+        """
+        if not self.enabled:
+            yield
+            return
+        with self.lock:
+            self.current_stage = name
+            self.stage_started = time.monotonic()
+            self.stage_total = total
+            self.stage_done = 0
+        try:
+            yield
+        finally:
+            with self.lock:
+                elapsed = time.monotonic() - self.stage_started
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+                self.current_stage = None
+
+    def progress(self) -> str:
+        """Describe the current stage's progress and the run totals."""
+        with self.lock:
+            elapsed = time.monotonic() - self.stage_started
+            parts = []
+            if self.current_stage:
+                rate = self.stage_done / elapsed if elapsed else 0.0
+                done = f"{self.stage_done}"
+                if self.stage_total:
+                    share = self.stage_done / self.stage_total
+                    done += f"/{self.stage_total} ({share:.1%})"
+                parts.append(f"{self.current_stage}: {done} at {rate:.1f}/s")
+                if self.stage_total and rate:
+                    remaining = (self.stage_total - self.stage_done) / rate
+                    parts.append(f"ETA {timedelta(seconds=round(remaining))}")
+            parts.append(
+                f"seen {int(self.counters.get('files_seen', 0))}, "
+                f"hashed {int(self.counters.get('files_hashed', 0))}, "
+                f"read {human_readable_size(self.counters.get('bytes_read', 0))}"
+            )
+        return " | ".join(parts)
+
+    def summary(self) -> Dict:
+        """Return every metric as a JSON-serialisable dictionary."""
+        with self.lock:
+            return {
+                "elapsed_seconds": time.monotonic() - self.started,
+                "current_stage": self.current_stage,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {
+                    name: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "mean": histogram.sum / histogram.count,
+                        "max": histogram.max,
+                        "buckets": dict(
+                            zip(
+                                [str(bound) for bound in histogram.buckets] + ["+Inf"],
+                                histogram.cumulative(),
+                            )
+                        ),
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_elapsed_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_elapsed_seconds {summary['elapsed_seconds']}",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge",
+        ]
+        for stage, seconds in summary["stages"].items():
+            lines.append(
+                f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{stage}"}} {seconds}'
+            )
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_total {value}")
+        for name, value in summary["gauges"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name} {value}")
+        for name, histogram in summary["histograms"].items():
+            metric = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{metric}_sum {histogram['sum']}")
+            lines.append(f"{metric}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared disabled instance used when no metrics are requested
+NO_METRICS = Metrics(enabled=False)
+
+
+def _write_atomically(path: Path, text: str) -> None:
+    """Replace ``path`` in one step so readers never see a partial file."""
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text(text)
+    os.replace(temporary, path)
+
+
+class MetricsReporter:
+    """
+    Reports a run's metrics while it runs and once it ends.
+
+    Every ``interval`` seconds a background thread logs a progress line,
+    if ``progress`` is set, and rewrites the JSON summary and Prometheus
+    textfile, if their paths are given. Leaving the context writes the
+    final exports.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        progress: bool = False,
+        json_path: Optional[Path] = None,
+        prometheus_path: Optional[Path] = None,
+        interval: float = DEFAULT_METRICS_INTERVAL,
+    ):
+        self.metrics = metrics
+        self.show_progress = progress
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="dupehunter-metrics", daemon=True
+        )
+
+    def __enter__(self) -> "MetricsReporter":
+        if self.metrics.enabled:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if not self.metrics.enabled:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.export()
+        if self.show_progress:
+            logging.info(f"Stage timings: {self._format_stages()}")
+
+    def export(self) -> None:
+        """Write the configured metrics files."""
+        try:
+            if self.json_path:
+                summary = json.dumps(self.metrics.summary(), indent=2)
+                _write_atomically(self.json_path, summary)
+            if self.prometheus_path:
+                _write_atomically(self.prometheus_path, self.metrics.prometheus())
+        except OSError as error:
+            logging.error(f"Error writing metrics: {error}")
+
+    def _format_stages(self) -> str:
+        return ", ".join(
+            f"{stage} {seconds:.2f}s" for stage, seconds in self.metrics.stages.items()
+        )
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            if self.show_progress:
+                logging.info(self.metrics.progress())
+            self.export()
@@ -0,0 +1,177 @@
+"""Bounded worker pools for hashing and metadata extraction."""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    TypeVar,
+)
+
+from dupehunter.constants import (
+    DEFAULT_POOL_KIND,
+    DEFAULT_WORKERS,
+    POOL_BATCH_SIZE,
+    POOL_KINDS,
+)
+from dupehunter.metrics import NO_METRICS, Metrics
+
+T = TypeVar("T")
+
+# Marks the end of a prefetched iterable
+_DONE = object()
+
+
+def _run_batch(func: Callable, batch: List[Tuple]) -> List[Any]:
+    """Apply ``func`` to every argument tuple of a batch inside a worker."""
+    return [func(*args) for args in batch]
+
+
+def _run_timed_batch(func: Callable, batch: List[Tuple]) -> List[Tuple[Any, float]]:
+    """Like ``_run_batch``, pairing each result with its run time in seconds."""
+    results = []
+    for args in batch:
+        start = time.perf_counter()
+        result = func(*args)
+        results.append((result, time.perf_counter() - start))
+    return results
+
+
+class WorkerPool:
+    """
+    A thread or process pool that maps a function over work items.
+
+    Items are sent to the workers in batches and at most two batches per
+    worker are in flight, so memory stays flat however many items the
+    input iterable produces. With ``metrics`` enabled, the run time of
+    every call is recorded in the ``<func>_seconds`` histogram and the
+    number of batches in flight in the ``pool_pending_batches`` gauge.
+    """
+
+    def __init__(
+        self,
+        kind: str = DEFAULT_POOL_KIND,
+        workers: int = DEFAULT_WORKERS,
+        batch_size: int = POOL_BATCH_SIZE,
+        metrics: Metrics = NO_METRICS,
+    ):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown pool kind: {kind}")
+        if workers < 1:
+            raise ValueError("Worker count must be at least 1.")
+        self.kind = kind
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_pending = 2 * workers
+        self.metrics = metrics
+        self.executor: Executor = (
+            ThreadPoolExecutor(max_workers=workers)
+            if kind == "thread"
+            else ProcessPoolExecutor(max_workers=workers)
+        )
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """Wait for running work and release the workers."""
+        self.executor.shutdown(wait=True)
+
+    async def map(
+        self, func: Callable, items: Iterable[Tuple]
+    ) -> AsyncIterator[Tuple[Tuple, Any]]:
+        """
+        Run ``func(*args)`` for every argument tuple in ``items``.
+
+        ``func`` must be a module-level function so process pools can
+        pickle it.
+
+        Yields:
+            Tuple[Tuple, Any]: Each argument tuple with its result, in
+            completion order.
+        """
+        loop = asyncio.get_running_loop()
+        pending: Dict[asyncio.Future, List[Tuple]] = {}
+        metrics = self.metrics
+        runner = _run_timed_batch if metrics.enabled else _run_batch
+        histogram = f"{func.__name__}_seconds"
+
+        def submit(batch: List[Tuple]) -> None:
+            future = loop.run_in_executor(self.executor, runner, func, batch)
+            pending[future] = batch
+            metrics.set_gauge("pool_pending_batches", len(pending))
+
+        def collect(future: asyncio.Future) -> List[Tuple[Tuple, Any]]:
+            results = future.result()
+            if metrics.enabled:
+                for _, seconds in results:
+                    metrics.observe(histogram, seconds)
+                results = [result for result, _ in results]
+            batch = pending.pop(future)
+            metrics.set_gauge("pool_pending_batches", len(pending))
+            return list(zip(batch, results))
+
+        batch: List[Tuple] = []
+        for args in items:
+            batch.append(args)
+            if len(batch) < self.batch_size:
+                continue
+            submit(batch)
+            batch = []
+            while len(pending) >= self.max_pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    for result in collect(future):
+                        yield result
+        if batch:
+            submit(batch)
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                for result in collect(future):
+                    yield result
+
+
+def prefetch(items: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Produce ``items`` in a background thread into a bounded queue.
+
+    The producer runs ahead of the consumer by at most ``maxsize`` items,
+    so slow system calls in the producer overlap with the consumer's work
+    without buffering the whole iterable. Exceptions raised by the
+    producer are re-raised in the consumer.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    failure: List[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as error:
+            failure.append(error)
+        finally:
+            buffer.put(_DONE)
+
+    threading.Thread(target=produce, name="dupehunter-prefetch", daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is _DONE:
+            break
+        yield item
+    if failure:
+        raise failure[0]
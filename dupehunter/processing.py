@@ -1,60 +1,590 @@
-import asyncio
+import json
 import logging
 import os
-import sqlite3
 from pathlib import Path
-from typing import List
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Set,
+    Tuple,
+)
 
-from dupehunter.constants import SUPPORTED_EXTENSIONS
-from dupehunter.files import calculate_checksum, extract_metadata
+from dupehunter.archives import is_archive, iter_archive_members
+from dupehunter.constants import (
+    ARCHIVE_SEPARATOR,
+    DEFAULT_DISK_ORDER,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_READ_AHEAD,
+    PARTIAL_CHECKSUM_SIZE,
+    SCAN_QUEUE_SIZE,
+    SUPPORTED_EXTENSIONS,
+)
+from dupehunter.database import (
+    PARTIAL_COLLISIONS_SQL,
+    REMOVE_FILE_SQL,
+    RESET_CHECKSUMS_SQL,
+    SIZE_COLLISIONS_SQL,
+    STORE_FILE_SQL,
+    UNHASHED_CONTENT_SQL,
+    UNHASHED_FILES_SQL,
+    UPDATE_CHECKSUM_SQL,
+    UPDATE_CONTENT_CHECKSUM_SQL,
+    UPDATE_METADATA_SQL,
+    UPDATE_PARTIAL_CHECKSUM_SQL,
+    UPDATE_PERCEPTUAL_HASH_SQL,
+    DatabaseWriter,
+    Signature,
+    count_rows,
+    iter_duplicates_without_metadata,
+    iter_partial_collisions,
+    iter_signatures,
+    iter_size_collisions,
+    iter_unhashed_content,
+    iter_unhashed_files,
+    iter_unhashed_images,
+    sized_query,
+    unique_size_bytes,
+)
+from dupehunter.files import (
+    calculate_checksum,
+    calculate_content_checksum,
+    calculate_partial_checksum,
+    calculate_perceptual_hash,
+    extract_metadata,
+)
+from dupehunter.metrics import NO_METRICS, Metrics
+from dupehunter.pool import WorkerPool, prefetch
+from dupehunter.utils import is_storable_path
 
 logger = logging.getLogger(__name__)
 
 
-async def process_file(file_path: Path, db_path: Path) -> None:
+def stat_signature(stat_result: os.stat_result) -> Signature:
+    """Return the fields that identify an unchanged file."""
+    return (
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+
+
+def process_file(file_path: str, stat_result: os.stat_result) -> Tuple:
     """
-    Process a single file: calculate checksum, extract metadata,
-    and store in the database.
+    Process a single file: build its catalog row from its stat result.
+    Checksums are filled in later by ``hash_candidates`` for files that
+    may have a duplicate, and metadata by ``extract_duplicate_metadata``
+    for files that turn out to have one.
     """
-    checksum = calculate_checksum(file_path)
-    if not checksum:
-        return
+    return (
+        file_path,
+        stat_result.st_size,
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_mtime_ns,
+    )
 
-    metadata = extract_metadata(file_path)
-    file_size = file_path.stat().st_size
 
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO file_info (file_path, checksum, metadata, file_size)
-            VALUES (?, ?, ?, ?)
-            """,
-            (str(file_path), checksum, metadata, file_size),
+def hash_file_ends(
+    file_path: str, file_size: int, algorithm: str
+) -> Tuple[bytes, str, int]:
+    """
+    Return ``(partial_checksum, file_path, file_size)`` for a worker.
+
+    Checksums are returned, and stored, as raw digests; an empty digest
+    means the file could not be read.
+    """
+    checksum = calculate_partial_checksum(
+        Path(file_path), file_size, algorithm=algorithm
+    )
+    return bytes.fromhex(checksum), file_path, file_size
+
+
+def hash_file(
+    file_path: str, file_size: int, algorithm: str, xattr_cache: bool = False
+) -> Tuple[bytes, str, int]:
+    """Return ``(checksum, file_path, file_size)`` for a worker."""
+    checksum = calculate_checksum(Path(file_path), algorithm, xattr_cache)
+    return bytes.fromhex(checksum), file_path, file_size
+
+
+def _map_reads(
+    func: Callable, items: Iterable[Tuple], pool: WorkerPool, disk_order: int
+) -> AsyncIterator[Tuple[Tuple, Any]]:
+    """Run ``func`` over ``items`` in ``pool``, or in on-disk order."""
+    if not disk_order:
+        return pool.map(func, items)
+    from dupehunter.locality import map_in_disk_order
+
+    return map_in_disk_order(func, items, disk_order)
+
+
+def _full_hashes(
+    rows: Iterable[Tuple[str, int]],
+    pool: WorkerPool,
+    algorithm: str,
+    metrics: Metrics,
+    read_ahead: int,
+    xattr_cache: bool,
+    disk_order: int,
+) -> AsyncIterator[Tuple[bytes, str, int]]:
+    """Hash ``(file_path, file_size)`` rows in full, as ``hash_candidates`` does."""
+    if read_ahead:
+        from dupehunter.readahead import read_ahead_hashes
+
+        return read_ahead_hashes(rows, algorithm, read_ahead, metrics, xattr_cache)
+    candidates = (row + (algorithm, xattr_cache) for row in rows)
+    return (row async for _, row in _map_reads(hash_file, candidates, pool, disk_order))
+
+
+async def hash_candidates(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+    metrics: Metrics = NO_METRICS,
+    hash_all: bool = False,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    xattr_cache: bool = False,
+    disk_order: int = DEFAULT_DISK_ORDER,
+    sizes: Optional[Set[int]] = None,
+) -> Dict[str, int]:
+    """
+    Hash catalogued files that may have a duplicate, in stages.
+
+    Files with a unique size are never read. Files sharing a size get a
+    partial checksum of their first and last blocks, and only files whose
+    size and partial checksum both collide are hashed in full. With
+    ``hash_all``, for shard catalogs whose duplicates may live on other
+    shards, every file is hashed in full instead. With ``read_ahead``,
+    full hashes are read by ``readahead.read_ahead_hashes`` with that many
+    files in flight, instead of by ``pool``. With ``xattr_cache``, full
+    checksums cached in the files' extended attributes are used, and new
+    ones cached. With ``disk_order``, both stages read files in on-disk
+    order through ``locality.map_in_disk_order``, with that many readers
+    per device, instead of through ``pool``. With ``sizes``, only files of
+    those sizes are considered, so a few new files are hashed without
+    querying the whole catalog.
+
+    Returns:
+        Dict[str, int]: Bytes skipped by the size and partial-hash stages.
+    """
+
+    if hash_all:
+        stats = {"size_skipped_bytes": 0}
+        full_query, full_rows = UNHASHED_FILES_SQL, iter_unhashed_files
+    else:
+        stats = {"size_skipped_bytes": unique_size_bytes(db_path, sizes)}
+        full_query, full_rows = PARTIAL_COLLISIONS_SQL, iter_partial_collisions
+    partial_skipped_bytes = 0
+    both_ends = 2 * PARTIAL_CHECKSUM_SIZE
+
+    if not hash_all:
+        query = sized_query(SIZE_COLLISIONS_SQL, sizes)
+        total = count_rows(db_path, *query) if metrics.enabled else None
+        with metrics.stage("hash_partial", total):
+            rows = iter_size_collisions(db_path, sizes)
+            candidates = (row + (algorithm,) for row in rows)
+            async for _, row in _map_reads(
+                hash_file_ends, candidates, pool, disk_order
+            ):
+                metrics.advance()
+                partial_checksum, file_path, file_size = row
+                if not partial_checksum:
+                    continue
+                metrics.increment("bytes_read", min(file_size, both_ends))
+                update = (partial_checksum, algorithm, file_path)
+                writer.write(UPDATE_PARTIAL_CHECKSUM_SQL, update)
+                if file_size <= both_ends:
+                    # The whole file was read, so the partial checksum is the full one
+                    writer.write(UPDATE_CHECKSUM_SQL, update)
+                    metrics.increment("files_hashed")
+                else:
+                    partial_skipped_bytes += file_size - both_ends
+                    metrics.increment("files_partially_hashed")
+            writer.flush()
+
+    query = sized_query(full_query, sizes)
+    total = count_rows(db_path, *query) if metrics.enabled else None
+    with metrics.stage("hash_full", total):
+        results = _full_hashes(
+            full_rows(db_path, sizes),
+            pool,
+            algorithm,
+            metrics,
+            read_ahead,
+            xattr_cache,
+            disk_order,
+        )
+        async for checksum, file_path, file_size in results:
+            metrics.advance()
+            if checksum:
+                writer.write(UPDATE_CHECKSUM_SQL, (checksum, algorithm, file_path))
+                partial_skipped_bytes -= file_size - both_ends
+                metrics.increment("files_hashed")
+                metrics.increment("bytes_read", file_size)
+        writer.flush()
+
+    stats["partial_skipped_bytes"] = max(partial_skipped_bytes, 0)
+    return stats
+
+
+def perceptual_hash_file(file_path: str) -> Tuple[str, str]:
+    """Return ``(perceptual_hash, file_path)`` for a worker."""
+    return calculate_perceptual_hash(Path(file_path)), file_path
+
+
+async def hash_perceptually(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    metrics: Metrics = NO_METRICS,
+) -> int:
+    """
+    Compute perceptual hashes for catalogued files that lack one.
+
+    Images that cannot be decoded get an empty hash so they are not
+    retried on the next run.
+
+    Returns:
+        int: Number of files hashed successfully.
+    """
+    hashed = 0
+    with metrics.stage("perceptual_hash"):
+        rows = iter_unhashed_images(db_path)
+        async for _, row in pool.map(perceptual_hash_file, rows):
+            metrics.advance()
+            writer.write(UPDATE_PERCEPTUAL_HASH_SQL, row)
+            hashed += bool(row[0])
+        writer.flush()
+    return hashed
+
+
+def content_hash_file(file_path: str, algorithm: str) -> Tuple[bytes, str]:
+    """Return ``(content_checksum, file_path)`` for a worker."""
+    checksum = calculate_content_checksum(Path(file_path), algorithm)
+    return bytes.fromhex(checksum), file_path
+
+
+async def hash_content(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+    metrics: Metrics = NO_METRICS,
+) -> int:
+    """
+    Compute content checksums, which leave image metadata out, for
+    catalogued files that lack one.
+
+    Every file is read, as copies with edited metadata differ in size and
+    partial checksum; hardlinks of one inode are read once.
+
+    Returns:
+        int: Number of files hashed successfully.
+    """
+    hashed = 0
+    total = count_rows(db_path, UNHASHED_CONTENT_SQL) if metrics.enabled else None
+    with metrics.stage("content_hash", total):
+        items = (
+            (file_path, algorithm) for (file_path,) in iter_unhashed_content(db_path)
         )
-        conn.commit()
-    except Exception as error:
-        logging.error(f"Database insert error for {file_path}: {error}")
-    finally:
-        conn.close()
+        async for _, (checksum, file_path) in pool.map(content_hash_file, items):
+            metrics.advance()
+            if checksum:
+                writer.write(
+                    UPDATE_CONTENT_CHECKSUM_SQL, (checksum, algorithm, file_path)
+                )
+                hashed += 1
+        writer.flush()
+    return hashed
+
+
+def describe_file(file_path: str) -> Tuple[str, str, str, str]:
+    """
+    Return ``(metadata, datetime_original, camera_model, file_path)`` for a
+    worker, with the metadata as a JSON object.
+    """
+    metadata = extract_metadata(Path(file_path))
+    tags = json.loads(metadata)
+    return (
+        metadata,
+        tags.get("DateTimeOriginal"),
+        tags.get("Model"),
+        file_path,
+    )
+
+
+async def extract_duplicate_metadata(
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    metrics: Metrics = NO_METRICS,
+    sizes: Optional[Set[int]] = None,
+    key: str = "checksum",
+) -> int:
+    """
+    Read EXIF metadata for the members of duplicate groups only, of groups
+    of ``sizes`` only if given. Groups are formed on ``key``, so the gold
+    copy of each can be chosen by the date its photo was taken.
+
+    Returns:
+        int: Number of files whose metadata was read.
+    """
+    described = 0
+    with metrics.stage("metadata"):
+        rows = iter_duplicates_without_metadata(db_path, sizes, key)
+        async for _, row in pool.map(describe_file, rows):
+            metrics.advance()
+            writer.write(UPDATE_METADATA_SQL, row)
+            described += 1
+        writer.flush()
+    return described
 
 
 # Directory Traversal
-async def process_folder(root: str, files: List[str], db_path: Path) -> None:
-    """Process all files in a folder asynchronously."""
-    logger.debug(f"Scanning folder: {root}")
-    tasks = []
-    for file in files:
-        if Path(file).suffix.lower() in SUPPORTED_EXTENSIONS:
-            file_path = Path(root) / file
-            tasks.append(process_file(file_path.resolve(), db_path))
-    await asyncio.gather(*tasks)
-
-
-async def traverse_directory(base_path: Path, db_path: Path) -> None:
-    """Recursively traverse the directory and process image files."""
-    tasks = []
-    for root, _, files in os.walk(base_path):
-        tasks.append(process_folder(root, files, db_path))
-    await asyncio.gather(*tasks)
+def _entry_key(entry: os.DirEntry) -> str:
+    """
+    Sort key that makes a depth-first walk yield full paths in string order.
+
+    Directories sort as ``name/``, so ``a.jpg`` comes before the contents
+    of directory ``a`` exactly as ``.../a.jpg`` < ``.../a/...`` compares.
+    Archives sort as ``name!/``, the prefix of their members' paths.
+    """
+    try:
+        if entry.is_dir(follow_symlinks=False):
+            return entry.name + os.sep
+    except OSError:
+        return entry.name
+    return entry.name + ARCHIVE_SEPARATOR if is_archive(entry.name) else entry.name
+
+
+def _sorted_entries(directory: str) -> Iterator[os.DirEntry]:
+    """Return the sorted entries of one directory, or none if it is unreadable."""
+    try:
+        with os.scandir(directory) as entries:
+            return iter(sorted(entries, key=_entry_key))
+    except OSError as error:
+        logging.warning(f"Cannot scan directory {directory}: {error}")
+        return iter(())
+
+
+def walk_files(
+    base_path: Path, archives: bool = False
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Walk a directory tree with ``os.scandir``, yielding supported image files.
+
+    Paths are yielded in string order together with their ``DirEntry`` stat
+    results. Only the directories on the current branch are held in memory.
+    Symbolic links to directories are not followed and symbolic links to
+    files are skipped, as they hold no data of their own. With ``archives``,
+    the images inside zip and tar archives are yielded too, under their
+    composite paths, as ``archives.iter_archive_members`` yields them.
+    Entries whose names are not valid UTF-8 cannot be stored in the catalog
+    and are skipped with a warning.
+    """
+    stack = [_sorted_entries(str(base_path))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        if not is_storable_path(entry.path):
+            logging.warning(
+                f"Skipping {ascii(entry.path)}: its name is not valid UTF-8"
+            )
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(_sorted_entries(entry.path))
+                continue
+            if entry.is_symlink() or not entry.is_file(follow_symlinks=False):
+                continue
+            archive = archives and is_archive(entry.name)
+            extension = os.path.splitext(entry.name)[1].lower()
+            if not archive and extension not in SUPPORTED_EXTENSIONS:
+                continue
+            stat_result = entry.stat(follow_symlinks=False)
+        except OSError as error:
+            logging.error(f"Error reading file status for {entry.path}: {error}")
+            continue
+        if archive:
+            yield from iter_archive_members(entry.path, stat_result)
+        else:
+            yield entry.path, stat_result
+
+
+def iter_catalog_changes(
+    walked: Iterable[Tuple[str, os.stat_result]],
+    stored: Iterable[Tuple],
+    writer: DatabaseWriter,
+    stats: Dict[str, int],
+    metrics: Metrics = NO_METRICS,
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Merge the walked files with the stored catalog rows, both in path order.
+
+    New and changed files are stored, files whose stat signature matches
+    the stored one are skipped without being opened, and rows of files
+    that were not walked are removed. Neither side is held in memory.
+    The stored, unchanged and removed files are counted in ``stats``.
+
+    Yields:
+        Tuple[str, os.stat_result]: Each new or changed file, once its row
+        has been handed to ``writer``.
+    """
+    stored_rows = iter(stored)
+    row = next(stored_rows, None)
+    for file_path, stat_result in walked:
+        metrics.increment("files_seen")
+        metrics.advance()
+        while row is not None and row[0] < file_path:
+            writer.write(REMOVE_FILE_SQL, (row[0],))
+            stats["removed_files"] += 1
+            row = next(stored_rows, None)
+        if row is not None and row[0] == file_path:
+            unchanged = tuple(row[1:]) == stat_signature(stat_result)
+            row = next(stored_rows, None)
+            if unchanged:
+                stats["unchanged_files"] += 1
+                continue
+        writer.write(STORE_FILE_SQL, process_file(file_path, stat_result))
+        stats["stored_files"] += 1
+        yield file_path, stat_result
+    while row is not None:
+        writer.write(REMOVE_FILE_SQL, (row[0],))
+        stats["removed_files"] += 1
+        row = next(stored_rows, None)
+
+
+def catalog_changes(
+    walked: Iterable[Tuple[str, os.stat_result]],
+    stored: Iterable[Tuple],
+    writer: DatabaseWriter,
+    metrics: Metrics = NO_METRICS,
+) -> Dict[str, int]:
+    """
+    Apply ``iter_catalog_changes`` to the catalog.
+
+    Returns:
+        Dict[str, int]: Counts of stored, unchanged and removed files.
+    """
+    stats = {"stored_files": 0, "unchanged_files": 0, "removed_files": 0}
+    for _ in iter_catalog_changes(walked, stored, writer, stats, metrics):
+        pass
+    return stats
+
+
+async def hash_while_cataloguing(
+    walked: Iterable[Tuple[str, os.stat_result]],
+    stored: Iterable[Tuple],
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+    metrics: Metrics = NO_METRICS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    xattr_cache: bool = False,
+    disk_order: int = DEFAULT_DISK_ORDER,
+) -> Dict[str, int]:
+    """
+    Catalog changes as ``catalog_changes`` does, hashing each new or changed
+    file in full as soon as it is walked.
+
+    The walk and the merge advance as the hashing consumes files, so reading
+    starts with the first file found instead of after the last. Hardlinked
+    files are left to ``hash_candidates``, which hashes each inode once.
+
+    Returns:
+        Dict[str, int]: Counts of stored, unchanged and removed files.
+    """
+    stats = {"stored_files": 0, "unchanged_files": 0, "removed_files": 0}
+    changed = iter_catalog_changes(walked, stored, writer, stats, metrics)
+    rows = (
+        (file_path, stat_result.st_size)
+        for file_path, stat_result in changed
+        if stat_result.st_nlink == 1
+    )
+    results = _full_hashes(
+        rows, pool, algorithm, metrics, read_ahead, xattr_cache, disk_order
+    )
+    async for checksum, file_path, file_size in results:
+        if checksum:
+            writer.write(UPDATE_CHECKSUM_SQL, (checksum, algorithm, file_path))
+            metrics.increment("files_hashed")
+            metrics.increment("bytes_read", file_size)
+    return stats
+
+
+async def traverse_directory(
+    base_path: Path,
+    db_path: Path,
+    pool: WorkerPool,
+    writer: DatabaseWriter,
+    algorithm: str = DEFAULT_HASH_ALGORITHM,
+    metrics: Metrics = NO_METRICS,
+    hash_all: bool = False,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    xattr_cache: bool = False,
+    archives: bool = False,
+    disk_order: int = DEFAULT_DISK_ORDER,
+) -> Dict[str, int]:
+    """
+    Recursively traverse the directory, catalog new and changed image files,
+    drop deleted ones and hash the files that may have a duplicate.
+
+    The walk runs in a background thread feeding a bounded queue, and the
+    catalog is compared with it as a sorted stream, so memory does not grow
+    with the size of the tree. Files are catalogued from their stat results
+    alone; hashing starts as soon as the walk ends, because the size
+    prefilter needs every size, and runs in ``pool`` with results handed to
+    ``writer``. With ``hash_all`` there is no prefilter to wait for, so new
+    and changed files are hashed by ``hash_while_cataloguing`` as they are
+    walked, and ``hash_candidates`` only picks up the rest. Checksums stored
+    with a different ``algorithm`` are cleared first so they are recomputed.
+    ``hash_all``, ``read_ahead``, ``xattr_cache`` and ``disk_order`` are
+    passed on to ``hash_candidates``, and ``archives`` to ``walk_files``.
+
+    Returns:
+        Dict[str, int]: Rescan counts and bytes skipped by each hashing stage.
+    """
+    writer.write(RESET_CHECKSUMS_SQL, (algorithm,))
+    base_path = base_path.resolve()
+    with metrics.stage("catalog"):
+        walked = prefetch(walk_files(base_path, archives), SCAN_QUEUE_SIZE)
+        stored = iter_signatures(db_path, base_path)
+        if hash_all:
+            stats = await hash_while_cataloguing(
+                walked,
+                stored,
+                pool,
+                writer,
+                algorithm,
+                metrics,
+                read_ahead,
+                xattr_cache,
+                disk_order,
+            )
+        else:
+            stats = catalog_changes(walked, stored, writer, metrics)
+        writer.flush()
+
+    stats.update(
+        await hash_candidates(
+            db_path,
+            pool,
+            writer,
+            algorithm,
+            metrics,
+            hash_all,
+            read_ahead,
+            xattr_cache,
+            disk_order,
+        )
+    )
+    return stats
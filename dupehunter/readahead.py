@@ -0,0 +1,163 @@
+"""
+Asynchronous read-ahead hashing for storage where every read waits a
+network round trip, such as NFS and SMB mounts.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, Set, Tuple
+
+import aiofiles
+
+from dupehunter.archives import is_member_path
+from dupehunter.constants import READ_AHEAD_WINDOW, READ_BUFFER_SIZE
+from dupehunter.files import calculate_checksum
+from dupehunter.hashers import new_hasher
+from dupehunter.metrics import NO_METRICS, Metrics
+from dupehunter.xattrs import read_cached_checksum, write_cached_checksum
+
+
+def advise(fd: int, offset: int, length: int, advice_name: str) -> None:
+    """Pass a ``posix_fadvise`` hint where the platform supports it."""
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        # Some filesystems reject hints; they are only hints
+        pass
+
+
+async def read_ahead_digest(
+    file_path: str,
+    file_size: int,
+    algorithm: str,
+    executor: ThreadPoolExecutor,
+    chunk_size: int = READ_BUFFER_SIZE,
+    window: int = READ_AHEAD_WINDOW,
+    xattr_cache: bool = False,
+) -> Tuple[bytes, str, int]:
+    """
+    Hash one file, reading the next chunk while the last one is hashed.
+
+    The kernel is told the file is read sequentially and asked to fetch
+    ``window`` bytes ahead of the reader, so the next request is already on
+    its way when the current one returns. At most two chunks of the file
+    are held at a time. With ``xattr_cache``, the checksum cached in the
+    file's extended attributes is used, or the new one cached there.
+
+    Returns:
+        Tuple[bytes, str, int]: ``(checksum, file_path, file_size)``, with an
+        empty checksum if the file could not be read.
+    """
+    loop = asyncio.get_running_loop()
+    if is_member_path(file_path):
+        # Archive members are streamed from their archive, not opened by path
+        checksum = await loop.run_in_executor(
+            executor, calculate_checksum, file_path, algorithm
+        )
+        return bytes.fromhex(checksum), file_path, file_size
+    hasher = new_hasher(algorithm)
+    if xattr_cache:
+        cached = await loop.run_in_executor(
+            executor, read_cached_checksum, file_path, algorithm
+        )
+        if cached:
+            return bytes.fromhex(cached), file_path, file_size
+    try:
+        async with aiofiles.open(
+            file_path, "rb", buffering=0, executor=executor
+        ) as file:
+            fd = file.fileno()
+            stat_result = os.fstat(fd)
+            advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+            offset = advised = 0
+            update = None
+            while True:
+                # Keep the hinted range a full window ahead of the reader
+                if offset + window > advised and advised < file_size:
+                    advise(fd, advised, window, "POSIX_FADV_WILLNEED")
+                    advised += window
+                chunk = await file.read(chunk_size)
+                if update is not None:
+                    await update
+                if not chunk:
+                    break
+                offset += len(chunk)
+                update = loop.run_in_executor(executor, hasher.update, chunk)
+    except OSError as error:
+        logging.error(f"Error calculating checksum for {file_path}: {error}")
+        return b"", file_path, file_size
+    if xattr_cache:
+        await loop.run_in_executor(
+            executor,
+            write_cached_checksum,
+            file_path,
+            algorithm,
+            hasher.hexdigest(),
+            stat_result,
+        )
+    return hasher.digest(), file_path, file_size
+
+
+async def read_ahead_hashes(
+    items: Iterable[Tuple[str, int]],
+    algorithm: str,
+    files_in_flight: int,
+    metrics: Metrics = NO_METRICS,
+    xattr_cache: bool = False,
+    chunk_size: int = READ_BUFFER_SIZE,
+) -> AsyncIterator[Tuple[bytes, str, int]]:
+    """
+    Hash ``(file_path, file_size)`` items with ``files_in_flight`` files
+    read concurrently.
+
+    Waiting on many files at once hides the latency of each read, so
+    throughput is bound by the storage's bandwidth rather than its round
+    trip time. Buffer memory stays below two chunks per file in flight
+    whatever the file sizes. ``xattr_cache`` is passed on to
+    ``read_ahead_digest``.
+
+    Yields:
+        Tuple[bytes, str, int]: ``(checksum, file_path, file_size)`` in
+        completion order, as ``processing.hash_file`` returns them.
+    """
+    if files_in_flight < 1:
+        raise ValueError("Files in flight must be at least 1.")
+    executor = ThreadPoolExecutor(
+        max_workers=2 * files_in_flight, thread_name_prefix="dupehunter-read-ahead"
+    )
+    pending: Set[asyncio.Task] = set()
+    items = iter(items)
+    try:
+        while True:
+            for file_path, file_size in items:
+                pending.add(
+                    asyncio.ensure_future(
+                        read_ahead_digest(
+                            file_path,
+                            file_size,
+                            algorithm,
+                            executor,
+                            chunk_size,
+                            xattr_cache=xattr_cache,
+                        )
+                    )
+                )
+                if len(pending) >= files_in_flight:
+                    break
+            if not pending:
+                return
+            metrics.set_gauge("read_ahead_files_in_flight", len(pending))
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
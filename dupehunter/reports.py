@@ -0,0 +1,124 @@
+"""
+Streaming writers for the copy plan and delete candidate reports.
+
+Entries are written as they are read from the catalog, so memory use does
+not grow with the number of files a report lists.
+"""
+
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, TextIO
+
+from dupehunter.catalog import FileRecord
+from dupehunter.constants import DEFAULT_REPORT_FORMAT, REPORT_FORMATS
+
+COPY_FIELDS = ("source", "target", "checksum", "file_size")
+DELETE_FIELDS = ("file_path", "gold_path", "checksum", "file_size")
+
+
+def _hex(checksum: Optional[bytes]) -> Optional[str]:
+    return checksum.hex() if checksum else None
+
+
+def _open_report(path: Path, report_format: str) -> TextIO:
+    """Open a report for writing, checking its format first."""
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {report_format}")
+    # The csv module writes its own line endings
+    return path.open("w", newline="" if report_format == "csv" else None)
+
+
+def write_files_to_copy(
+    entries: Iterable[Dict],
+    path: Path,
+    report_format: str = DEFAULT_REPORT_FORMAT,
+) -> int:
+    """
+    Write the copy plan, one entry per gold file.
+
+    Parameters:
+        entries (Iterable[Dict]): Entries from ``catalog.iter_files_to_copy``.
+        path (Path): Report file to write.
+        report_format (str): "text" for ``source -> target`` lines, "jsonl"
+            for one JSON object per entry, "csv" for rows under a header,
+            or "nul" for NUL-terminated source and target paths, as
+            ``xargs -0 -n 2`` reads them.
+
+    Returns:
+        int: Number of entries written.
+    """
+    count = 0
+    with _open_report(path, report_format) as f:
+        if report_format == "csv":
+            rows = csv.writer(f)
+            rows.writerow(COPY_FIELDS)
+        for entry in entries:
+            checksum = _hex(entry["checksum"])
+            if report_format == "text":
+                f.write(f"{entry['source']} -> {entry['target']}\n")
+            elif report_format == "nul":
+                f.write(f"{entry['source']}\0{entry['target']}\0")
+            elif report_format == "csv":
+                rows.writerow(
+                    (entry["source"], entry["target"], checksum, entry["file_size"])
+                )
+            else:
+                f.write(json.dumps({**entry, "checksum": checksum}) + "\n")
+            count += 1
+    return count
+
+
+def write_delete_candidates(
+    groups: Iterable[Sequence[FileRecord]],
+    path: Path,
+    report_format: str = DEFAULT_REPORT_FORMAT,
+    key: str = "checksum",
+) -> int:
+    """
+    Write every duplicate that is not its group's gold copy.
+
+    Parameters:
+        groups (Iterable[Sequence[FileRecord]]): Duplicate groups, gold copy
+            first, as ``database.iter_duplicate_groups`` streams them.
+        path (Path): Report file to write.
+        report_format (str): "text" for one path per line, "jsonl" for one
+            JSON object per group with its gold copy and duplicates, "csv"
+            for one row per duplicate with its gold copy, or "nul" for
+            NUL-terminated paths, as ``xargs -0`` reads them.
+        key (str): Checksum column the groups were formed on.
+
+    Returns:
+        int: Number of delete candidates written.
+    """
+    count = 0
+    with _open_report(path, report_format) as f:
+        if report_format == "csv":
+            rows = csv.writer(f)
+            rows.writerow(DELETE_FIELDS)
+        for gold, *duplicates in groups:
+            checksum = _hex(gold[key])
+            if report_format == "jsonl":
+                group = {
+                    key: checksum,
+                    "file_size": gold["file_size"],
+                    "gold": gold["file_path"],
+                    "duplicates": [file["file_path"] for file in duplicates],
+                }
+                f.write(json.dumps(group) + "\n")
+            for file in duplicates:
+                if report_format == "text":
+                    f.write(f"\n{file['file_path']}" if count else file["file_path"])
+                elif report_format == "nul":
+                    f.write(f"{file['file_path']}\0")
+                elif report_format == "csv":
+                    rows.writerow(
+                        (
+                            file["file_path"],
+                            gold["file_path"],
+                            checksum,
+                            file["file_size"],
+                        )
+                    )
+                count += 1
+    return count
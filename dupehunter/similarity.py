@@ -0,0 +1,102 @@
+"""Near-duplicate detection over perceptual hashes."""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dupehunter.constants import DEFAULT_MAX_HAMMING_DISTANCE
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Return the number of bits in which two hashes differ."""
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    """
+    A BK-tree of integer hashes under Hamming distance.
+
+    Each child edge is labelled with its distance to the parent, so a
+    search only descends into edges within ``max_distance`` of the
+    query's distance to the parent instead of visiting every hash.
+    """
+
+    def __init__(self) -> None:
+        self.root: Optional[Tuple[int, Dict[int, tuple]]] = None
+        self.size = 0
+
+    def add(self, value: int) -> None:
+        """Insert a hash; inserting a hash already present does nothing."""
+        if self.root is None:
+            self.root = (value, {})
+            self.size = 1
+            return
+        node_value, children = self.root
+        while True:
+            distance = hamming_distance(value, node_value)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (value, {})
+                self.size += 1
+                return
+            node_value, children = children[distance]
+
+    def search(self, value: int, max_distance: int) -> List[int]:
+        """Return every stored hash within ``max_distance`` of ``value``."""
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append(node_value)
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+def find_near_duplicates(
+    hashes: Iterable[Tuple[str, str]],
+    max_distance: int = DEFAULT_MAX_HAMMING_DISTANCE,
+) -> List[List[str]]:
+    """
+    Cluster files whose perceptual hashes are within ``max_distance`` bits.
+
+    Clusters are transitive: if A is near B and B is near C, all three
+    end up in one cluster even when A and C are further apart.
+
+    Parameters:
+        hashes (Iterable[Tuple[str, str]]): ``(file_path, perceptual_hash)``
+            pairs with hex hashes; files without a hash are ignored.
+        max_distance (int): Largest Hamming distance treated as a match.
+
+    Returns:
+        List[List[str]]: Sorted file paths of each cluster with more than
+        one file.
+    """
+    paths_by_hash = defaultdict(list)
+    for file_path, perceptual_hash in hashes:
+        if perceptual_hash:
+            paths_by_hash[int(perceptual_hash, 16)].append(file_path)
+
+    tree = BKTree()
+    for value in paths_by_hash:
+        tree.add(value)
+
+    parents = {value: value for value in paths_by_hash}
+
+    def find(value: int) -> int:
+        while parents[value] != value:
+            parents[value] = parents[parents[value]]
+            value = parents[value]
+        return value
+
+    for value in paths_by_hash:
+        for match in tree.search(value, max_distance):
+            parents[find(match)] = find(value)
+
+    clusters = defaultdict(list)
+    for value, file_paths in paths_by_hash.items():
+        clusters[find(value)].extend(file_paths)
+    return sorted(sorted(paths) for paths in clusters.values() if len(paths) > 1)
@@ -19,6 +19,20 @@ def is_supported_file(file_path: Path) -> bool:
     return file_path.suffix.lower() in SUPPORTED_EXTENSIONS
 
 
+def is_storable_path(file_path: str) -> bool:
+    """
+    Check whether a path can be stored in the catalog as UTF-8 text.
+
+    ``os.scandir`` and ``tarfile`` decode undecodable bytes in names to lone
+    surrogates, which SQLite cannot encode.
+    """
+    try:
+        file_path.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
 def human_readable_size(size_in_bytes: float) -> str:
     """
     Convert a file size in bytes to a human-readable string format.
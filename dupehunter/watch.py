@@ -0,0 +1,438 @@
+"""
+Keep a catalog up to date while the scanned tree is in use, by following
+inotify events instead of rescanning the whole tree.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import stat
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dupehunter.constants import (
+    DEFAULT_DISK_ORDER,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_READ_AHEAD,
+    SUPPORTED_EXTENSIONS,
+    WATCH_DEBOUNCE,
+)
+from dupehunter.database import (
+    REMOVE_FILE_SQL,
+    REMOVE_TREE_SQL,
+    RENAME_FILE_SQL,
+    RENAME_TREE_SQL,
+    STORE_FILE_SQL,
+    DatabaseWriter,
+    iter_new_duplicates,
+    load_signatures,
+    path_range,
+)
+from dupehunter.metrics import NO_METRICS, Metrics
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import (
+    extract_duplicate_metadata,
+    hash_candidates,
+    process_file,
+    stat_signature,
+    traverse_directory,
+)
+
+# Event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+# Events of every watched directory. Deleted directories need no event:
+# the files in them were reported deleted one by one.
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+# struct inotify_event: wd, mask, cookie and len, followed by len bytes of
+# NUL-padded file name
+EVENT_HEADER = struct.Struct("iIII")
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+class Inotify:
+    """A non-blocking inotify instance, called through libc with ctypes."""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("Watching needs inotify, which only Linux provides")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._check(
+            self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC), "inotify_init1"
+        )
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _check(result: int, call: str) -> int:
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"{call}: {os.strerror(errno)}")
+        return result
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watch ``path``; return its watch descriptor."""
+        return self._check(
+            self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask),
+            "inotify_add_watch",
+        )
+
+    def remove_watch(self, wd: int) -> None:
+        """Stop watching a descriptor, which is then reported ``IN_IGNORED``."""
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> Iterator[Tuple[int, int, int, str]]:
+        """
+        Drain the queued events without blocking.
+
+        Yields:
+            Tuple[int, int, int, str]: ``(wd, mask, cookie, name)`` events.
+        """
+        while True:
+            try:
+                data = os.read(self.fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                yield wd, mask, cookie, os.fsdecode(name)
+
+    def close(self) -> None:
+        """Close the instance, removing every watch."""
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Follow changes below ``base_path`` and apply them to the catalog.
+
+    Files are catalogued once no event has arrived for them for
+    ``debounce`` seconds, so a file being written is hashed once, when it
+    is complete. Renames are applied to the stored rows, so renamed files
+    keep their checksums and are not read again. Events are queued by the
+    kernel from the moment the watcher is created, so a watcher created
+    before the initial scan misses nothing the scan did not see. The
+    hashing options are those of ``processing.traverse_directory``, which
+    rescans the tree with them when events were missed.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        db_path: Path,
+        algorithm: str = DEFAULT_HASH_ALGORITHM,
+        metrics: Metrics = NO_METRICS,
+        hash_all: bool = False,
+        xattr_cache: bool = False,
+        hash_only: bool = False,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        archives: bool = False,
+        disk_order: int = DEFAULT_DISK_ORDER,
+        debounce: float = WATCH_DEBOUNCE,
+    ):
+        self.base_path = base_path.resolve()
+        self.db_path = db_path
+        self.algorithm = algorithm
+        self.metrics = metrics
+        self.hash_all = hash_all
+        self.xattr_cache = xattr_cache
+        self.hash_only = hash_only
+        self.read_ahead = read_ahead
+        self.archives = archives
+        self.disk_order = disk_order
+        self.debounce = debounce
+        self.inotify = Inotify()
+        # Path of each watched directory, by watch descriptor
+        self.directories: Dict[int, str] = {}
+        # Files to catalog, with the time of their last event
+        self.pending: Dict[str, float] = {}
+        # Renames and removals, applied in order before pending files
+        self.statements: List[Tuple[str, Tuple]] = []
+        # Moves awaiting their IN_MOVED_TO, by cookie: (path, is_dir, time)
+        self.moved_from: Dict[int, Tuple[str, bool, float]] = {}
+        self.rescan = False
+        try:
+            self.watch_tree(str(self.base_path))
+        except BaseException:
+            self.inotify.close()
+            raise
+
+    def __enter__(self) -> "DirectoryWatcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop watching the tree."""
+        self.inotify.close()
+
+    def watch_tree(self, directory: str, now: Optional[float] = None) -> None:
+        """
+        Watch ``directory`` and every directory below it.
+
+        With ``now``, the tree is new to the watcher, as when it was created
+        or moved in, and the files already in it are queued as changed.
+        """
+        stack = [directory]
+        while stack:
+            path = stack.pop()
+            try:
+                self.directories[self.inotify.add_watch(path)] = path
+            except OSError as error:
+                # ENOSPC means fs.inotify.max_user_watches is too low
+                logging.warning(f"Cannot watch directory {path}: {error}")
+                continue
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif now is not None:
+                            self._touch(entry.path, now)
+            except OSError as error:
+                logging.warning(f"Cannot scan directory {path}: {error}")
+
+    def _touch(self, file_path: str, now: float) -> None:
+        """Queue a supported file to be catalogued once it settles."""
+        if os.path.splitext(file_path)[1].lower() in SUPPORTED_EXTENSIONS:
+            self.pending[file_path] = now
+
+    def _rename(self, old_path: str, new_path: str, is_dir: bool, now: float) -> None:
+        """Record a rename within the tree without reading the files again."""
+        if is_dir:
+            self.statements.append(
+                (RENAME_TREE_SQL, (new_path,) + path_range(Path(old_path)))
+            )
+            old_prefix = old_path + os.sep
+            for wd, path in self.directories.items():
+                if path == old_path or path.startswith(old_prefix):
+                    self.directories[wd] = new_path + path[len(old_path) :]
+            for path in [path for path in self.pending if path.startswith(old_prefix)]:
+                self.pending[new_path + path[len(old_path) :]] = self.pending.pop(path)
+            return
+        self.pending.pop(old_path, None)
+        if os.path.splitext(new_path)[1].lower() in SUPPORTED_EXTENSIONS:
+            self.statements.append((RENAME_FILE_SQL, (new_path, old_path)))
+            # Its signature is unchanged unless it was written, too
+            self.pending[new_path] = now
+        else:
+            self.statements.append((REMOVE_FILE_SQL, (old_path,)))
+
+    def _moved_out(self, path: str, is_dir: bool, now: float) -> None:
+        """Forget a file or directory moved out of the tree."""
+        if not is_dir:
+            self._touch(path, now)
+            return
+        self.statements.append((REMOVE_TREE_SQL, path_range(Path(path))))
+        prefix = path + os.sep
+        for wd, watched in list(self.directories.items()):
+            if watched == path or watched.startswith(prefix):
+                self.inotify.remove_watch(wd)
+                del self.directories[wd]
+
+    def read_events(self, now: Optional[float] = None) -> int:
+        """
+        Read the queued events, recording what changed.
+
+        Returns:
+            int: Number of events read.
+        """
+        now = time.monotonic() if now is None else now
+        count = 0
+        for wd, mask, cookie, name in self.inotify.read():
+            count += 1
+            if mask & IN_Q_OVERFLOW:
+                self.rescan = True
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                self.moved_from[cookie] = (path, is_dir, now)
+            elif mask & IN_MOVED_TO and cookie in self.moved_from:
+                old_path, _, _ = self.moved_from.pop(cookie)
+                self._rename(old_path, path, is_dir, now)
+            elif is_dir:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path, now)
+            else:
+                self._touch(path, now)
+        self.metrics.increment("watch_events", count)
+        return count
+
+    def next_deadline(self) -> Optional[float]:
+        """Return when the next queued change settles, or None if none is queued."""
+        if self.rescan or self.statements:
+            return time.monotonic()
+        times = list(self.pending.values())
+        times.extend(seen for _, _, seen in self.moved_from.values())
+        return min(times) + self.debounce if times else None
+
+    async def settle(
+        self, pool: WorkerPool, writer: DatabaseWriter, now: Optional[float] = None
+    ) -> Dict[str, int]:
+        """
+        Catalog the changes that have settled and hash the files that may
+        now have a duplicate.
+
+        Returns:
+            Dict[str, int]: Counts of stored, unchanged and removed files,
+            and of stored files that duplicate another file.
+        """
+        now = time.monotonic() if now is None else now
+        for cookie, (path, is_dir, seen) in list(self.moved_from.items()):
+            if now - seen >= self.debounce:
+                del self.moved_from[cookie]
+                self._moved_out(path, is_dir, seen)
+        for statement, row in self.statements:
+            writer.write(statement, row)
+        self.statements.clear()
+
+        if self.rescan:
+            logging.warning(f"Missed events, rescanning {self.base_path}")
+            self.rescan = False
+            self.pending.clear()
+            self.watch_tree(str(self.base_path))
+            return await traverse_directory(
+                self.base_path,
+                self.db_path,
+                pool,
+                writer,
+                self.algorithm,
+                self.metrics,
+                self.hash_all,
+                self.read_ahead,
+                self.xattr_cache,
+                self.archives,
+                self.disk_order,
+            )
+
+        stats = {"stored_files": 0, "unchanged_files": 0, "removed_files": 0}
+        settled = sorted(
+            path for path, seen in self.pending.items() if now - seen >= self.debounce
+        )
+        for path in settled:
+            del self.pending[path]
+        writer.flush()
+        if not settled:
+            return stats
+
+        signatures = load_signatures(self.db_path, settled)
+        stored = []
+        sizes = set()
+        for file_path in settled:
+            try:
+                stat_result = os.stat(file_path, follow_symlinks=False)
+            except FileNotFoundError:
+                if file_path in signatures:
+                    writer.write(REMOVE_FILE_SQL, (file_path,))
+                    stats["removed_files"] += 1
+                continue
+            except OSError as error:
+                logging.error(f"Error reading file status for {file_path}: {error}")
+                continue
+            if not stat.S_ISREG(stat_result.st_mode):
+                continue
+            if signatures.get(file_path) == stat_signature(stat_result):
+                stats["unchanged_files"] += 1
+                continue
+            writer.write(STORE_FILE_SQL, process_file(file_path, stat_result))
+            stored.append(file_path)
+            sizes.add(stat_result.st_size)
+        writer.flush()
+        stats["stored_files"] = len(stored)
+        stats["new_duplicates"] = 0
+        if not stored:
+            return stats
+
+        # Only files of the stored sizes can have become duplicates
+        await hash_candidates(
+            self.db_path,
+            pool,
+            writer,
+            self.algorithm,
+            self.metrics,
+            self.hash_all,
+            self.read_ahead,
+            self.xattr_cache,
+            self.disk_order,
+            sizes,
+        )
+        if not self.hash_only:
+            await extract_duplicate_metadata(
+                self.db_path, pool, writer, self.metrics, sizes
+            )
+        for file_path, gold_path in iter_new_duplicates(self.db_path, stored):
+            logging.info(f"New duplicate: {file_path} duplicates {gold_path}")
+            stats["new_duplicates"] += 1
+        return stats
+
+    async def run(self, pool: WorkerPool, writer: DatabaseWriter) -> None:
+        """
+        Catalog changes as they settle, until cancelled.
+
+        The event loop waits on the inotify descriptor, with a timer only
+        while changes are settling, so an idle tree costs nothing.
+        """
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.inotify.fd, readable.set)
+        try:
+            while True:
+                deadline = self.next_deadline()
+                timeout = None if deadline is None else deadline - time.monotonic()
+                try:
+                    await asyncio.wait_for(readable.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                readable.clear()
+                self.read_events()
+                stats = await self.settle(pool, writer)
+                if stats.get("stored_files") or stats.get("removed_files"):
+                    logging.info(
+                        f"Catalogued {stats['stored_files']} new or changed files, "
+                        f"removed {stats['removed_files']} deleted files"
+                    )
+        finally:
+            loop.remove_reader(self.inotify.fd)
@@ -0,0 +1,83 @@
+"""
+Checksums cached in extended attributes of the files themselves, so they
+survive moves, renames and the loss of the catalog.
+
+Each algorithm has its own attribute, ``user.dupehunter.<algorithm>``,
+holding ``<size>:<mtime_ns>:<hex digest>``. A cached checksum is only used
+while the file's size and modification time are the ones it was computed
+at. Filesystems without extended attributes simply never hit the cache.
+"""
+
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from dupehunter.constants import XATTR_CACHE_MIN_AGE_NS, XATTR_CACHE_PREFIX
+
+
+def _attribute(algorithm: str) -> str:
+    return f"{XATTR_CACHE_PREFIX}{algorithm}"
+
+
+def read_cached_checksum(
+    file_path: Path, algorithm: str, stat_result: Optional[os.stat_result] = None
+) -> str:
+    """
+    Return the cached checksum of a file, without opening it.
+
+    Parameters:
+        file_path (Path): File to look up.
+        algorithm (str): Registered algorithm of the checksum.
+        stat_result (Optional[os.stat_result]): The file's current status,
+            if already known.
+
+    Returns:
+        str: The hex digest, or '' if none is cached or the file changed
+        since it was.
+    """
+    if not hasattr(os, "getxattr"):
+        return ""
+    try:
+        value = os.getxattr(file_path, _attribute(algorithm))
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+        size, mtime_ns, checksum = value.decode("ascii").split(":")
+        if (int(size), int(mtime_ns)) != (stat_result.st_size, stat_result.st_mtime_ns):
+            return ""
+    except (OSError, ValueError):
+        # No attribute, no xattr support, or a value this version did not write
+        return ""
+    return checksum
+
+
+def write_cached_checksum(
+    file_path: Path, algorithm: str, checksum: str, stat_result: os.stat_result
+) -> bool:
+    """
+    Cache a checksum computed while the file had ``stat_result``.
+
+    Nothing is cached if the file changed since, or was modified so
+    recently that a further write could leave its modification time as
+    it is. Errors, such as a read-only file or a filesystem without
+    extended attributes, are ignored.
+
+    Returns:
+        bool: True if the checksum was cached.
+    """
+    if not checksum or not hasattr(os, "setxattr"):
+        return False
+    try:
+        current = os.stat(file_path)
+        signature = (current.st_size, current.st_mtime_ns)
+        if signature != (stat_result.st_size, stat_result.st_mtime_ns):
+            return False
+        if time.time_ns() - current.st_mtime_ns < XATTR_CACHE_MIN_AGE_NS:
+            return False
+        value = f"{current.st_size}:{current.st_mtime_ns}:{checksum}"
+        os.setxattr(file_path, _attribute(algorithm), value.encode("ascii"))
+    except OSError as error:
+        logging.debug(f"Cannot cache the checksum of {file_path}: {error}")
+        return False
+    return True
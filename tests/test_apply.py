@@ -0,0 +1,209 @@
+import asyncio
+import errno
+import os
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.apply import (
+    apply_copy_plan,
+    copy_file,
+    copy_verified,
+    link_duplicates,
+    remove_duplicates,
+)
+from dupehunter.catalog import iter_files_to_copy
+from dupehunter.constants import PARTIAL_COPY_SUFFIX
+from dupehunter.database import (
+    DatabaseWriter,
+    duplicate_savings,
+    initialize_database,
+    iter_gold_files,
+    iter_link_candidates,
+    load_catalog,
+)
+from dupehunter.files import calculate_checksum
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import traverse_directory
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    """Fixture for a file larger than one kernel copy chunk is likely to be."""
+    path = tmp_path / "source.jpg"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+@pytest.fixture
+def scanned_tree(tmp_path):
+    """Fixture for a scanned catalog with two duplicate groups."""
+    base = tmp_path / "images"
+    (base / "nested").mkdir(parents=True)
+    (base / "a.jpg").write_bytes(b"a" * 100)
+    (base / "nested" / "a_copy.jpg").write_bytes(b"a" * 100)
+    (base / "b.jpg").write_bytes(b"b" * 100)
+    (base / "nested" / "b_copy.jpg").write_bytes(b"b" * 100)
+    db_path = tmp_path / "catalog.db"
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        asyncio.run(traverse_directory(base, db_path, pool, writer))
+    return base.resolve(), db_path
+
+
+def _apply(scanned_tree, target, action, quarantine):
+    base, db_path = scanned_tree
+    plan = iter_files_to_copy(iter_gold_files(db_path), target, base)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        copy_stats, failed = asyncio.run(apply_copy_plan(plan, pool, "sha256"))
+        remove_stats = asyncio.run(
+            remove_duplicates(db_path, pool, writer, action, base, quarantine, failed)
+        )
+    return copy_stats, remove_stats
+
+
+def test_copy_file_kernel_path(tmp_path, source_file):
+    """Positive test: The copy is byte-identical whichever method is used."""
+    target = tmp_path / "target.jpg"
+    method = copy_file(source_file, target)
+    assert method in ("reflink", "copy_file_range", "sendfile", "read_write")
+    assert target.read_bytes() == source_file.read_bytes()
+
+
+def test_copy_file_falls_back_when_unsupported(tmp_path, source_file):
+    """Alternative test: Unsupported kernel copies fall back to read/write."""
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    target = tmp_path / "target.jpg"
+    with patch("dupehunter.apply._reflink", return_value=False), patch(
+        "dupehunter.apply.KERNEL_COPIES", (("copy_file_range", unsupported),)
+    ):
+        assert copy_file(source_file, target) == "read_write"
+    assert target.read_bytes() == source_file.read_bytes()
+
+
+def test_copy_verified_resumes(tmp_path, source_file):
+    """Positive test: A verified copy is renamed into place and not redone."""
+    target = tmp_path / "out" / "nested" / "source.jpg"
+    checksum = bytes.fromhex(calculate_checksum(source_file))
+    size = source_file.stat().st_size
+    args = (str(source_file), str(target), checksum, size, "sha256")
+
+    method, copied = copy_verified(*args)
+    assert method != "failed" and copied == size
+    assert target.read_bytes() == source_file.read_bytes()
+    assert target.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+    assert copy_verified(*args) == ("present", 0)
+
+
+def test_copy_verified_replaces_changed_target(tmp_path, source_file):
+    """Negative test: A target changed behind the copy's back is copied again."""
+    target = tmp_path / "target.jpg"
+    checksum = bytes.fromhex(calculate_checksum(source_file))
+    size = source_file.stat().st_size
+    args = (str(source_file), str(target), checksum, size, "sha256")
+    target.write_bytes(bytes(size))
+    source_stat = source_file.stat()
+    os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+    method, copied = copy_verified(*args)
+    assert method != "present" and copied == size
+    assert target.read_bytes() == source_file.read_bytes()
+
+
+def test_copy_verified_checksum_mismatch(tmp_path, source_file):
+    """Negative test: A copy that does not match the catalog is discarded."""
+    target = tmp_path / "target.jpg"
+    size = source_file.stat().st_size
+    args = (str(source_file), str(target), bytes(32), size, "sha256")
+    assert copy_verified(*args) == ("failed", 0)
+    assert not target.exists()
+    assert not target.with_name(target.name + PARTIAL_COPY_SUFFIX).exists()
+
+
+def test_apply_quarantines_duplicates(tmp_path, scanned_tree):
+    """Positive test: Gold files are copied and duplicates quarantined."""
+    base, db_path = scanned_tree
+    target, quarantine = tmp_path / "target", tmp_path / "quarantine"
+    copy_stats, remove_stats = _apply(scanned_tree, target, "quarantine", quarantine)
+
+    assert copy_stats["copied_files"] == 2 and copy_stats["failed_copies"] == 0
+    assert (target / "a.jpg").read_bytes() == b"a" * 100
+    assert remove_stats == {"removed_files": 2, "kept_files": 0, "failed_removals": 0}
+    assert (quarantine / "nested" / "a_copy.jpg").exists()
+    assert not (base / "nested" / "b_copy.jpg").exists()
+    assert len(load_catalog(db_path)) == 2
+
+
+def test_apply_keeps_duplicates_of_failed_copies(tmp_path, scanned_tree):
+    """Exception handling: Duplicates are kept when their gold copy failed."""
+    base, _ = scanned_tree
+
+    def corrupt_b(path, algorithm):
+        return "0" * 64 if path.name.startswith("b.jpg") else real(path, algorithm)
+
+    real = calculate_checksum
+    with patch("dupehunter.apply.calculate_checksum", side_effect=corrupt_b):
+        copy_stats, remove_stats = _apply(
+            scanned_tree, tmp_path / "target", "delete", None
+        )
+    assert copy_stats["failed_copies"] == 1
+    assert remove_stats == {"removed_files": 1, "kept_files": 1, "failed_removals": 0}
+    assert not (base / "nested" / "a_copy.jpg").exists()
+    assert (base / "nested" / "b_copy.jpg").exists()
+
+
+def test_apply_keeps_duplicates_rewritten_since_scan(tmp_path, scanned_tree):
+    """Negative test: A duplicate rewritten with the same size is not removed."""
+    base, _ = scanned_tree
+    rewritten = base / "nested" / "a_copy.jpg"
+    stat_result = rewritten.stat()
+    rewritten.write_bytes(b"c" * 100)
+    os.utime(rewritten, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1))
+    _, remove_stats = _apply(scanned_tree, tmp_path / "target", "delete", None)
+
+    assert remove_stats == {"removed_files": 1, "kept_files": 0, "failed_removals": 1}
+    assert rewritten.read_bytes() == b"c" * 100
+
+
+def _link(scanned_tree, action):
+    _, db_path = scanned_tree
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        return asyncio.run(link_duplicates(db_path, pool, writer, action))
+
+
+def test_link_duplicates_hardlink(scanned_tree):
+    """Positive test: Duplicates become hardlinks of their gold file in place."""
+    base, db_path = scanned_tree
+    assert duplicate_savings(db_path) == 200
+    stats = _link(scanned_tree, "hardlink")
+
+    assert stats == {"linked_files": 2, "linked_bytes": 200, "failed_links": 0}
+    gold, duplicate = base / "a.jpg", base / "nested" / "a_copy.jpg"
+    assert gold.stat().st_ino == duplicate.stat().st_ino
+    assert duplicate.read_bytes() == b"a" * 100
+    assert duplicate_savings(db_path) == 0
+    assert list(iter_link_candidates(db_path)) == []
+
+
+def test_link_duplicates_changed_file(scanned_tree):
+    """Negative test: A duplicate modified after the scan is not replaced."""
+    base, _ = scanned_tree
+    (base / "nested" / "a_copy.jpg").write_bytes(b"changed")
+    stats = _link(scanned_tree, "hardlink")
+
+    assert stats["linked_files"] == 1 and stats["failed_links"] == 1
+    assert (base / "nested" / "a_copy.jpg").read_bytes() == b"changed"
+
+
+def test_link_duplicates_reflink_unsupported(scanned_tree):
+    """Exception handling: Without reflink support duplicates stay untouched."""
+    base, _ = scanned_tree
+    with patch("dupehunter.apply._reflink", return_value=False):
+        stats = _link(scanned_tree, "reflink")
+
+    assert stats["failed_links"] == 2
+    assert (base / "nested" / "b_copy.jpg").read_bytes() == b"b" * 100
+    assert not list((base / "nested").glob("*.dupehunter-link"))
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from dupehunter.apply import copy_verified, remove_duplicate
+from dupehunter.archives import (
+    iter_archive_members,
+    open_file,
+    split_member_path,
+    stat_file,
+)
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_delete_candidates,
+    iter_gold_files,
+    load_catalog,
+)
+from dupehunter.files import calculate_checksum, calculate_partial_checksum
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import stat_signature, traverse_directory
+
+PHOTO = os.urandom(300_000)
+
+
+def _scan(base, db_path):
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        return asyncio.run(
+            traverse_directory(base, db_path, pool, writer, archives=True)
+        )
+
+
+@pytest.fixture
+def archive_tree(tmp_path):
+    """Fixture for loose photos beside a zip and a tar archive holding copies."""
+    base = tmp_path / "photos"
+    base.mkdir()
+    (base / "a.jpg").write_bytes(PHOTO)
+    with zipfile.ZipFile(base / "2009.zip", "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("rome/a.jpg", PHOTO)
+        archive.writestr("rome/only.jpg", b"only in the zip")
+        archive.writestr("notes.txt", b"not an image")
+    with tarfile.open(base / "2010.tar", "w") as archive:
+        archive.add(base / "a.jpg", "trip/a.jpg")
+    return base.resolve()
+
+
+def test_archive_members_catalogued_as_files(tmp_path, archive_tree):
+    """Positive test: Copies inside archives are duplicates of loose files."""
+    db_path = tmp_path / "catalog.db"
+    _scan(archive_tree, db_path)
+    # Gold copies are the first in path order, wherever they are stored
+    assert [file["file_path"] for file in iter_gold_files(db_path)] == [
+        f"{archive_tree}/2009.zip!/rome/a.jpg"
+    ]
+    assert list(iter_delete_candidates(db_path)) == [
+        f"{archive_tree}/2010.tar!/trip/a.jpg",
+        str(archive_tree / "a.jpg"),
+    ]
+    sizes = {file["file_path"]: file["file_size"] for file in load_catalog(db_path)}
+    assert sizes[f"{archive_tree}/2009.zip!/rome/only.jpg"] == 15
+    assert len(sizes) == 4
+
+
+def test_archive_members_unchanged_on_rescan(tmp_path, archive_tree):
+    """Positive test: Members of unchanged archives are not read again."""
+    db_path = tmp_path / "catalog.db"
+    _scan(archive_tree, db_path)
+    stats = _scan(archive_tree, db_path)
+    assert stats["unchanged_files"] == 4
+    assert stats["stored_files"] == stats["removed_files"] == 0
+
+
+def test_member_streams_read_like_files(archive_tree):
+    """Positive test: Members hash and seek exactly like the loose file."""
+    loose = archive_tree / "a.jpg"
+    for member in ("2009.zip!/rome/a.jpg", "2010.tar!/trip/a.jpg"):
+        file_path = f"{archive_tree}/{member}"
+        assert calculate_checksum(file_path) == calculate_checksum(loose)
+        assert calculate_partial_checksum(
+            file_path, len(PHOTO)
+        ) == calculate_partial_checksum(loose, len(PHOTO))
+        with open_file(file_path) as file:
+            file.seek(-10, os.SEEK_END)
+            assert file.read() == PHOTO[-10:]
+        assert stat_file(file_path).st_size == len(PHOTO)
+        assert stat_file(file_path).st_ino < 0
+
+
+def test_member_gold_extracted_and_never_removed(tmp_path, archive_tree):
+    """Alternative test: Members are extracted by copies and never removed."""
+    member = f"{archive_tree}/2010.tar!/trip/a.jpg"
+    target = tmp_path / "out" / "a.jpg"
+    checksum = bytes.fromhex(calculate_checksum(member))
+    args = (member, str(target), checksum, len(PHOTO), "sha256")
+    assert copy_verified(*args) == ("extract", len(PHOTO))
+    assert target.read_bytes() == PHOTO
+    assert copy_verified(*args) == ("present", 0)
+    signature = stat_signature(stat_file(member))
+    assert not remove_duplicate(member, signature, "delete", str(archive_tree), "")
+    assert (archive_tree / "2010.tar").exists()
+
+
+def test_split_member_path(archive_tree):
+    """Negative test: Ordinary paths are not archive members."""
+    assert split_member_path("/photos/x.zip!/a!/b.jpg") == ("/photos/x.zip", "a!/b.jpg")
+    assert split_member_path("/photos/shots!/x.zip!/a.jpg") == (
+        "/photos/shots!/x.zip",
+        "a.jpg",
+    )
+    assert split_member_path("/photos/hello!/a.jpg") is None
+    assert split_member_path(str(archive_tree / "a.jpg")) is None
+
+
+def test_unreadable_archive_skipped(tmp_path, caplog):
+    """Exception handling: Corrupt archives and unusable names yield no members."""
+    broken = tmp_path / "broken.zip"
+    broken.write_bytes(b"not a zip")
+    assert list(iter_archive_members(str(broken), broken.stat())) == []
+    assert "Cannot read archive" in caplog.text
+
+    odd = tmp_path / "odd.zip"
+    with zipfile.ZipFile(odd, "w") as archive:
+        archive.writestr("../escape.jpg", b"x")
+        archive.writestr("ok.jpg", b"x")
+    assert [path for path, _ in iter_archive_members(str(odd), odd.stat())] == [
+        f"{odd}!/ok.jpg"
+    ]
+    with pytest.raises(OSError):
+        open_file(f"{odd}!/missing.jpg")
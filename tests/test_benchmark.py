@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+from dupehunter.benchmark import compare_results, generate_corpus, main, run_benchmark
+from dupehunter.files import read_metadata
+
+
+@pytest.fixture
+def small_corpus(tmp_path):
+    """Fixture for a tiny synthetic corpus with duplicates and EXIF data."""
+    root = tmp_path / "corpus"
+    summary = generate_corpus(
+        root,
+        files=40,
+        duplicate_ratio=0.3,
+        depth=2,
+        exif_density=1.0,
+        min_size=1024,
+        max_size=64 * 1024,
+        seed=3,
+    )
+    return root, summary
+
+
+def _digests(root):
+    return {
+        path.relative_to(root): hashlib.sha256(path.read_bytes()).hexdigest()
+        for path in root.rglob("*.jpg")
+    }
+
+
+def test_generate_corpus_is_reproducible(tmp_path, small_corpus):
+    """Positive test: Equal parameters and seed give an identical corpus."""
+    root, summary = small_corpus
+    again = tmp_path / "again"
+    generate_corpus(
+        again,
+        files=40,
+        duplicate_ratio=0.3,
+        depth=2,
+        exif_density=1.0,
+        min_size=1024,
+        max_size=64 * 1024,
+        seed=3,
+    )
+    digests = _digests(root)
+    assert len(digests) == summary["files"] == 40
+    assert digests == _digests(again)
+    assert len(set(digests.values())) < 40
+    assert sum(path.stat().st_size for path in root.rglob("*.jpg")) == summary["bytes"]
+
+
+def test_generate_corpus_exif(small_corpus):
+    """Positive test: Generated files carry readable EXIF tags."""
+    root, _ = small_corpus
+    tags = read_metadata(next(root.rglob("*.jpg")))
+    assert tags["Model"].startswith("Camera ")
+    assert "DateTimeOriginal" in tags
+
+
+def test_generate_corpus_invalid_distribution(tmp_path):
+    """Negative test: Unknown size distribution."""
+    with pytest.raises(ValueError, match="Unknown size distribution"):
+        generate_corpus(tmp_path, files=1, distribution="pareto")
+
+
+def test_run_benchmark_stages(tmp_path, small_corpus):
+    """Positive test: Every stage is measured over the whole corpus."""
+    root, _ = small_corpus
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    stages = asyncio.run(run_benchmark(root, work_dir, workers=2))
+    assert list(stages) == ["traverse", "ingest", "hash", "find_duplicates", "report"]
+    for result in stages.values():
+        assert result["files"] == 40
+        assert result["seconds"] >= 0
+        assert result["peak_rss_kb"] > 0
+    assert (work_dir / "delete_candidates.txt").read_text()
+
+
+def test_compare_results_flags_regression():
+    """Positive test: Only stages slower than the threshold are regressions."""
+    baseline = {"stages": {"hash": {"files_per_sec": 100.0}}}
+    baseline["stages"]["traverse"] = {"files_per_sec": 100.0}
+    candidate = {
+        "stages": {"hash": {"files_per_sec": 80.0}, "traverse": {"files_per_sec": 95.0}}
+    }
+    rows = {row["stage"]: row for row in compare_results(baseline, candidate)}
+    assert rows["hash"]["regression"] is True
+    assert rows["hash"]["change"] == pytest.approx(-0.2)
+    assert rows["traverse"]["regression"] is False
+
+
+def test_main_compare_exit_code(tmp_path):
+    """Alternative test: The compare command fails on a regression."""
+    baseline = tmp_path / "baseline.json"
+    candidate = tmp_path / "candidate.json"
+    baseline.write_text(json.dumps({"stages": {"hash": {"files_per_sec": 100.0}}}))
+    candidate.write_text(json.dumps({"stages": {"hash": {"files_per_sec": 50.0}}}))
+    assert main(["compare", str(baseline), str(candidate)]) == 1
+    assert main(["compare", str(baseline), str(baseline)]) == 0
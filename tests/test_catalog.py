@@ -0,0 +1,175 @@
+import hashlib
+import json
+import random
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.catalog import (
+    Catalog,
+    _spill,
+    calculate_storage_savings,
+    find_duplicates,
+    generate_delete_candidates,
+    iter_duplicate_summaries,
+)
+
+
+@pytest.fixture
+def catalog():
+    """Fixture for a catalog with one duplicate group and unhashed files."""
+    return [
+        {"file_path": "/a/1.jpg", "checksum": "c1", "metadata": "{}", "file_size": 10},
+        {"file_path": "/b/1.jpg", "checksum": "c1", "metadata": "{}", "file_size": 10},
+        {"file_path": "/a/2.jpg", "checksum": "c2", "metadata": "{}", "file_size": 20},
+        {"file_path": "/a/3.jpg", "checksum": None, "metadata": "{}", "file_size": 30},
+        {"file_path": "/a/4.jpg", "checksum": None, "metadata": "{}", "file_size": 40},
+    ]
+
+
+def test_find_duplicates_ignores_unhashed_files(catalog):
+    """Positive test: Files without a checksum never form a group."""
+    gold_files, duplicates = find_duplicates(catalog)
+    assert list(gold_files) == ["c1"]
+    assert gold_files["c1"]["file_path"] == "/a/1.jpg"
+    assert None not in duplicates
+
+
+def test_delete_candidates_and_savings_cover_duplicate_groups_only(catalog):
+    """Positive test: Unique files are neither deleted nor counted as savings."""
+    gold_files, duplicates = find_duplicates(catalog)
+    assert generate_delete_candidates(duplicates, gold_files) == ["/b/1.jpg"]
+    assert calculate_storage_savings(duplicates, gold_files) == 10
+
+
+def test_savings_count_each_inode_once():
+    """Alternative test: Hardlinks of a kept inode free no space."""
+    catalog = [
+        {"file_path": f"/a/{n}.jpg", "checksum": "c1", "file_size": 10}
+        for n in range(4)
+    ]
+    for file, inode in zip(catalog, (1, 1, 2, 2)):
+        file.update(st_dev=1, st_ino=inode)
+    gold_files, duplicates = find_duplicates(catalog)
+    assert calculate_storage_savings(duplicates, gold_files) == 10
+
+
+def test_catalog_columns_round_trip(catalog):
+    """Positive test: A column-stored catalog reads back as the rows it was given."""
+    rows = [
+        tuple(file.values()) + (1, n, None, None, "2010:05:01 10:00:00", "Canon")
+        for n, file in enumerate(catalog)
+    ]
+    columns = Catalog(rows)
+    assert len(columns) == 5
+    assert dict(columns[1]) == dict(
+        catalog[1],
+        st_dev=1,
+        st_ino=1,
+        shard=None,
+        content_checksum=None,
+        exif_datetime_original="2010:05:01 10:00:00",
+        exif_camera_model="Canon",
+    )
+    assert columns[-1]["file_path"] == "/a/4.jpg"
+    gold_files, duplicates = find_duplicates(columns)
+    assert generate_delete_candidates(duplicates, gold_files) == ["/b/1.jpg"]
+
+
+def test_catalog_columns_are_compact():
+    """Positive test: Columns take under a third of the memory of dict rows."""
+    keys = ("file_path", "checksum", "metadata", "file_size", "st_dev", "st_ino")
+    digests = [
+        hashlib.sha256(bytes([n % 256, n // 256])).digest() for n in range(20000)
+    ]
+
+    def rows(encode):
+        for n, digest in enumerate(digests):
+            path = f"/photos/{n // 100:03d}/IMG_{n:05d}.jpg"
+            yield path, encode(digest), None, 10**6 + n, 2049, 10**7 + n
+
+    def allocated(build):
+        tracemalloc.start()
+        catalog = build()  # noqa: F841 - measured while alive
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    as_dicts = allocated(lambda: [dict(zip(keys, row)) for row in rows(bytes.hex)])
+    as_columns = allocated(lambda: Catalog(rows(bytes)))
+    assert as_columns * 3 < as_dicts
+
+
+def test_grouping_spills_and_matches_in_memory_analysis(tmp_path):
+    """Positive test: Spilled runs merge into the groups found in memory."""
+    rng = random.Random(7)
+    catalog = [
+        {
+            "file_path": f"/photos/{n}.jpg",
+            "checksum": f"c{rng.randrange(300)}" if n % 5 else None,
+            "file_size": 100,
+            "st_dev": 1,
+            "st_ino": rng.randrange(1200),
+        }
+        for n in range(2000)
+    ]
+    with patch("dupehunter.catalog._spill", wraps=_spill) as spill:
+        groups = list(
+            iter_duplicate_summaries(catalog, memory_budget=50_000, temp_dir=tmp_path)
+        )
+    assert spill.call_count > 10
+    assert not list(tmp_path.iterdir())
+
+    gold_files, duplicates = find_duplicates(catalog)
+    assert {group.checksum: group.gold["file_path"] for group in groups} == {
+        checksum: gold["file_path"] for checksum, gold in gold_files.items()
+    }
+    assert sorted(
+        file["file_path"] for group in groups for file in group.duplicates
+    ) == sorted(generate_delete_candidates(duplicates, gold_files))
+    assert sum(group.savings for group in groups) == calculate_storage_savings(
+        duplicates, gold_files
+    )
+
+
+def test_grouping_in_memory(catalog):
+    """Alternative test: Catalogs within the budget are grouped without spilling."""
+    with patch("dupehunter.catalog._spill") as spill:
+        (group,) = iter_duplicate_summaries(catalog)
+    spill.assert_not_called()
+    assert group.checksum == "c1"
+    assert group.gold["file_path"] == "/a/1.jpg"
+    assert [file["file_path"] for file in group.duplicates] == ["/b/1.jpg"]
+    assert group.savings == 10
+
+
+def test_grouping_budget_counts_metadata(tmp_path):
+    """Positive test: Large metadata fills the memory budget and spills."""
+    catalog = [
+        {
+            "file_path": f"/photos/{n}.jpg",
+            "checksum": f"c{n % 10}",
+            "metadata": json.dumps({"MakerNote": "x" * 10_000}),
+            "file_size": 100,
+            "st_dev": 1,
+            "st_ino": n,
+        }
+        for n in range(100)
+    ]
+    with patch("dupehunter.catalog._spill", wraps=_spill) as spill:
+        groups = list(
+            iter_duplicate_summaries(catalog, memory_budget=100_000, temp_dir=tmp_path)
+        )
+    assert spill.call_count >= 9
+    assert len(groups) == 10
+
+
+def test_grouping_without_duplicates():
+    """Negative test: Unique and unhashed files form no group."""
+    catalog = [
+        {"file_path": "/a/1.jpg", "checksum": "c1", "file_size": 10},
+        {"file_path": "/a/2.jpg", "checksum": None, "file_size": 10},
+    ]
+    assert list(iter_duplicate_summaries(catalog, memory_budget=1)) == []
+    assert list(iter_duplicate_summaries([])) == []
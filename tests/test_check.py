@@ -0,0 +1,167 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.check import check_files, main
+from dupehunter.database import DatabaseWriter, initialize_database
+from dupehunter.index import (
+    CatalogIndex,
+    build_index,
+    default_index_path,
+    open_index,
+)
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import hash_file, traverse_directory
+
+
+def _scan(base, db_path, hash_all=True):
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        asyncio.run(traverse_directory(base, db_path, pool, writer, hash_all=hash_all))
+
+
+def _check(incoming, db_path, index):
+    async def collect():
+        with WorkerPool("thread", 2) as pool:
+            return {
+                os.path.basename(file_path): match
+                async for file_path, match in check_files(
+                    incoming, db_path, index, pool
+                )
+            }
+
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Fixture for a fully hashed archive catalog and a directory of new files."""
+    base = tmp_path / "archive"
+    base.mkdir()
+    (base / "kept.jpg").write_bytes(b"kept" * 100)
+    (base / "other.jpg").write_bytes(b"other" * 100)
+    db_path = tmp_path / "archive.db"
+    _scan(base, db_path)
+
+    incoming = tmp_path / "incoming"
+    incoming.mkdir()
+    (incoming / "copy.jpg").write_bytes(b"kept" * 100)
+    (incoming / "same_size.jpg").write_bytes(b"KEPT" * 100)
+    (incoming / "new_size.jpg").write_bytes(b"new")
+    return base.resolve(), db_path, incoming
+
+
+def test_check_finds_catalogued_files(archive):
+    """Positive test: Copies are matched, other files reported new."""
+    base, db_path, incoming = archive
+    with open_index(db_path, default_index_path(db_path)) as index:
+        assert _check(incoming, db_path, index) == {
+            "copy.jpg": str(base / "kept.jpg"),
+            "same_size.jpg": None,
+            "new_size.jpg": None,
+        }
+
+
+def test_check_rejects_unseen_sizes_without_reading(archive):
+    """Positive test: Files of an unseen size are new without being hashed."""
+    base, db_path, incoming = archive
+    for path in incoming.iterdir():
+        if path.name != "new_size.jpg":
+            path.unlink()
+    with open_index(db_path, default_index_path(db_path)) as index, patch(
+        "dupehunter.check.hash_file"
+    ) as hash_file, patch("dupehunter.check.connect") as connect:
+        assert _check(incoming, db_path, index) == {"new_size.jpg": None}
+    hash_file.assert_not_called()
+    connect.assert_not_called()
+
+
+def test_index_bloom_filter(archive):
+    """Positive test: The filter holds every checksum and rejects others."""
+    _, db_path, _ = archive
+    index_path = default_index_path(db_path)
+    stats = build_index(db_path, index_path)
+    assert stats == {"sizes": 2, "checksums": 2, "unhashed_files": 0}
+    with CatalogIndex(index_path) as index:
+        assert index.algorithm == "sha256"
+        assert index.has_size(400) and not index.has_size(401)
+        rejected = sum(not index.may_contain(os.urandom(32)) for _ in range(1000))
+        assert rejected > 900
+
+
+def test_index_rebuilt_when_catalog_changes(archive):
+    """Alternative test: A stale index is rebuilt before it is used."""
+    base, db_path, incoming = archive
+    index_path = default_index_path(db_path)
+    open_index(db_path, index_path).close()
+    (base / "added.jpg").write_bytes(b"new")
+    _scan(base, db_path)
+    with open_index(db_path, index_path) as index:
+        assert _check(incoming, db_path, index)["new_size.jpg"] == str(
+            base / "added.jpg"
+        )
+
+
+def test_check_reads_unhashed_catalog_files(tmp_path, archive):
+    """Alternative test: Catalogued files without a checksum are read on demand."""
+    base, _, incoming = archive
+    db_path = tmp_path / "prefiltered.db"
+    _scan(base, db_path, hash_all=False)
+    with open_index(db_path, default_index_path(db_path)) as index:
+        assert index.has_unhashed_size(400)
+        assert _check(incoming, db_path, index)["copy.jpg"] == str(base / "kept.jpg")
+
+
+def test_check_stores_checksums_of_unhashed_files(tmp_path, archive):
+    """
+    Positive test: Catalogued files read by one check are not read again,
+    and the index is updated rather than rebuilt.
+    """
+    base, _, incoming = archive
+    db_path = tmp_path / "prefiltered.db"
+    _scan(base, db_path, hash_all=False)
+    index_path = default_index_path(db_path)
+    with open_index(db_path, index_path) as index:
+        _check(incoming, db_path, index)
+
+    read = []
+
+    def recording_hash_file(file_path, *args):
+        read.append(os.path.basename(file_path))
+        return hash_file(file_path, *args)
+
+    with patch("dupehunter.index.build_index") as rebuild:
+        index = open_index(db_path, index_path)
+    rebuild.assert_not_called()
+    with index, patch("dupehunter.check.hash_file", recording_hash_file):
+        assert not index.has_unhashed_size(400)
+        assert _check(incoming, db_path, index)["copy.jpg"] == str(base / "kept.jpg")
+    assert sorted(read) == ["copy.jpg", "same_size.jpg"]
+
+
+def test_check_main_prints_results(archive, capsys):
+    """Positive test: The command prints each file as new or existing."""
+    base, db_path, incoming = archive
+    incoming = incoming.resolve()
+    assert main([str(incoming), "--db-path", str(db_path), "--workers", "2"]) == 0
+    lines = sorted(capsys.readouterr().out.splitlines())
+    assert lines == [
+        f"exists\t{incoming / 'copy.jpg'}\t{base / 'kept.jpg'}",
+        f"new\t{incoming / 'new_size.jpg'}",
+        f"new\t{incoming / 'same_size.jpg'}",
+    ]
+
+
+def test_check_main_missing_catalog(tmp_path):
+    """Negative test: Checking against a missing catalog fails."""
+    assert main([str(tmp_path), "--db-path", str(tmp_path / "missing.db")]) == 1
+
+
+def test_index_rejects_other_files(tmp_path):
+    """Exception handling: A file that is not an index is refused."""
+    path = tmp_path / "not.index"
+    path.write_bytes(b"x" * 200)
+    with pytest.raises(ValueError, match="not a catalog index"):
+        CatalogIndex(path)
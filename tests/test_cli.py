@@ -1,10 +1,35 @@
 import argparse
+import subprocess
+import sys
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 
 from dupehunter.cli import cli_entry_point, parse_arguments
+from dupehunter.constants import (
+    DEFAULT_MAX_HAMMING_DISTANCE,
+    DEFAULT_NEAR_DUPLICATES_FILE,
+    DEFAULT_WORKERS,
+)
+
+# Cumulative microseconds ``import dupehunter.cli`` may take, as reported
+# by ``python -X importtime`` in the fastest of CLI_IMPORT_RUNS runs
+CLI_IMPORT_BUDGET_US = 250_000
+CLI_IMPORT_RUNS = 5
+# Modules ``import dupehunter.cli`` must not import: only running the
+# pipeline needs it, and only the stages that decode images, read ahead or
+# watch need their own dependencies
+LAZY_MODULES = {
+    "PIL",
+    "aiofiles",
+    "sqlite3",
+    "dupehunter.core",
+    "dupehunter.database",
+    "dupehunter.processing",
+    "dupehunter.readahead",
+    "dupehunter.watch",
+}
 
 
 @pytest.fixture
@@ -22,6 +47,72 @@ def mock_valid_args():
     ]
 
 
+@pytest.fixture
+def mock_namespace():
+    """Fixture for the parsed arguments of a full CLI invocation."""
+    return argparse.Namespace(
+        base_path=Path("/test/base"),
+        target_path=Path("/test/target"),
+        db_path=Path("/test/db.sqlite"),
+        log_level="INFO",
+        workers=4,
+        pool="thread",
+        near_duplicates=True,
+        max_distance=6,
+        hash_algorithm="blake2b",
+        progress=True,
+        metrics_json=Path("/test/metrics.json"),
+        metrics_prometheus=None,
+        metrics_interval=5.0,
+        apply=True,
+        duplicates="quarantine",
+        quarantine_path=Path("/test/quarantine"),
+        shard_id="node-1",
+        content_hash=False,
+        read_ahead=16,
+        watch=True,
+        xattr_cache=True,
+        files_to_copy=Path("/test/copy.jsonl"),
+        delete_candidates=Path("/test/delete.jsonl"),
+        report_format="jsonl",
+        hash_only=False,
+        scan_archives=True,
+        disk_order=2,
+        near_duplicates_report=Path("/test/near.txt"),
+    )
+
+
+@pytest.fixture
+def expected_main_options():
+    """Fixture for the keyword options core.main receives from mock_namespace."""
+    return {
+        "workers": 4,
+        "pool_kind": "thread",
+        "near_duplicates": True,
+        "max_distance": 6,
+        "hash_algorithm": "blake2b",
+        "progress": True,
+        "metrics_json": Path("/test/metrics.json"),
+        "metrics_prometheus": None,
+        "metrics_interval": 5.0,
+        "apply": True,
+        "duplicate_action": "quarantine",
+        "quarantine_path": Path("/test/quarantine"),
+        "shard_id": "node-1",
+        "content_hash": False,
+        "read_ahead": 16,
+        "watch": True,
+        "xattr_cache": True,
+        "files_to_copy_path": Path("/test/copy.jsonl"),
+        "delete_candidates_path": Path("/test/delete.jsonl"),
+        "report_format": "jsonl",
+        "hash_only": False,
+        "scan_archives": True,
+        "disk_order": 2,
+        "near_duplicates_path": Path("/test/near.txt"),
+    }
+
+
 def test_parse_arguments_valid(mock_valid_args):
     """Positive test: Parse valid arguments."""
     with patch("sys.argv", ["cli.py"] + mock_valid_args):
@@ -30,6 +121,104 @@ def test_parse_arguments_valid(mock_valid_args):
         assert args.target_path == Path("/test/target")
         assert args.db_path == Path("/test/db.sqlite")
         assert args.log_level == "INFO"
+        assert args.workers == DEFAULT_WORKERS
+        assert args.pool == "thread"
+        assert args.near_duplicates is False
+        assert args.near_duplicates_report == DEFAULT_NEAR_DUPLICATES_FILE
+        assert args.max_distance == DEFAULT_MAX_HAMMING_DISTANCE
+        assert args.hash_algorithm == "sha256"
+        assert args.progress is False
+        assert args.metrics_json is None
+        assert args.metrics_prometheus is None
+        assert args.apply is False
+        assert args.duplicates == "keep"
+        assert args.report_format == "text"
+
+
+def test_parse_arguments_worker_pool(mock_valid_args):
+    """Positive test: Parse worker pool options."""
+    with patch(
+        "sys.argv",
+        ["cli.py"] + mock_valid_args + ["--workers", "8", "--pool", "process"],
+    ):
+        args = parse_arguments()
+        assert args.workers == 8
+        assert args.pool == "process"
+
+
+def test_parse_arguments_invalid_hash_algorithm(mock_valid_args):
+    """Negative test: Unregistered hash algorithm."""
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + ["--hash-algorithm", "md4"]):
+        with pytest.raises(SystemExit):
+            parse_arguments()
+
+
+def test_parse_arguments_duplicates_requires_apply(mock_valid_args):
+    """Negative test: Removing duplicates without applying the copy plan."""
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + ["--duplicates", "delete"]):
+        with pytest.raises(SystemExit):
+            parse_arguments()
+
+
+def test_parse_arguments_link_without_apply(mock_valid_args):
+    """Alternative test: Linking duplicates in place needs no copy."""
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + ["--duplicates", "hardlink"]):
+        args = parse_arguments()
+        assert args.duplicates == "hardlink"
+        assert args.apply is False
+
+
+def test_parse_arguments_content_hash_cannot_apply(mock_valid_args):
+    """Negative test: Content-hash groups are reported, never applied."""
+    extra = ["--content-hash", "--duplicates", "hardlink"]
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + extra):
+        with pytest.raises(SystemExit):
+            parse_arguments()
+
+
+def test_parse_arguments_hash_only_cannot_decode(mock_valid_args):
+    """Negative test: Hash-only runs cannot compare decoded images."""
+    extra = ["--hash-only", "--near-duplicates"]
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + extra):
+        with pytest.raises(SystemExit):
+            parse_arguments()
+
+
+def test_cli_import_is_light():
+    """Positive test: Importing the CLI does not import the pipeline."""
+    script = "import sys, dupehunter.cli; print(*sorted(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert not LAZY_MODULES & set(result.stdout.split())
+
+
+def _cli_import_time() -> int:
+    """Return the cumulative microseconds of one ``import dupehunter.cli``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import dupehunter.cli"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        _, cumulative, module = line.split("|")
+        if module.strip() == "dupehunter.cli":
+            return int(cumulative)
+    raise AssertionError("dupehunter.cli missing from the import times")
+
+
+def test_cli_import_within_budget():
+    """Positive test: Importing the CLI stays within its import-time budget."""
+    timings = [_cli_import_time() for _ in range(CLI_IMPORT_RUNS)]
+    assert min(timings) < CLI_IMPORT_BUDGET_US
+
+
+def test_parse_arguments_invalid_pool(mock_valid_args):
+    """Negative test: Unknown worker pool type."""
+    with patch("sys.argv", ["cli.py"] + mock_valid_args + ["--pool", "fiber"]):
+        with pytest.raises(SystemExit):
+            parse_arguments()
 
 
 def test_parse_arguments_missing_required():
@@ -57,42 +246,48 @@ def test_parse_arguments_invalid_log_level():
             parse_arguments()
 
 
-@patch("dupehunter.cli.main")
+@patch("dupehunter.core.main")
 @patch("dupehunter.cli.configure_logging")
 @patch("dupehunter.cli.parse_arguments")
 def test_cli_entry_point_success(
-    mock_parse_args, mock_configure_logging, mock_main, mock_valid_args
+    mock_parse_args,
+    mock_configure_logging,
+    mock_main,
+    mock_namespace,
+    expected_main_options,
 ):
     """Positive test: Complete CLI flow with mocked dependencies."""
-    mock_parse_args.return_value = argparse.Namespace(
-        base_path=Path("/test/base"),
-        target_path=Path("/test/target"),
-        db_path=Path("/test/db.sqlite"),
-        log_level="INFO",
-    )
+    mock_parse_args.return_value = mock_namespace
     cli_entry_point()
     mock_parse_args.assert_called_once()
     mock_configure_logging.assert_called_once_with("INFO")
     mock_main.assert_called_once_with(
-        Path("/test/base"), Path("/test/target"), Path("/test/db.sqlite")
+        Path("/test/base"),
+        Path("/test/target"),
+        Path("/test/db.sqlite"),
+        **expected_main_options,
     )
 
 
-@patch("dupehunter.cli.main", side_effect=Exception("Mocked exception"))
+@patch("dupehunter.core.main", side_effect=Exception("Mocked exception"))
 @patch("dupehunter.cli.configure_logging")
 @patch("dupehunter.cli.parse_arguments")
-def test_cli_entry_point_exception(mock_parse_args, mock_configure_logging, mock_main):
+def test_cli_entry_point_exception(
+    mock_parse_args,
+    mock_configure_logging,
+    mock_main,
+    mock_namespace,
+    expected_main_options,
+):
     """Negative test: Simulate an exception in the CLI flow."""
-    mock_parse_args.return_value = argparse.Namespace(
-        base_path=Path("/test/base"),
-        target_path=Path("/test/target"),
-        db_path=Path("/test/db.sqlite"),
-        log_level="INFO",
-    )
+    mock_parse_args.return_value = mock_namespace
     with pytest.raises(Exception, match="Mocked exception"):
         cli_entry_point()
     mock_parse_args.assert_called_once()
     mock_configure_logging.assert_called_once_with("INFO")
     mock_main.assert_called_once_with(
-        Path("/test/base"), Path("/test/target"), Path("/test/db.sqlite")
+        Path("/test/base"),
+        Path("/test/target"),
+        Path("/test/db.sqlite"),
+        **expected_main_options,
     )
@@ -3,7 +3,30 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
-from dupehunter.database import initialize_database, load_catalog
+from dupehunter.catalog import (
+    calculate_storage_savings,
+    find_duplicates,
+    generate_delete_candidates,
+    iter_duplicate_summaries,
+)
+from dupehunter.database import (
+    FILE_COLUMNS_SQL,
+    MIGRATIONS,
+    STORE_FILE_SQL,
+    UPDATE_CHECKSUM_SQL,
+    UPDATE_CONTENT_CHECKSUM_SQL,
+    UPDATE_METADATA_SQL,
+    DatabaseWriter,
+    _gold_id_sql,
+    duplicate_savings,
+    initialize_database,
+    iter_delete_candidates,
+    iter_duplicate_groups,
+    iter_duplicates_without_metadata,
+    iter_file_records,
+    iter_gold_files,
+    load_catalog,
+)
 
 
 @pytest.fixture
@@ -49,6 +72,8 @@ def test_initialize_database_custom_path(mock_connect, tmp_path):
     mock_conn = MagicMock()
     mock_connect.return_value = mock_conn
     mock_conn.cursor.return_value = mock_cursor
+    # The catalog is already at the current schema version
+    mock_cursor.execute.return_value.fetchone.return_value = (len(MIGRATIONS),)
 
     custom_path = tmp_path / "custom_db.db"
     initialize_database(custom_path)
@@ -57,14 +82,24 @@ def test_initialize_database_custom_path(mock_connect, tmp_path):
     mock_connect.assert_called_once_with(custom_path)
 
     # Verify the table creation SQL is executed
-    mock_cursor.execute.assert_called_once_with(
+    mock_cursor.execute.assert_any_call(
         """
         CREATE TABLE IF NOT EXISTS file_info (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file_path TEXT UNIQUE,
-            checksum TEXT,
+            checksum BLOB,
             metadata TEXT,
-            file_size INTEGER
+            file_size INTEGER,
+            partial_checksum BLOB,
+            st_dev INTEGER,
+            st_ino INTEGER,
+            st_mtime_ns INTEGER,
+            perceptual_hash TEXT,
+            exif_datetime_original TEXT,
+            exif_camera_model TEXT,
+            hash_algorithm TEXT,
+            shard TEXT,
+            content_checksum BLOB
         )
         """
     )
@@ -177,19 +212,306 @@ def setup_empty_database(mock_db_path):
 
 def test_load_catalog_success(mock_db_path, setup_database):
     """Positive test: Verify correct data is loaded from the database."""
-    result = load_catalog(mock_db_path)
+    initialize_database(mock_db_path)
+    result = [dict(file) for file in load_catalog(mock_db_path)]
     expected = [
         {
             "file_path": "/path/to/file1.jpg",
             "checksum": "checksum1",
             "metadata": '{"Author": "Alice"}',
             "file_size": 1024,
+            "st_dev": None,
+            "st_ino": None,
+            "shard": None,
+            "content_checksum": None,
+            "exif_datetime_original": None,
+            "exif_camera_model": None,
         },
         {
             "file_path": "/path/to/file2.png",
             "checksum": "checksum2",
             "metadata": '{"Author": "Bob"}',
             "file_size": 2048,
+            "st_dev": None,
+            "st_ino": None,
+            "shard": None,
+            "content_checksum": None,
+            "exif_datetime_original": None,
+            "exif_camera_model": None,
         },
     ]
     assert result == expected
+
+
+def test_initialize_database_adds_missing_columns(mock_db_path, setup_empty_database):
+    """Migration test: Columns added after the initial schema are created."""
+    initialize_database(mock_db_path)
+
+    conn = sqlite3.connect(mock_db_path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(file_info)")}
+    conn.close()
+    assert "partial_checksum" in columns
+
+
+def test_initialize_database_wal_and_indexes(mock_db_path):
+    """Positive test: The catalog uses WAL and indexes checksums."""
+    initialize_database(mock_db_path)
+
+    conn = sqlite3.connect(mock_db_path)
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(file_info)")}
+    conn.close()
+    assert journal_mode == "wal"
+    assert "idx_file_info_checksum" in indexes
+
+
+def test_database_writer_commits_batches(mock_db_path):
+    """Positive test: Queued rows are visible after a flush."""
+    initialize_database(mock_db_path)
+    with DatabaseWriter(mock_db_path, batch_size=2) as writer:
+        writer.write_many(
+            STORE_FILE_SQL,
+            [(f"/path/{n}.jpg", n, 1, n, 0) for n in range(5)],
+        )
+        writer.write(UPDATE_CHECKSUM_SQL, ("checksum0", "sha256", "/path/0.jpg"))
+        writer.flush()
+        catalog = load_catalog(mock_db_path)
+
+    assert len(catalog) == 5
+    assert catalog[0]["checksum"] == "checksum0"
+
+
+def test_database_writer_survives_errors(mock_db_path, caplog):
+    """Exception handling: A failing batch is logged and later rows still land."""
+    initialize_database(mock_db_path)
+    with DatabaseWriter(mock_db_path, batch_size=1) as writer:
+        writer.write("INSERT INTO missing_table VALUES (?)", (1,))
+        writer.write(STORE_FILE_SQL, ("/path/a.jpg", 1, 1, 1, 0))
+
+    assert "Database write error" in caplog.text
+    assert len(load_catalog(mock_db_path)) == 1
+
+
+def test_database_writer_retries_failed_batch_by_row(mock_db_path, caplog):
+    """Exception handling: One bad row does not lose the rest of its batch."""
+    initialize_database(mock_db_path)
+    with DatabaseWriter(mock_db_path, batch_size=100) as writer:
+        writer.write(STORE_FILE_SQL, ("/path/a.jpg", 1, 1, 1, 0))
+        writer.write(STORE_FILE_SQL, ("/path/bad\udcff.jpg", 1, 1, 2, 0))
+        writer.write(STORE_FILE_SQL, ("/path/b.jpg", 1, 1, 3, 0))
+        # Returns rather than hanging, though a row could not be encoded
+        writer.flush()
+        paths = [file["file_path"] for file in load_catalog(mock_db_path)]
+
+    assert paths == ["/path/a.jpg", "/path/b.jpg"]
+    assert "bad\\udcff" in caplog.text
+
+
+@pytest.fixture
+def duplicate_database(mock_db_path):
+    """Fixture for a catalog with two duplicate groups and unique files."""
+    initialize_database(mock_db_path)
+    rows = [
+        ("/a/1.jpg", 10, 1, 1, 0),
+        ("/a/2.jpg", 20, 1, 2, 0),
+        ("/b/1.jpg", 10, 1, 3, 0),
+        ("/a/3.jpg", 30, 1, 4, 0),
+        ("/c/1.jpg", 10, 1, 5, 0),
+        ("/b/2.jpg", 20, 1, 6, 0),
+        ("/a/4.jpg", 40, 1, 7, 0),
+    ]
+    checksums = {
+        "/a/1.jpg": "c1",
+        "/b/1.jpg": "c1",
+        "/c/1.jpg": "c1",
+        "/a/2.jpg": "c2",
+        "/b/2.jpg": "c2",
+        "/a/3.jpg": "c3",
+    }
+    with DatabaseWriter(mock_db_path) as writer:
+        writer.write_many(STORE_FILE_SQL, rows)
+        writer.write_many(
+            UPDATE_CHECKSUM_SQL,
+            [(value, "sha256", key) for key, value in checksums.items()],
+        )
+    return mock_db_path
+
+
+def test_iter_duplicate_groups(duplicate_database):
+    """Positive test: Groups are streamed gold first, singletons omitted."""
+    groups = [
+        [file["file_path"] for file in group]
+        for group in iter_duplicate_groups(duplicate_database)
+    ]
+    assert groups == [["/a/1.jpg", "/b/1.jpg", "/c/1.jpg"], ["/a/2.jpg", "/b/2.jpg"]]
+
+
+def test_sql_analysis_matches_in_memory_catalog(duplicate_database):
+    """Alternative test: SQL queries agree with the in-memory catalog functions."""
+    gold_files, duplicates = find_duplicates(load_catalog(duplicate_database))
+
+    assert sorted(iter_gold_files(duplicate_database), key=str) == sorted(
+        gold_files.values(), key=str
+    )
+    assert sorted(iter_delete_candidates(duplicate_database)) == sorted(
+        generate_delete_candidates(duplicates, gold_files)
+    )
+    assert duplicate_savings(duplicate_database) == calculate_storage_savings(
+        duplicates, gold_files
+    )
+    assert duplicate_savings(duplicate_database) == 40
+
+
+def test_sql_analysis_empty_catalog(mock_db_path):
+    """Negative test: An empty catalog has no groups and no savings."""
+    initialize_database(mock_db_path)
+    assert list(iter_duplicate_groups(mock_db_path)) == []
+    assert list(iter_delete_candidates(mock_db_path)) == []
+    assert duplicate_savings(mock_db_path) == 0
+
+
+def test_gold_copy_is_earliest_photo(duplicate_database, tmp_path):
+    """Positive test: Every gold selection prefers the earliest EXIF date."""
+    metadata = [
+        ("{}", "2010:05:01 10:00:00", "Canon", "/b/1.jpg"),
+        ("{}", "2009:05:01 10:00:00", "Canon", "/c/1.jpg"),
+        ("{}", None, "Canon", "/b/2.jpg"),
+    ]
+    with DatabaseWriter(duplicate_database) as writer:
+        writer.write_many(UPDATE_METADATA_SQL, metadata)
+
+    groups = [
+        [file["file_path"] for file in group]
+        for group in iter_duplicate_groups(duplicate_database)
+    ]
+    assert groups == [["/c/1.jpg", "/b/1.jpg", "/a/1.jpg"], ["/b/2.jpg", "/a/2.jpg"]]
+    golds = {"/c/1.jpg", "/b/2.jpg"}
+    assert {file["file_path"] for file in iter_gold_files(duplicate_database)} == golds
+    assert sorted(iter_delete_candidates(duplicate_database)) == [
+        "/a/1.jpg",
+        "/a/2.jpg",
+        "/b/1.jpg",
+    ]
+    summaries = iter_duplicate_summaries(iter_file_records(duplicate_database))
+    assert {group.gold["file_path"] for group in summaries} == golds
+    spilled = iter_duplicate_summaries(
+        iter_file_records(duplicate_database), memory_budget=1, temp_dir=tmp_path
+    )
+    assert {group.gold["file_path"] for group in spilled} == golds
+    gold_files, _ = find_duplicates(load_catalog(duplicate_database))
+    assert {file["file_path"] for file in gold_files.values()} == golds
+
+
+def test_gold_queries_do_not_sort_the_catalog(duplicate_database):
+    """Positive test: Catalog streams and gold lookups are served by indexes."""
+    conn = sqlite3.connect(duplicate_database)
+    plans = [
+        " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}"))
+        for query in (
+            f"SELECT {FILE_COLUMNS_SQL} FROM file_info ORDER BY rowid",
+            f"""
+            SELECT file_path FROM file_info AS duplicate
+            WHERE checksum IS NOT NULL AND id != {_gold_id_sql("checksum", "duplicate")}
+            """,
+            f"""
+            SELECT id FROM file_info AS duplicate
+            WHERE id = {_gold_id_sql("content_checksum", "duplicate")}
+            """,
+        )
+    ]
+    conn.close()
+    assert not any("TEMP B-TREE" in plan for plan in plans)
+    assert "idx_file_info_checksum_gold" in plans[1]
+    assert "idx_file_info_content_checksum_gold" in plans[2]
+
+
+def test_hardlinks_of_gold_copy_are_not_duplicates(mock_db_path, tmp_path):
+    """Negative test: A gold file and its hardlinks form no duplicate group."""
+    initialize_database(mock_db_path)
+    rows = [
+        ("/a/img1.jpg", 5, 1, 9, 0),
+        ("/b/link1.jpg", 5, 1, 9, 0),
+        ("/a/img2.jpg", 6, 1, 10, 0),
+        ("/b/link2.jpg", 6, 1, 10, 0),
+        ("/c/img2.jpg", 6, 1, 11, 0),
+    ]
+    with DatabaseWriter(mock_db_path) as writer:
+        writer.write_many(STORE_FILE_SQL, rows)
+        writer.write(UPDATE_CHECKSUM_SQL, (b"1", "sha256", "/a/img1.jpg"))
+        writer.write(UPDATE_CHECKSUM_SQL, (b"2", "sha256", "/a/img2.jpg"))
+        writer.write(UPDATE_CHECKSUM_SQL, (b"2", "sha256", "/c/img2.jpg"))
+
+    groups = [
+        [file["file_path"] for file in group]
+        for group in iter_duplicate_groups(mock_db_path)
+    ]
+    assert groups == [["/a/img2.jpg", "/c/img2.jpg"]]
+    golds = [file["file_path"] for file in iter_gold_files(mock_db_path)]
+    assert golds == ["/a/img2.jpg"]
+    assert list(iter_delete_candidates(mock_db_path)) == ["/c/img2.jpg"]
+    (summary,) = iter_duplicate_summaries(
+        iter_file_records(mock_db_path), memory_budget=1, temp_dir=tmp_path
+    )
+    assert [file["file_path"] for file in summary.duplicates] == ["/c/img2.jpg"]
+    gold_files, duplicates = find_duplicates(load_catalog(mock_db_path))
+    assert generate_delete_candidates(duplicates, gold_files) == ["/c/img2.jpg"]
+
+
+def test_duplicates_without_metadata_needs_two_inodes(mock_db_path):
+    """Negative test: Hardlinks of one file are not a group to describe."""
+    initialize_database(mock_db_path)
+    rows = [
+        ("/h/1.jpg", 5, 1, 9, 0),
+        ("/h/2.jpg", 5, 1, 9, 0),
+        ("/e/1.jpg", 6, 1, 10, 0),
+        ("/e/2.jpg", 7, 1, 11, 0),
+    ]
+    with DatabaseWriter(mock_db_path) as writer:
+        writer.write_many(STORE_FILE_SQL, rows)
+        writer.write(UPDATE_CHECKSUM_SQL, (b"h", "sha256", "/h/1.jpg"))
+        for file_path in ("/e/1.jpg", "/e/2.jpg"):
+            writer.write(UPDATE_CONTENT_CHECKSUM_SQL, (b"e", "sha256", file_path))
+
+    assert list(iter_duplicates_without_metadata(mock_db_path)) == []
+    assert sorted(
+        iter_duplicates_without_metadata(mock_db_path, key="content_checksum")
+    ) == [("/e/1.jpg",), ("/e/2.jpg",)]
+
+
+def test_initialize_database_backfills_hash_algorithm(mock_db_path, setup_database):
+    """Migration test: Checksums from before the column are marked as SHA-256."""
+    initialize_database(mock_db_path)
+
+    conn = sqlite3.connect(mock_db_path)
+    algorithms = {
+        row[0] for row in conn.execute("SELECT hash_algorithm FROM file_info")
+    }
+    conn.close()
+    assert algorithms == {"sha256"}
+
+
+def test_initialize_database_migrates_hex_checksums(mock_db_path):
+    """Migration test: Hex checksums of an older catalog become raw digests."""
+    digest = bytes(range(32))
+    conn = sqlite3.connect(mock_db_path)
+    conn.execute(
+        "CREATE TABLE file_info (file_path TEXT UNIQUE, checksum TEXT, "
+        "metadata TEXT, file_size INTEGER, partial_checksum TEXT)"
+    )
+    conn.execute(
+        "INSERT INTO file_info VALUES ('/a.jpg', ?, NULL, 10, ?)",
+        (digest.hex(), digest.hex()),
+    )
+    conn.commit()
+    conn.close()
+
+    initialize_database(mock_db_path)
+    initialize_database(mock_db_path)
+
+    conn = sqlite3.connect(mock_db_path)
+    row = conn.execute("SELECT checksum, partial_checksum FROM file_info").fetchone()
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    conn.close()
+    assert row == (digest, digest)
+    assert version == len(MIGRATIONS)
+    assert load_catalog(mock_db_path)[0]["checksum"] == digest
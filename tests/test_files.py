@@ -0,0 +1,100 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+from dupehunter.files import (
+    calculate_checksum,
+    calculate_content_checksum,
+    extract_metadata,
+    read_exif_segment,
+)
+
+
+@pytest.fixture
+def exif_jpeg(tmp_path):
+    """Fixture for a JPEG with base and Exif sub-IFD tags."""
+    exif = Image.Exif()
+    exif[272] = "Camera X"
+    exif.get_ifd(0x8769)[36867] = "2019:05:05 10:00:00"
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (32, 32), "red").save(path, exif=exif.tobytes())
+    return path
+
+
+def test_read_exif_segment(exif_jpeg):
+    """Positive test: The Exif APP1 payload is returned."""
+    assert read_exif_segment(exif_jpeg).startswith(b"Exif\x00\x00")
+
+
+def test_read_exif_segment_without_exif(tmp_path):
+    """Negative test: JPEGs without Exif and other formats yield nothing."""
+    plain = tmp_path / "plain.jpg"
+    Image.new("RGB", (8, 8)).save(plain)
+    png = tmp_path / "plain.png"
+    Image.new("RGB", (8, 8)).save(png)
+    assert read_exif_segment(plain) == b""
+    assert read_exif_segment(png) == b""
+
+
+def test_extract_metadata_is_json_without_decoding(exif_jpeg):
+    """Positive test: JPEG metadata is parsed from the header as JSON."""
+    with patch("PIL.Image.open") as mock_open:
+        metadata = json.loads(extract_metadata(exif_jpeg))
+    mock_open.assert_not_called()
+    assert metadata["Model"] == "Camera X"
+    assert metadata["DateTimeOriginal"] == "2019:05:05 10:00:00"
+
+
+def test_extract_metadata_other_formats(tmp_path):
+    """Alternative test: Non-JPEG images fall back to Image.open."""
+    exif = Image.Exif()
+    exif[272] = "Scanner"
+    path = tmp_path / "scan.tiff"
+    Image.new("RGB", (8, 8)).save(path, exif=exif.tobytes())
+    assert json.loads(extract_metadata(path))["Model"] == "Scanner"
+
+
+def test_extract_metadata_unreadable_file(tmp_path):
+    """Negative test: Unreadable files yield an empty JSON object."""
+    path = tmp_path / "broken.jpg"
+    path.write_bytes(b"\xff\xd8garbage")
+    assert extract_metadata(path) == "{}"
+
+
+def test_content_checksum_ignores_jpeg_metadata(tmp_path, exif_jpeg):
+    """Positive test: JPEGs differing only in Exif share a content checksum."""
+    exif = Image.Exif()
+    exif[272] = "Geotagger"
+    edited = tmp_path / "edited.jpg"
+    Image.new("RGB", (32, 32), "red").save(edited, exif=exif.tobytes())
+    assert calculate_checksum(edited) != calculate_checksum(exif_jpeg)
+
+    with patch("PIL.Image.open") as mock_open:
+        checksum = calculate_content_checksum(exif_jpeg)
+        assert calculate_content_checksum(edited) == checksum
+    mock_open.assert_not_called()
+
+    other = tmp_path / "other.jpg"
+    Image.new("RGB", (32, 32), "blue").save(other, exif=exif.tobytes())
+    assert calculate_content_checksum(other) != checksum
+
+
+def test_content_checksum_decodes_other_formats(tmp_path):
+    """Alternative test: Other formats are compared on their decoded pixels."""
+    paths = []
+    for comment in ("first", "second"):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Comment", comment)
+        paths.append(tmp_path / f"{comment}.png")
+        Image.new("RGB", (16, 16), "green").save(paths[-1], pnginfo=info)
+    assert calculate_checksum(paths[0]) != calculate_checksum(paths[1])
+    assert calculate_content_checksum(paths[0]) == calculate_content_checksum(paths[1])
+
+
+def test_content_checksum_falls_back_to_file_checksum(tmp_path):
+    """Exception handling: Files that are not images hash their bytes."""
+    path = tmp_path / "broken.jpg"
+    path.write_bytes(b"not an image")
+    assert calculate_content_checksum(path) == calculate_checksum(path)
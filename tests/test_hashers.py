@@ -0,0 +1,54 @@
+import hashlib
+import io
+
+import pytest
+
+from dupehunter.constants import READ_BUFFER_SIZE
+from dupehunter.files import calculate_checksum, calculate_partial_checksum
+from dupehunter.hashers import HASHERS, digest_file, new_hasher
+
+
+@pytest.fixture
+def payload():
+    """Fixture for data spanning several read buffers."""
+    return bytes(range(256)) * (READ_BUFFER_SIZE // 128 + 3)
+
+
+@pytest.mark.parametrize("algorithm", sorted(HASHERS))
+def test_digest_file_matches_one_shot_hash(algorithm, payload):
+    """Positive test: Buffered hashing equals hashing the whole payload."""
+    expected = new_hasher(algorithm)
+    expected.update(payload)
+    assert digest_file(io.BytesIO(payload), algorithm) == expected.hexdigest()
+
+
+@pytest.mark.parametrize("algorithm", sorted(HASHERS))
+def test_calculate_checksum_with_algorithm(algorithm, payload, tmp_path):
+    """Positive test: File checksums use the requested algorithm."""
+    path = tmp_path / "image.jpg"
+    path.write_bytes(payload)
+    checksum = calculate_checksum(path, algorithm)
+    assert checksum == digest_file(io.BytesIO(payload), algorithm)
+    assert calculate_partial_checksum(path, 100, algorithm=algorithm) != checksum
+
+
+def test_sha256_is_default(tmp_path):
+    """Alternative test: SHA-256 stays the default algorithm."""
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"pixels")
+    assert calculate_checksum(path) == hashlib.sha256(b"pixels").hexdigest()
+
+
+def test_xxh128_registered_when_available():
+    """Positive test: The fast hash is offered when xxhash is installed."""
+    pytest.importorskip("xxhash")
+    assert "xxh128" in HASHERS
+
+
+def test_unknown_algorithm(tmp_path):
+    """Negative test: Unknown algorithms are rejected or yield no checksum."""
+    with pytest.raises(ValueError, match="Unknown hash algorithm"):
+        new_hasher("md4")
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"pixels")
+    assert calculate_checksum(path, "md4") == ""
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_delete_candidates,
+)
+from dupehunter.locality import locate, map_in_disk_order
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import traverse_directory
+
+# Device and on-disk position of each test file
+LOCATIONS = {
+    "/disk1/c.jpg": (1, 0, 300),
+    "/disk1/a.jpg": (1, 0, 900),
+    "/disk1/b.jpg": (1, 0, 100),
+    "/disk2/d.jpg": (2, 1, 50),
+    "/disk2/e.jpg": (2, 1, 10),
+}
+
+
+def _map(func, items, readers_per_device, batch_size=4096):
+    async def collect():
+        return [
+            result
+            async for _, result in map_in_disk_order(
+                func, items, readers_per_device, batch_size
+            )
+        ]
+
+    with patch("dupehunter.locality.locate", side_effect=LOCATIONS.get):
+        return asyncio.run(collect())
+
+
+def test_files_read_in_disk_order():
+    """Positive test: One reader per device reads its files by position."""
+    order = []
+    results = _map(order.append, [(path,) for path in LOCATIONS], 1)
+    assert len(results) == 5
+    on_disk1 = [path for path in order if path.startswith("/disk1")]
+    on_disk2 = [path for path in order if path.startswith("/disk2")]
+    assert on_disk1 == ["/disk1/b.jpg", "/disk1/c.jpg", "/disk1/a.jpg"]
+    assert on_disk2 == ["/disk2/e.jpg", "/disk2/d.jpg"]
+
+
+def test_readers_capped_per_device():
+    """Positive test: Devices are read in parallel, each by at most N readers."""
+    lock = threading.Lock()
+    active = {1: 0, 2: 0}
+    peaks = {1: 0, 2: 0, "total": 0}
+
+    def read(file_path):
+        device = LOCATIONS[file_path][0]
+        with lock:
+            active[device] += 1
+            peaks[device] = max(peaks[device], active[device])
+            peaks["total"] = max(peaks["total"], sum(active.values()))
+        time.sleep(0.02)
+        with lock:
+            active[device] -= 1
+
+    _map(read, [(path,) for path in LOCATIONS], 2)
+    assert peaks[1] == peaks[2] == 2
+    assert peaks["total"] == 4
+
+
+def test_locate_falls_back_to_inode(tmp_path):
+    """Alternative test: Without FIEMAP, files are located by inode number."""
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"image")
+    stat_result = path.stat()
+    unsupported = OSError(95, "Operation not supported")
+    with patch("fcntl.ioctl", side_effect=unsupported):
+        assert locate(str(path)) == (stat_result.st_dev, 1, stat_result.st_ino)
+    assert locate(str(tmp_path / "missing.jpg")) == (-1, 1, 0)
+
+
+def test_disk_order_scan_finds_duplicates(tmp_path):
+    """Positive test: Scans in disk order find the same duplicates."""
+    base = tmp_path / "images"
+    base.mkdir()
+    data = os.urandom(100_000)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (base / name).write_bytes(data)
+    (base / "d.jpg").write_bytes(data[:-1] + b"x")
+    db_path = tmp_path / "catalog.db"
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        asyncio.run(traverse_directory(base, db_path, pool, writer, disk_order=1))
+    assert list(iter_delete_candidates(db_path)) == [
+        str(base.resolve() / "b.jpg"),
+        str(base.resolve() / "c.jpg"),
+    ]
+
+
+def test_disk_order_errors():
+    """Exception handling: Worker errors propagate and readers must be positive."""
+
+    def fail(file_path):
+        raise RuntimeError(f"cannot read {file_path}")
+
+    with pytest.raises(RuntimeError, match="cannot read"):
+        _map(fail, [("/disk1/a.jpg",)], 1)
+    with pytest.raises(ValueError, match="at least 1"):
+        _map(fail, [("/disk1/a.jpg",)], 0)
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from dupehunter.database import (
+    DatabaseWriter,
+    duplicate_savings,
+    initialize_database,
+    iter_delete_candidates,
+    load_catalog,
+    set_catalog_info,
+)
+from dupehunter.merge import main, merge_catalog
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import traverse_directory
+
+
+def _scan_shard(base, db_path, shard_id, algorithm="sha256"):
+    initialize_database(db_path)
+    set_catalog_info(db_path, "shard_id", shard_id)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        return asyncio.run(
+            traverse_directory(base, db_path, pool, writer, algorithm, hash_all=True)
+        )
+
+
+@pytest.fixture
+def shards(tmp_path):
+    """Fixture for two shard catalogs sharing one file and a unique file each."""
+    catalogs = []
+    for shard_id, unique in (("node-1", b"one"), ("node-2", b"two" * 10)):
+        base = tmp_path / shard_id
+        base.mkdir()
+        (base / "shared.jpg").write_bytes(b"shared" * 100)
+        (base / "unique.jpg").write_bytes(unique)
+        db_path = tmp_path / f"{shard_id}.db"
+        _scan_shard(base, db_path, shard_id)
+        catalogs.append((base, db_path))
+    return catalogs
+
+
+def test_shard_scan_hashes_every_file(shards):
+    """Positive test: A shard scan hashes files whose size is unique locally."""
+    _, db_path = shards[0]
+    catalog = load_catalog(db_path)
+    assert len(catalog) == 2
+    assert all(file["checksum"] for file in catalog)
+
+
+def test_merge_finds_duplicates_across_shards(tmp_path, shards):
+    """Positive test: Files on different shards form one duplicate group."""
+    merged = tmp_path / "merged.db"
+    for _, db_path in shards:
+        stats = merge_catalog(merged, db_path)
+        assert stats["changed_files"] == 2 and stats["unhashed_files"] == 0
+
+    base_2 = shards[1][0].resolve()
+    assert list(iter_delete_candidates(merged)) == [f"node-2:{base_2}/shared.jpg"]
+    assert duplicate_savings(merged) == 600
+    assert {file["shard"] for file in load_catalog(merged)} == {"node-1", "node-2"}
+
+
+def test_merge_is_incremental(tmp_path, shards):
+    """Positive test: A re-merge writes only changed files and drops removed ones."""
+    merged = tmp_path / "merged.db"
+    for _, db_path in shards:
+        merge_catalog(merged, db_path)
+    base, db_path = shards[1]
+    assert merge_catalog(merged, db_path)["changed_files"] == 0
+
+    (base / "shared.jpg").unlink()
+    (base / "unique.jpg").write_bytes(b"changed")
+    _scan_shard(base, db_path, "node-2")
+    stats = merge_catalog(merged, db_path)
+    assert stats["changed_files"] == 1 and stats["removed_files"] == 1
+    assert list(iter_delete_candidates(merged)) == []
+    assert len(load_catalog(merged)) == 3
+
+
+def test_merge_rejects_mixed_algorithms(tmp_path, shards):
+    """Negative test: Shards hashed with different algorithms are not merged."""
+    merged = tmp_path / "merged.db"
+    merge_catalog(merged, shards[0][1])
+    base, db_path = shards[1]
+    _scan_shard(base, db_path, "node-2", algorithm="blake2b")
+    with pytest.raises(ValueError, match="hash algorithms"):
+        merge_catalog(merged, db_path)
+
+
+def test_main_missing_shard(tmp_path):
+    """Exception handling: A missing shard catalog fails the merge command."""
+    args = ["--db-path", str(tmp_path / "merged.db"), str(tmp_path / "none.db")]
+    assert main(args) == 1
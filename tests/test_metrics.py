@@ -0,0 +1,81 @@
+import json
+import time
+
+from dupehunter.metrics import Histogram, Metrics, MetricsReporter
+
+
+def test_histogram_cumulative_buckets():
+    """Positive test: Values fall into cumulative buckets with an +Inf total."""
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [2, 3, 4]
+    assert histogram.count == 4
+    assert histogram.max == 2.0
+
+
+def test_disabled_metrics_record_nothing():
+    """Alternative test: A disabled instance ignores every update."""
+    metrics = Metrics(enabled=False)
+    with metrics.stage("hash_full", total=10):
+        metrics.increment("files_hashed")
+        metrics.observe("hash_file_seconds", 0.1)
+        metrics.set_gauge("db_queue_depth", 3)
+        metrics.advance()
+    summary = metrics.summary()
+    assert summary["stages"] == {}
+    assert summary["counters"] == {}
+    assert summary["histograms"] == {}
+
+
+def test_stage_progress_and_eta():
+    """Positive test: Progress reports the stage share and an ETA."""
+    metrics = Metrics()
+    with metrics.stage("hash_partial", total=4):
+        metrics.stage_started -= 2
+        metrics.advance(2)
+        metrics.increment("files_seen", 10)
+        line = metrics.progress()
+    assert "hash_partial: 2/4 (50.0%)" in line
+    assert "ETA 0:00:02" in line
+    assert "seen 10" in line
+    assert metrics.stages["hash_partial"] >= 2
+
+
+def test_prometheus_format():
+    """Positive test: Counters, gauges and histograms render as exposition text."""
+    metrics = Metrics()
+    metrics.increment("bytes_read", 4096)
+    metrics.set_gauge("db_queue_depth", 7)
+    metrics.observe("db_commit_seconds", 0.002)
+    text = metrics.prometheus()
+    assert "# TYPE dupehunter_bytes_read_total counter" in text
+    assert "dupehunter_bytes_read_total 4096" in text
+    assert "dupehunter_db_queue_depth 7" in text
+    assert 'dupehunter_db_commit_seconds_bucket{le="0.001"} 0' in text
+    assert 'dupehunter_db_commit_seconds_bucket{le="+Inf"} 1' in text
+    assert "dupehunter_db_commit_seconds_count 1" in text
+
+
+def test_reporter_exports_periodically_and_at_exit(tmp_path):
+    """Positive test: Exports are written during the run and once it ends."""
+    metrics = Metrics()
+    json_path = tmp_path / "metrics.json"
+    prometheus_path = tmp_path / "metrics.prom"
+    with MetricsReporter(metrics, True, json_path, prometheus_path, interval=0.01):
+        metrics.increment("files_seen")
+        deadline = time.monotonic() + 5
+        while not json_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert json_path.exists()
+        metrics.increment("files_seen")
+    assert json.loads(json_path.read_text())["counters"]["files_seen"] == 2
+    assert "dupehunter_files_seen_total 2" in prometheus_path.read_text()
+
+
+def test_reporter_disabled_writes_nothing(tmp_path):
+    """Negative test: No files are written when metrics are disabled."""
+    json_path = tmp_path / "metrics.json"
+    with MetricsReporter(Metrics(enabled=False), json_path=json_path):
+        pass
+    assert not json_path.exists()
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dupehunter.pool import WorkerPool, prefetch
+
+
+def square(value):
+    return value * value
+
+
+def slow_square(value):
+    time.sleep(0.01)
+    return value * value
+
+
+async def collect(pool, func, items):
+    return [result async for result in pool.map(func, items)]
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_map_returns_every_result(kind):
+    """Positive test: Every argument tuple is paired with its result."""
+    with WorkerPool(kind, workers=2, batch_size=3) as pool:
+        results = asyncio.run(collect(pool, square, ((n,) for n in range(20))))
+    assert sorted(results) == [((n,), n * n) for n in range(20)]
+
+
+def test_map_bounds_pending_work():
+    """Alternative test: The input is consumed only as batches complete."""
+    consumed = []
+    lock = threading.Lock()
+
+    def items():
+        for n in range(100):
+            with lock:
+                consumed.append(n)
+            yield (n,)
+
+    async def first_result(pool):
+        async for result in pool.map(slow_square, items()):
+            return result
+
+    with WorkerPool("thread", workers=1, batch_size=2) as pool:
+        asyncio.run(first_result(pool))
+    # Two batches may be pending for the single worker
+    assert len(consumed) <= 2 * 2 + 2
+
+
+@pytest.mark.parametrize("kind, workers", [("fiber", 2), ("thread", 0)])
+def test_invalid_pool_options(kind, workers):
+    """Negative test: Unknown pool types and empty pools are rejected."""
+    with pytest.raises(ValueError):
+        WorkerPool(kind, workers)
+
+
+def test_prefetch_yields_items_in_order():
+    """Positive test: Prefetched items arrive unchanged and in order."""
+    assert list(prefetch(iter(range(1000)), maxsize=10)) == list(range(1000))
+
+
+def test_prefetch_reraises_producer_errors():
+    """Exception handling: Errors in the producer reach the consumer."""
+
+    def items():
+        yield 1
+        raise OSError("disk gone")
+
+    consumed = []
+    with pytest.raises(OSError, match="disk gone"):
+        for item in prefetch(items(), maxsize=2):
+            consumed.append(item)
+    assert consumed == [1]
@@ -0,0 +1,362 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+from dupehunter.constants import PARTIAL_CHECKSUM_SIZE
+from dupehunter.database import (
+    DatabaseWriter,
+    duplicate_savings,
+    initialize_database,
+    iter_delete_candidates,
+    load_catalog,
+)
+from dupehunter.files import calculate_checksum, calculate_partial_checksum
+from dupehunter.metrics import Metrics
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import (
+    catalog_changes,
+    extract_duplicate_metadata,
+    hash_content,
+    hash_perceptually,
+    traverse_directory,
+    walk_files,
+)
+
+
+@pytest.fixture
+def image_tree(tmp_path):
+    """Fixture for a directory with unique, colliding and duplicate files."""
+    base = tmp_path / "images"
+    (base / "nested").mkdir(parents=True)
+    large = 4 * PARTIAL_CHECKSUM_SIZE
+    middle_a = (
+        b"a" * PARTIAL_CHECKSUM_SIZE + b"x" * large + b"z" * PARTIAL_CHECKSUM_SIZE
+    )
+    middle_b = (
+        b"a" * PARTIAL_CHECKSUM_SIZE + b"y" * large + b"z" * PARTIAL_CHECKSUM_SIZE
+    )
+    (base / "unique.jpg").write_bytes(b"u" * 10)
+    (base / "small_a.png").write_bytes(b"s" * 20)
+    (base / "nested" / "small_b.png").write_bytes(b"s" * 20)
+    (base / "small_c.png").write_bytes(b"t" * 20)
+    (base / "large_a.jpg").write_bytes(middle_a)
+    (base / "nested" / "large_b.jpg").write_bytes(middle_a)
+    (base / "large_c.jpg").write_bytes(middle_b)
+    (base / "notes.txt").write_bytes(b"s" * 20)
+    return base
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Fixture for an initialized database path."""
+    path = tmp_path / "catalog.db"
+    initialize_database(path)
+    return path
+
+
+@pytest.fixture
+def pool():
+    """Fixture for a small thread pool that splits work into several batches."""
+    with WorkerPool("thread", workers=2, batch_size=2) as worker_pool:
+        yield worker_pool
+
+
+@pytest.fixture
+def writer(db_path):
+    """Fixture for the database writer of the test catalog."""
+    with DatabaseWriter(db_path, batch_size=3) as db_writer:
+        yield db_writer
+
+
+def test_partial_checksum_equals_full_for_small_files(tmp_path):
+    """Positive test: Files up to two blocks are hashed completely."""
+    file_path = tmp_path / "small.jpg"
+    file_path.write_bytes(b"0123456789" * PARTIAL_CHECKSUM_SIZE)
+    file_path.write_bytes(file_path.read_bytes()[: 2 * PARTIAL_CHECKSUM_SIZE])
+    size = file_path.stat().st_size
+    assert calculate_partial_checksum(file_path, size) == calculate_checksum(file_path)
+
+
+def test_partial_checksum_missing_file(tmp_path):
+    """Negative test: Unreadable files yield an empty checksum."""
+    assert calculate_partial_checksum(tmp_path / "missing.jpg", 10) == ""
+
+
+def test_traverse_directory_hashes_only_collisions(image_tree, db_path, pool, writer):
+    """Positive test: Only files that may have a duplicate get a checksum."""
+    stats = asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+
+    checksums = {
+        row["file_path"].rsplit("/", 1)[-1]: row["checksum"]
+        for row in load_catalog(db_path)
+    }
+    assert "notes.txt" not in checksums
+    assert checksums["unique.jpg"] is None
+    assert checksums["small_a.png"] == checksums["small_b.png"]
+    assert checksums["small_c.png"] not in (None, checksums["small_a.png"])
+    assert checksums["large_a.jpg"] == checksums["large_b.jpg"]
+    large_a = calculate_checksum(image_tree / "large_a.jpg")
+    assert checksums["large_a.jpg"] == bytes.fromhex(large_a)
+    assert checksums["large_c.jpg"] is not None
+
+    assert stats["size_skipped_bytes"] == 10
+    assert stats["partial_skipped_bytes"] == 0
+
+
+def test_traverse_directory_records_metrics(image_tree, db_path):
+    """Positive test: Stages, counters and latencies are recorded."""
+    metrics = Metrics()
+    pool = WorkerPool("thread", workers=2, batch_size=2, metrics=metrics)
+    with pool, DatabaseWriter(db_path, batch_size=3, metrics=metrics) as writer:
+        asyncio.run(
+            traverse_directory(image_tree, db_path, pool, writer, "sha256", metrics)
+        )
+
+    block = PARTIAL_CHECKSUM_SIZE
+    assert list(metrics.stages) == ["catalog", "hash_partial", "hash_full"]
+    assert metrics.counters["files_seen"] == 7
+    assert metrics.counters["files_hashed"] == 6
+    assert metrics.counters["bytes_read"] == 3 * 20 + 3 * 2 * block + 3 * 6 * block
+    assert metrics.histograms["hash_file_ends_seconds"].count == 6
+    assert metrics.histograms["hash_file_seconds"].count == 3
+    assert metrics.histograms["db_commit_seconds"].count > 0
+    assert "db_queue_depth" in metrics.gauges
+
+
+def test_hash_all_hashes_while_walking(image_tree, db_path, pool, writer):
+    """Positive test: With hash_all, hashing starts before the walk ends."""
+    hashing_started = threading.Event()
+
+    def walk_until_hashing(base_path, archives=False):
+        files = list(walk_files(base_path, archives))
+        yield from files[:-1]
+        # The last file is held back until the first ones are being hashed
+        assert hashing_started.wait(5)
+        yield files[-1]
+
+    def checksum(*args):
+        hashing_started.set()
+        return calculate_checksum(*args)
+
+    with patch("dupehunter.processing.walk_files", walk_until_hashing), patch(
+        "dupehunter.processing.calculate_checksum", checksum
+    ):
+        stats = asyncio.run(
+            traverse_directory(image_tree, db_path, pool, writer, hash_all=True)
+        )
+
+    assert stats["stored_files"] == 7
+    assert all(row["checksum"] for row in load_catalog(db_path))
+
+
+def test_traverse_directory_hashes_each_inode_once(tmp_path, db_path):
+    """Positive test: Hardlinks are read once and only count once as savings."""
+    base = tmp_path / "linked"
+    base.mkdir()
+    (base / "a.jpg").write_bytes(b"a" * 100)
+    os.link(base / "a.jpg", base / "a_link.jpg")
+    (base / "b.jpg").write_bytes(b"a" * 100)
+    (base / "c.jpg").write_bytes(b"c" * 50)
+    os.link(base / "c.jpg", base / "c_link.jpg")
+
+    metrics = Metrics()
+    pool = WorkerPool("thread", workers=2, batch_size=2, metrics=metrics)
+    with pool, DatabaseWriter(db_path) as writer:
+        stats = asyncio.run(traverse_directory(base, db_path, pool, writer))
+
+    checksums = {
+        row["file_path"].rsplit("/", 1)[-1]: row["checksum"]
+        for row in load_catalog(db_path)
+    }
+    assert checksums["a.jpg"] == checksums["a_link.jpg"] == checksums["b.jpg"]
+    assert checksums["c.jpg"] is None and checksums["c_link.jpg"] is None
+    assert metrics.histograms["hash_file_ends_seconds"].count == 2
+    assert stats["size_skipped_bytes"] == 50
+    assert duplicate_savings(db_path) == 100
+
+
+def test_traverse_directory_skips_partial_mismatch(image_tree, db_path, pool, writer):
+    """Alternative test: Files whose ends differ are never fully read."""
+    (image_tree / "large_c.jpg").write_bytes(b"b" * (6 * PARTIAL_CHECKSUM_SIZE))
+    stats = asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(
+        "SELECT checksum, partial_checksum FROM file_info WHERE file_path LIKE ?",
+        ("%large_c.jpg",),
+    ).fetchone()
+    conn.close()
+    assert row[0] is None
+    assert row[1] is not None
+    assert stats["partial_skipped_bytes"] == 4 * PARTIAL_CHECKSUM_SIZE
+
+
+def test_rescan_skips_unchanged_files(image_tree, db_path, pool, writer):
+    """Positive test: A second scan neither hashes nor re-reads metadata."""
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    with patch(
+        "dupehunter.processing.calculate_partial_checksum"
+    ) as mock_partial, patch(
+        "dupehunter.processing.calculate_checksum"
+    ) as mock_checksum:
+        stats = asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    mock_partial.assert_not_called()
+    mock_checksum.assert_not_called()
+    assert stats["unchanged_files"] == 7
+    assert stats["removed_files"] == 0
+
+
+def test_rescan_refreshes_changed_and_removes_deleted(
+    image_tree, db_path, pool, writer
+):
+    """Alternative test: Changed files are re-hashed, deleted ones dropped."""
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    (image_tree / "nested" / "small_b.png").unlink()
+    changed = image_tree / "small_c.png"
+    changed.write_bytes(b"s" * 20)
+    os.utime(changed, ns=(0, 0))
+
+    stats = asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+
+    checksums = {
+        row["file_path"].rsplit("/", 1)[-1]: row["checksum"]
+        for row in load_catalog(db_path)
+    }
+    assert "small_b.png" not in checksums
+    assert checksums["small_c.png"] == checksums["small_a.png"]
+    assert stats["unchanged_files"] == 5
+    assert stats["removed_files"] == 1
+
+
+def test_traverse_directory_process_pool(image_tree, db_path, writer):
+    """Alternative test: A process pool produces the same checksums."""
+    with WorkerPool("process", workers=2) as process_pool:
+        asyncio.run(traverse_directory(image_tree, db_path, process_pool, writer))
+
+    checksums = {
+        row["file_path"].rsplit("/", 1)[-1]: row["checksum"]
+        for row in load_catalog(db_path)
+    }
+    assert checksums["large_a.jpg"] == checksums["large_b.jpg"]
+    assert checksums["unique.jpg"] is None
+
+
+def test_hash_perceptually_marks_undecodable_files(image_tree, db_path, pool, writer):
+    """Negative test: Files that are not images are hashed once as empty."""
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    assert asyncio.run(hash_perceptually(db_path, pool, writer)) == 0
+
+    conn = sqlite3.connect(db_path)
+    hashes = {row[0] for row in conn.execute("SELECT perceptual_hash FROM file_info")}
+    conn.close()
+    assert hashes == {""}
+    with patch("dupehunter.processing.calculate_perceptual_hash") as mock_hash:
+        asyncio.run(hash_perceptually(db_path, pool, writer))
+    mock_hash.assert_not_called()
+
+
+def test_hash_content_finds_copies_with_edited_metadata(
+    tmp_path, db_path, pool, writer
+):
+    """Positive test: Content checksums group copies whose Exif was edited."""
+    base = tmp_path / "photos"
+    base.mkdir()
+    for name, camera in (("a.jpg", "Camera X"), ("b.jpg", "Geotagger")):
+        exif = Image.Exif()
+        exif[272] = camera
+        Image.new("RGB", (32, 32), "red").save(base / name, exif=exif.tobytes())
+    Image.new("RGB", (32, 32), "blue").save(base / "c.jpg")
+
+    asyncio.run(traverse_directory(base, db_path, pool, writer))
+    assert list(iter_delete_candidates(db_path)) == []
+    assert asyncio.run(hash_content(db_path, pool, writer)) == 3
+    candidates = list(iter_delete_candidates(db_path, "content_checksum"))
+    assert candidates == [str(base.resolve() / "b.jpg")]
+    with pytest.raises(ValueError, match="Cannot group"):
+        duplicate_savings(db_path, "file_path")
+
+
+def test_metadata_is_read_for_duplicates_only(image_tree, db_path, pool, writer):
+    """Positive test: Only members of duplicate groups get metadata."""
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    assert asyncio.run(extract_duplicate_metadata(db_path, pool, writer)) == 4
+
+    conn = sqlite3.connect(db_path)
+    described = {
+        row[0].rsplit("/", 1)[-1]
+        for row in conn.execute(
+            "SELECT file_path FROM file_info WHERE metadata IS NOT NULL"
+        )
+    }
+    conn.close()
+    assert described == {"small_a.png", "small_b.png", "large_a.jpg", "large_b.jpg"}
+    assert asyncio.run(extract_duplicate_metadata(db_path, pool, writer)) == 0
+
+
+def test_rescan_with_other_algorithm_rehashes(image_tree, db_path, pool, writer):
+    """Alternative test: Checksums of another algorithm are never kept."""
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer))
+    asyncio.run(traverse_directory(image_tree, db_path, pool, writer, "blake2b"))
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT checksum, hash_algorithm FROM file_info WHERE checksum IS NOT NULL"
+    ).fetchall()
+    conn.close()
+    assert rows
+    assert {algorithm for _, algorithm in rows} == {"blake2b"}
+    assert {len(checksum) for checksum, _ in rows} == {64}
+
+
+def test_walk_files_yields_paths_in_string_order(tmp_path):
+    """Positive test: The walk order matches SQLite's path ordering."""
+    for name in ["a/x.jpg", "a.jpg", "a-b.png", "a/b/y.gif", "b.JPG", "c.txt"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"x")
+    (tmp_path / "link.jpg").symlink_to(tmp_path / "a.jpg")
+
+    paths = [file_path for file_path, _ in walk_files(tmp_path)]
+    relative = [path[len(str(tmp_path)) + 1 :] for path in paths]
+    assert relative == ["a-b.png", "a.jpg", "a/b/y.gif", "a/x.jpg", "b.JPG"]
+    assert paths == sorted(paths)
+
+
+def test_walk_files_skips_undecodable_names(tmp_path, caplog):
+    """Negative test: Names that are not valid UTF-8 are skipped with a warning."""
+    (tmp_path / "good.jpg").write_bytes(b"x")
+    with open(os.path.join(os.fsencode(tmp_path), b"bad\xff.jpg"), "wb") as file:
+        file.write(b"x")
+
+    paths = [file_path for file_path, _ in walk_files(tmp_path)]
+    assert paths == [str(tmp_path / "good.jpg")]
+    assert "not valid UTF-8" in caplog.text
+
+
+def test_catalog_changes_merges_sorted_streams(tmp_path):
+    """Positive test: New, changed, unchanged and deleted files are told apart."""
+    stat_result = os.stat(tmp_path)
+    signature = (
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+    walked = [("/b.jpg", stat_result), ("/c.jpg", stat_result), ("/e.jpg", stat_result)]
+    stored = [
+        ("/a.jpg",) + signature,
+        ("/b.jpg",) + signature,
+        ("/c.jpg", 0, 0, 0, 0),
+        ("/d.jpg",) + signature,
+    ]
+    writer = MagicMock()
+
+    stats = catalog_changes(walked, stored, writer)
+
+    assert stats == {"stored_files": 2, "unchanged_files": 1, "removed_files": 2}
+    written = [call.args for call in writer.write.call_args_list]
+    assert [row[1][0] for row in written] == ["/a.jpg", "/c.jpg", "/d.jpg", "/e.jpg"]
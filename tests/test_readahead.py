@@ -0,0 +1,82 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_delete_candidates,
+)
+from dupehunter.files import calculate_checksum
+from dupehunter.metrics import Metrics
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import traverse_directory
+from dupehunter.readahead import read_ahead_hashes
+
+
+async def _collect(items, algorithm="sha256", files_in_flight=3, **kwargs):
+    return [
+        row
+        async for row in read_ahead_hashes(items, algorithm, files_in_flight, **kwargs)
+    ]
+
+
+@pytest.fixture
+def files(tmp_path):
+    """Fixture for files from empty to several read chunks long."""
+    paths = []
+    for n, size in enumerate((0, 1, 4096, 10 * 4096 + 7, 3 * 4096)):
+        path = tmp_path / f"{n}.jpg"
+        path.write_bytes(os.urandom(size))
+        paths.append((str(path), size))
+    return paths
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+def test_read_ahead_matches_checksum(files, algorithm):
+    """Positive test: Read-ahead digests equal the synchronous checksums."""
+    rows = asyncio.run(_collect(files, algorithm, chunk_size=4096))
+    assert sorted(path for _, path, _ in rows) == sorted(path for path, _ in files)
+    for checksum, path, _ in rows:
+        assert checksum.hex() == calculate_checksum(path, algorithm)
+
+
+def test_read_ahead_bounds_files_in_flight(files):
+    """Positive test: No more than the configured number of files are open."""
+    metrics = Metrics()
+    gauges = []
+    with patch.object(
+        metrics, "set_gauge", side_effect=lambda name, value: gauges.append(value)
+    ), patch("dupehunter.readahead.os.posix_fadvise", create=True) as fadvise:
+        asyncio.run(_collect(files, files_in_flight=2, metrics=metrics))
+    assert gauges and max(gauges) == 2
+    assert fadvise.called
+
+
+def test_read_ahead_missing_file(tmp_path):
+    """Exception handling: Unreadable files yield an empty checksum."""
+    missing = str(tmp_path / "missing.jpg")
+    assert asyncio.run(_collect([(missing, 10)])) == [(b"", missing, 10)]
+
+
+def test_read_ahead_rejects_zero_files_in_flight():
+    """Negative test: At least one file must be in flight."""
+    with pytest.raises(ValueError):
+        asyncio.run(_collect([], files_in_flight=0))
+
+
+def test_traverse_directory_with_read_ahead(tmp_path, files):
+    """Alternative test: The full-hash stage can run through the reader."""
+    duplicate = tmp_path / "copy.jpg"
+    duplicate.write_bytes((tmp_path / "3.jpg").read_bytes())
+    db_path = tmp_path / "catalog.db"
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        with patch("dupehunter.processing.hash_file") as hash_file:
+            asyncio.run(
+                traverse_directory(tmp_path, db_path, pool, writer, read_ahead=4)
+            )
+    hash_file.assert_not_called()
+    assert list(iter_delete_candidates(db_path)) == [str(duplicate)]
@@ -0,0 +1,128 @@
+import csv
+import json
+import tracemalloc
+
+import pytest
+
+from dupehunter.catalog import FileRecord
+from dupehunter.reports import write_delete_candidates, write_files_to_copy
+
+CHECKSUM = bytes.fromhex("ab" * 32)
+
+
+def _file(file_path, size=10):
+    return FileRecord(file_path, CHECKSUM, None, size, 1, hash(file_path), None, None)
+
+
+@pytest.fixture
+def groups():
+    """Fixture for two duplicate groups, gold copy first."""
+    return [
+        [_file("/images/a.jpg"), _file("/images/copy of a.jpg")],
+        [_file("/images/b.jpg", 20), _file("/images/b2.jpg", 20), _file("/b3.jpg", 20)],
+    ]
+
+
+@pytest.fixture
+def entries():
+    """Fixture for copy plan entries."""
+    return [
+        {
+            "source": "/images/a.jpg",
+            "target": "/out/a.jpg",
+            "checksum": CHECKSUM,
+            "file_size": 10,
+        }
+    ]
+
+
+def test_delete_candidates_text(tmp_path, groups):
+    """Positive test: Text reports list one path per line."""
+    path = tmp_path / "delete.txt"
+    assert write_delete_candidates(groups, path) == 3
+    assert path.read_text() == "/images/copy of a.jpg\n/images/b2.jpg\n/b3.jpg"
+
+
+def test_delete_candidates_nul(tmp_path, groups):
+    """Positive test: NUL-separated reports keep paths with any character."""
+    path = tmp_path / "delete.nul"
+    write_delete_candidates(groups, path, "nul")
+    assert path.read_text().split("\0") == [
+        "/images/copy of a.jpg",
+        "/images/b2.jpg",
+        "/b3.jpg",
+        "",
+    ]
+
+
+def test_delete_candidates_jsonl(tmp_path, groups):
+    """Positive test: JSONL reports hold each group with its gold copy."""
+    path = tmp_path / "delete.jsonl"
+    write_delete_candidates(groups, path, "jsonl")
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines[1] == {
+        "checksum": CHECKSUM.hex(),
+        "file_size": 20,
+        "gold": "/images/b.jpg",
+        "duplicates": ["/images/b2.jpg", "/b3.jpg"],
+    }
+
+
+def test_delete_candidates_csv(tmp_path, groups):
+    """Positive test: CSV reports have a row per duplicate with its gold copy."""
+    path = tmp_path / "delete.csv"
+    write_delete_candidates(groups, path, "csv")
+    with path.open(newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0] == {
+        "file_path": "/images/copy of a.jpg",
+        "gold_path": "/images/a.jpg",
+        "checksum": CHECKSUM.hex(),
+        "file_size": "10",
+    }
+    assert len(rows) == 3
+
+
+@pytest.mark.parametrize(
+    "report_format, expected",
+    [
+        ("text", "/images/a.jpg -> /out/a.jpg\n"),
+        ("nul", "/images/a.jpg\0/out/a.jpg\0"),
+        (
+            "csv",
+            f"source,target,checksum,file_size\r\n"
+            f"/images/a.jpg,/out/a.jpg,{CHECKSUM.hex()},10\r\n",
+        ),
+    ],
+)
+def test_files_to_copy_formats(tmp_path, entries, report_format, expected):
+    """Positive test: Copy plans in each line-based format."""
+    path = tmp_path / "copy"
+    assert write_files_to_copy(entries, path, report_format) == 1
+    assert path.read_bytes().decode() == expected
+
+
+def test_files_to_copy_jsonl(tmp_path, entries):
+    """Alternative test: JSONL copy plans hold checksums as hex."""
+    path = tmp_path / "copy.jsonl"
+    write_files_to_copy(entries, path, "jsonl")
+    assert json.loads(path.read_text()) == {**entries[0], "checksum": CHECKSUM.hex()}
+
+
+def test_delete_candidates_constant_memory(tmp_path):
+    """Positive test: Reports are streamed, whatever their length."""
+    groups = ([_file(f"/g/{n}.jpg"), _file(f"/d/{n}.jpg")] for n in range(50_000))
+    tracemalloc.start()
+    try:
+        write_delete_candidates(groups, tmp_path / "delete.nul", "nul")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 * 1024
+
+
+def test_unknown_report_format(tmp_path, groups):
+    """Negative test: Unknown formats are rejected before anything is written."""
+    with pytest.raises(ValueError, match="Unknown report format"):
+        write_delete_candidates(groups, tmp_path / "delete.xml", "xml")
+    assert not (tmp_path / "delete.xml").exists()
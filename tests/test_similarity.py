@@ -0,0 +1,76 @@
+import random
+
+import pytest
+from PIL import Image
+
+from dupehunter.files import calculate_perceptual_hash
+from dupehunter.similarity import BKTree, find_near_duplicates, hamming_distance
+
+
+@pytest.fixture
+def gradient_image(tmp_path):
+    """Fixture for a JPEG with structure that survives resizing."""
+    img = Image.new("RGB", (256, 192))
+    img.putdata(
+        [
+            ((x * 7) % 256, (y * 3) % 256, (x * y) % 256)
+            for y in range(192)
+            for x in range(256)
+        ]
+    )
+    path = tmp_path / "original.jpg"
+    img.save(path, quality=95)
+    return path
+
+
+def test_bk_tree_search_matches_brute_force():
+    """Positive test: The index returns exactly the hashes within range."""
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for value in values:
+        tree.add(value)
+
+    query = values[0] ^ 0b1011
+    expected = sorted(v for v in set(values) if hamming_distance(query, v) <= 10)
+    assert sorted(tree.search(query, 10)) == expected
+    assert tree.size == len(set(values))
+
+
+def test_bk_tree_empty_search():
+    """Negative test: Searching an empty tree finds nothing."""
+    assert BKTree().search(0, 64) == []
+
+
+def test_find_near_duplicates_clusters_transitively():
+    """Positive test: Chains of close hashes form a single cluster."""
+    hashes = [
+        ("/a.jpg", f"{0b0000:016x}"),
+        ("/b.jpg", f"{0b0011:016x}"),
+        ("/c.jpg", f"{0b1111:016x}"),
+        ("/d.jpg", f"{0b0000:016x}"),
+        ("/far.jpg", f"{2**64 - 1:016x}"),
+        ("/broken.jpg", ""),
+    ]
+    assert find_near_duplicates(hashes, max_distance=2) == [
+        ["/a.jpg", "/b.jpg", "/c.jpg", "/d.jpg"]
+    ]
+    assert find_near_duplicates(hashes, max_distance=0) == [["/a.jpg", "/d.jpg"]]
+
+
+def test_perceptual_hash_survives_resize_and_reencode(gradient_image, tmp_path):
+    """Positive test: A smaller, recompressed copy has a nearby hash."""
+    copy_path = tmp_path / "copy.png"
+    with Image.open(gradient_image) as img:
+        img.resize((128, 96)).save(copy_path)
+
+    original = int(calculate_perceptual_hash(gradient_image), 16)
+    copy = int(calculate_perceptual_hash(copy_path), 16)
+    assert hamming_distance(original, copy) <= 4
+
+
+def test_perceptual_hash_unreadable_image(tmp_path):
+    """Negative test: Files that are not images yield an empty hash."""
+    path = tmp_path / "broken.jpg"
+    path.write_bytes(b"not an image")
+    assert calculate_perceptual_hash(path) == ""
@@ -0,0 +1,197 @@
+import asyncio
+import math
+import os
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from dupehunter.database import (
+    STORE_FILE_SQL,
+    DatabaseWriter,
+    initialize_database,
+    iter_delete_candidates,
+    load_catalog,
+)
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import hash_file_ends, traverse_directory
+from dupehunter.watch import DirectoryWatcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Fixture for a scanned tree, with its catalog, pool and writer."""
+    base_path = tmp_path / "images"
+    (base_path / "album").mkdir(parents=True)
+    (base_path / "album" / "a.jpg").write_bytes(b"a" * 100)
+    (base_path / "b.jpg").write_bytes(b"b" * 100)
+    db_path = tmp_path / "catalog.db"
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        asyncio.run(traverse_directory(base_path, db_path, pool, writer))
+        yield base_path.resolve(), db_path, pool, writer
+
+
+def _settle(watcher, pool, writer):
+    watcher.read_events()
+    return asyncio.run(watcher.settle(pool, writer, now=math.inf))
+
+
+def _checksums(db_path):
+    return {file["file_path"]: file["checksum"] for file in load_catalog(db_path)}
+
+
+def test_watch_catalogs_new_duplicates(tree):
+    """Positive test: New files are hashed and reported as duplicates."""
+    base_path, db_path, pool, writer = tree
+    with DirectoryWatcher(base_path, db_path) as watcher:
+        (base_path / "c.jpg").write_bytes(b"b" * 100)
+        (base_path / "notes.txt").write_text("not an image")
+        with patch("dupehunter.watch.logging.info") as log_info:
+            stats = _settle(watcher, pool, writer)
+    assert stats["stored_files"] == 1
+    assert stats["new_duplicates"] == 1
+    log_info.assert_called_once_with(
+        f"New duplicate: {base_path / 'c.jpg'} duplicates {base_path / 'b.jpg'}"
+    )
+    assert list(iter_delete_candidates(db_path)) == [str(base_path / "c.jpg")]
+
+
+def test_watch_records_renames_without_hashing(tree):
+    """Positive test: Renamed files and directories keep their checksums."""
+    base_path, db_path, pool, writer = tree
+    (base_path / "copy.jpg").write_bytes(b"b" * 100)
+    asyncio.run(traverse_directory(base_path, db_path, pool, writer))
+    before = _checksums(db_path)
+    with DirectoryWatcher(base_path, db_path) as watcher:
+        os.rename(base_path / "copy.jpg", base_path / "renamed.jpg")
+        os.rename(base_path / "album", base_path / "trip")
+        with patch("dupehunter.processing.hash_file") as hash_file, patch(
+            "dupehunter.processing.hash_file_ends"
+        ) as hash_file_ends:
+            stats = _settle(watcher, pool, writer)
+    hash_file.assert_not_called()
+    hash_file_ends.assert_not_called()
+    assert stats["stored_files"] == 0
+    assert stats["unchanged_files"] == 1
+    assert _checksums(db_path) == {
+        str(base_path / "b.jpg"): before[str(base_path / "b.jpg")],
+        str(base_path / "renamed.jpg"): before[str(base_path / "copy.jpg")],
+        str(base_path / "trip" / "a.jpg"): before[str(base_path / "album" / "a.jpg")],
+    }
+
+
+def test_watch_follows_new_and_moved_directories(tree):
+    """Positive test: Files in created and renamed directories are watched."""
+    base_path, db_path, pool, writer = tree
+    with DirectoryWatcher(base_path, db_path) as watcher:
+        os.rename(base_path / "album", base_path / "trip")
+        (base_path / "new").mkdir()
+        watcher.read_events()
+        (base_path / "trip" / "c.jpg").write_bytes(b"c" * 10)
+        (base_path / "new" / "d.jpg").write_bytes(b"d" * 10)
+        stats = _settle(watcher, pool, writer)
+    assert stats["stored_files"] == 2
+    assert set(_checksums(db_path)) == {
+        str(base_path / name)
+        for name in ("b.jpg", "trip/a.jpg", "trip/c.jpg", "new/d.jpg")
+    }
+
+
+def test_watch_hashes_only_sizes_of_changed_files(tree):
+    """Positive test: Settling reads no file of a size that did not change."""
+    base_path, db_path, pool, writer = tree
+    # An unrelated size collision the initial scan left unhashed
+    other = [(f"/elsewhere/{n}.jpg", 7, 1, n, 0) for n in (1, 2)]
+    writer.write_many(STORE_FILE_SQL, other)
+    read = []
+
+    def recording_hash_file_ends(file_path, *args):
+        read.append(file_path)
+        return hash_file_ends(file_path, *args)
+
+    with DirectoryWatcher(base_path, db_path) as watcher, patch(
+        "dupehunter.processing.hash_file_ends", recording_hash_file_ends
+    ):
+        (base_path / "c.jpg").write_bytes(b"b" * 100)
+        stats = _settle(watcher, pool, writer)
+    assert stats["new_duplicates"] == 1
+    assert read == [str(base_path / "c.jpg")]
+
+
+def test_watch_rescan_keeps_scan_options(tree):
+    """Alternative test: A rescan after missed events uses the scan's options."""
+    base_path, db_path, pool, writer = tree
+    watcher = DirectoryWatcher(
+        base_path, db_path, read_ahead=4, archives=True, disk_order=2
+    )
+    with watcher, patch(
+        "dupehunter.watch.traverse_directory", new_callable=AsyncMock
+    ) as rescan:
+        watcher.rescan = True
+        asyncio.run(watcher.settle(pool, writer, now=math.inf))
+    assert rescan.call_args.args[7:] == (4, False, True, 2)
+
+
+def test_watch_removes_deleted_and_moved_out_files(tree, tmp_path):
+    """Positive test: Deleted files and directories moved away are dropped."""
+    base_path, db_path, pool, writer = tree
+    with DirectoryWatcher(base_path, db_path) as watcher:
+        (base_path / "b.jpg").unlink()
+        os.rename(base_path / "album", tmp_path / "album")
+        stats = _settle(watcher, pool, writer)
+    assert stats["removed_files"] == 1
+    assert _checksums(db_path) == {}
+
+
+def test_watch_debounces_files_being_written(tree):
+    """Alternative test: A file is only catalogued once it has settled."""
+    base_path, db_path, pool, writer = tree
+    with DirectoryWatcher(base_path, db_path, debounce=60) as watcher:
+        assert watcher.read_events() == 0
+        assert watcher.next_deadline() is None
+        with (base_path / "c.jpg").open("wb") as f:
+            f.write(b"partial")
+            f.flush()
+            watcher.read_events(now=0)
+            f.write(b" and the rest")
+        watcher.read_events(now=30)
+        stats = asyncio.run(watcher.settle(pool, writer, now=60))
+        assert stats["stored_files"] == 0
+        assert watcher.next_deadline() == 90
+        stats = asyncio.run(watcher.settle(pool, writer, now=90))
+    assert stats["stored_files"] == 1
+    assert str(base_path / "c.jpg") in _checksums(db_path)
+
+
+def test_watch_run_until_cancelled(tree):
+    """Positive test: The watch loop catalogs changes as they happen."""
+    base_path, db_path, pool, writer = tree
+
+    async def watch_for_duplicate(watcher):
+        task = asyncio.ensure_future(watcher.run(pool, writer))
+        await asyncio.sleep(0.05)
+        (base_path / "c.jpg").write_bytes(b"b" * 100)
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if list(iter_delete_candidates(db_path)):
+                break
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with DirectoryWatcher(base_path, db_path, debounce=0.05) as watcher:
+        asyncio.run(watch_for_duplicate(watcher))
+    assert list(iter_delete_candidates(db_path)) == [str(base_path / "c.jpg")]
+
+
+def test_watch_unavailable():
+    """Exception handling: Watching fails clearly without inotify."""
+    with patch("dupehunter.watch.sys.platform", "darwin"):
+        with pytest.raises(OSError, match="inotify"):
+            DirectoryWatcher(Path("."), Path("catalog.db"))
@@ -0,0 +1,107 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+from dupehunter.database import (
+    DatabaseWriter,
+    initialize_database,
+    iter_delete_candidates,
+)
+from dupehunter.files import calculate_checksum
+from dupehunter.hashers import digest_file
+from dupehunter.pool import WorkerPool
+from dupehunter.processing import traverse_directory
+from dupehunter.xattrs import read_cached_checksum, write_cached_checksum
+
+OLD_MTIME_NS = 1_600_000_000 * 10**9
+
+
+def _supports_xattrs(path):
+    try:
+        os.setxattr(path, "user.dupehunter.test", b"")
+        os.removexattr(path, "user.dupehunter.test")
+    except (AttributeError, OSError):
+        return False
+    return True
+
+
+@pytest.fixture
+def image(tmp_path):
+    """Fixture for a file last modified long ago, on a filesystem with xattrs."""
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"image data" * 2000)
+    os.utime(path, ns=(OLD_MTIME_NS, OLD_MTIME_NS))
+    if not _supports_xattrs(path):
+        pytest.skip("The temporary directory does not support extended attributes")
+    return path
+
+
+def test_checksum_cached_and_reused(image):
+    """Positive test: A cached checksum is returned without opening the file."""
+    checksum = calculate_checksum(image, xattr_cache=True)
+    assert checksum == calculate_checksum(image)
+    assert os.getxattr(image, "user.dupehunter.sha256") == (
+        f"{image.stat().st_size}:{OLD_MTIME_NS}:{checksum}".encode()
+    )
+    with patch("builtins.open", side_effect=AssertionError("file was opened")):
+        assert calculate_checksum(image, xattr_cache=True) == checksum
+
+
+def test_checksum_cache_survives_moves(image, tmp_path):
+    """Positive test: Moved files are not read again with a new catalog."""
+    checksum = calculate_checksum(image, "blake2b", xattr_cache=True)
+    moved = tmp_path / "archive" / "moved.jpg"
+    moved.parent.mkdir()
+    os.rename(image, moved)
+    (tmp_path / "archive" / "copy.jpg").write_bytes(moved.read_bytes())
+    db_path = tmp_path / "new_catalog.db"
+    initialize_database(db_path)
+    with WorkerPool("thread", 2) as pool, DatabaseWriter(db_path) as writer:
+        with patch("dupehunter.xattrs.os.setxattr") as setxattr, patch(
+            "dupehunter.files.digest_file", wraps=digest_file
+        ) as digest:
+            asyncio.run(
+                traverse_directory(
+                    tmp_path / "archive",
+                    db_path,
+                    pool,
+                    writer,
+                    "blake2b",
+                    xattr_cache=True,
+                )
+            )
+    # Only the new copy was read; it is too recent to be cached
+    assert digest.call_count == 1
+    setxattr.assert_not_called()
+    assert read_cached_checksum(moved, "blake2b") == checksum
+    assert list(iter_delete_candidates(db_path)) == [
+        str((tmp_path / "archive" / "moved.jpg").resolve())
+    ]
+
+
+def test_checksum_cache_invalidated_by_changes(image):
+    """Negative test: A modified file's cached checksum is not used."""
+    calculate_checksum(image, xattr_cache=True)
+    image.write_bytes(b"edited")
+    os.utime(image, ns=(OLD_MTIME_NS + 1, OLD_MTIME_NS + 1))
+    assert read_cached_checksum(image, "sha256") == ""
+    assert calculate_checksum(image, xattr_cache=True) == calculate_checksum(image)
+
+
+def test_checksum_cache_skips_recent_files(image):
+    """Alternative test: Files modified within the last seconds are not cached."""
+    os.utime(image)
+    calculate_checksum(image, xattr_cache=True)
+    assert read_cached_checksum(image, "sha256") == ""
+
+
+def test_checksum_cache_without_xattr_support(image):
+    """Exception handling: Filesystems without xattrs fall back to hashing."""
+    unsupported = OSError(95, "Operation not supported")
+    with patch("dupehunter.xattrs.os.getxattr", side_effect=unsupported), patch(
+        "dupehunter.xattrs.os.setxattr", side_effect=unsupported
+    ):
+        assert calculate_checksum(image, xattr_cache=True) == calculate_checksum(image)
+        assert not write_cached_checksum(image, "sha256", "00", image.stat())